@@ -0,0 +1,533 @@
+#!/usr/bin/env python3
+"""
+Webhook load test for discuss_hub.
+
+Drives /discuss_hub/connector/<uuid> with generated Evolution payloads at a
+controlled concurrency and prints a JSON report (throughput, latency
+percentiles, SQL queries per event and peak RSS of the Odoo processes).
+
+A local provider stub answers the outbound calls Odoo makes (Evolution
+/message/*, /chat/* and WhatsApp Cloud /messages/ and /media/), so point the
+connector url at it, e.g. `--stub-port 8899` and connector url
+http://localhost:8899.
+
+Only the standard library is used so it runs anywhere Odoo is reachable:
+
+    python3 benchmarks/webhook_bench.py \\
+        --url http://localhost:8069 --uuid <connector uuid> \\
+        --events 2000 --concurrency 8 --mix text=70,image=10,reaction=10,receipt=10 \\
+        --media-kb 256 --odoo-log /var/log/odoo/odoo.log --odoo-pid <pid> \\
+        --output report.json
+"""
+
+import argparse
+import base64
+import json
+import os
+import random
+import re
+import statistics
+import string
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+EVENT_TYPES = ["text", "image", "document", "reaction", "receipt", "delete", "contacts"]
+DEFAULT_MIX = "text=70,image=10,reaction=10,receipt=10"
+
+# werkzeug access line written by Odoo:
+# "POST /discuss_hub/connector/<uuid> HTTP/1.1" 200 - <queries> <sql time> <other>
+ODOO_ACCESS_LINE = re.compile(
+    r'"POST /discuss_hub/connector/(?P<uuid>[0-9a-f-]+) HTTP/[0-9.]+" '
+    r"(?P<status>\d{3}) - (?P<queries>\d+) (?P<sql_time>[0-9.]+) "
+    r"(?P<other_time>[0-9.]+)"
+)
+
+
+#
+# Provider stub
+#
+
+
+class ProviderStubHandler(BaseHTTPRequestHandler):
+    """Answers Evolution and WhatsApp Cloud outbound calls with canned data"""
+
+    protocol_version = "HTTP/1.1"
+    server_version = "DiscussHubProviderStub/1.0"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, payload, status=200):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def do_GET(self):
+        self.server.count(self.path)
+        if "/instance/connect/" in self.path:
+            return self._reply({"instance": {"state": "open"}})
+        if self.path.startswith("/media/"):
+            return self._reply({"data": base64.b64encode(b"stub").decode()})
+        return self._reply({})
+
+    def do_POST(self):
+        self._read_body()
+        self.server.count(self.path)
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        message_id = uuid.uuid4().hex.upper()[:20]
+        if "/message/" in self.path:
+            # Evolution sendText / sendMedia / sendReaction
+            return self._reply(
+                {"key": {"id": message_id, "fromMe": True}, "status": "PENDING"},
+                status=201,
+            )
+        if "/chat/fetchProfilePictureUrl/" in self.path:
+            return self._reply({"profilePictureUrl": None})
+        if "/chat/" in self.path:
+            return self._reply([])
+        if self.path.rstrip("/").endswith("/media"):
+            # WhatsApp Cloud media upload
+            return self._reply({"id": message_id})
+        if self.path.rstrip("/").endswith("/messages"):
+            # WhatsApp Cloud send
+            return self._reply(
+                {
+                    "messaging_product": "whatsapp",
+                    "messages": [{"id": f"wamid.{message_id}"}],
+                }
+            )
+        return self._reply({})
+
+
+class ProviderStub(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port, latency=0.0):
+        super().__init__(("0.0.0.0", port), ProviderStubHandler)
+        self.latency = latency
+        self.calls = {}
+        self._lock = threading.Lock()
+
+    def count(self, path):
+        # group calls by endpoint, not by instance name
+        endpoint = "/".join(path.split("?")[0].split("/")[:3])
+        with self._lock:
+            self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+
+#
+# Payload generator
+#
+
+
+class PayloadGenerator:
+    """
+    Builds Evolution webhook payloads. Message ids are remembered so
+    reactions, receipts and deletes point to messages already sent.
+    """
+
+    def __init__(self, instance, contacts=50, media_kb=64, burst=20, seed=None):
+        self.instance = instance
+        self.random = random.Random(seed)
+        self.remote_jids = [f"55119{n:08d}@s.whatsapp.net" for n in range(contacts)]
+        self.media_base64 = base64.b64encode(
+            self.random.randbytes(media_kb * 1024)
+        ).decode()
+        self.burst = burst
+        self.sent_ids = []
+        self._lock = threading.Lock()
+
+    def _message_id(self):
+        return "BENCH" + "".join(
+            self.random.choices(string.ascii_uppercase + string.digits, k=15)
+        )
+
+    def _remember(self, remote_jid, message_id):
+        with self._lock:
+            self.sent_ids.append((remote_jid, message_id))
+            if len(self.sent_ids) > 10000:
+                del self.sent_ids[:5000]
+
+    def _previous(self):
+        with self._lock:
+            if self.sent_ids:
+                return self.random.choice(self.sent_ids)
+        return None
+
+    def _upsert(self, remote_jid, message, message_type):
+        message_id = self._message_id()
+        self._remember(remote_jid, message_id)
+        return {
+            "event": "messages.upsert",
+            "instance": self.instance,
+            "data": {
+                "key": {"remoteJid": remote_jid, "fromMe": False, "id": message_id},
+                "pushName": f"Bench {remote_jid[5:13]}",
+                "message": message,
+                "messageType": message_type,
+                "messageTimestamp": int(time.time()),
+            },
+        }
+
+    def text(self, remote_jid):
+        words = self.random.randint(3, 40)
+        body = " ".join(
+            "".join(self.random.choices(string.ascii_lowercase, k=6))
+            for _ in range(words)
+        )
+        return self._upsert(remote_jid, {"conversation": body}, "conversation")
+
+    def image(self, remote_jid):
+        message = {
+            "imageMessage": {"caption": "bench image", "mimetype": "image/jpeg"},
+            "base64": self.media_base64,
+        }
+        return self._upsert(remote_jid, message, "imageMessage")
+
+    def document(self, remote_jid):
+        message = {
+            "documentMessage": {
+                "caption": "bench document",
+                "title": "bench.pdf",
+                "mimetype": "application/pdf",
+            },
+            "base64": self.media_base64,
+        }
+        return self._upsert(remote_jid, message, "documentMessage")
+
+    def reaction(self, remote_jid):
+        previous = self._previous()
+        if not previous:
+            return self.text(remote_jid)
+        remote_jid, message_id = previous
+        message = {
+            "reactionMessage": {
+                "key": {"remoteJid": remote_jid, "id": message_id},
+                "text": self.random.choice(["👍", "❤️", "😂"]),
+            }
+        }
+        return self._upsert(remote_jid, message, "reactionMessage")
+
+    def receipt(self, remote_jid):
+        previous = self._previous()
+        if not previous:
+            return self.text(remote_jid)
+        remote_jid, message_id = previous
+        return {
+            "event": "messages.update",
+            "instance": self.instance,
+            "data": {"keyId": message_id, "remoteJid": remote_jid, "status": "READ"},
+        }
+
+    def delete(self, remote_jid):
+        previous = self._previous()
+        if not previous:
+            return self.text(remote_jid)
+        remote_jid, message_id = previous
+        return {
+            "event": "messages.delete",
+            "instance": self.instance,
+            "data": {"id": message_id, "remoteJid": remote_jid},
+        }
+
+    def contacts(self, remote_jid):
+        return {
+            "event": "contacts.upsert",
+            "instance": self.instance,
+            "data": [
+                {
+                    "remoteJid": jid,
+                    "pushName": f"Bench {jid[5:13]}",
+                    "profilePicUrl": None,
+                }
+                for jid in self.random.sample(
+                    self.remote_jids, min(self.burst, len(self.remote_jids))
+                )
+            ],
+        }
+
+    def build(self, event_type):
+        return getattr(self, event_type)(self.random.choice(self.remote_jids))
+
+
+def parse_mix(mix):
+    weights = {}
+    for item in mix.split(","):
+        name, _sep, weight = item.partition("=")
+        name = name.strip()
+        if name not in EVENT_TYPES:
+            raise argparse.ArgumentTypeError(
+                f"unknown event type {name}, expected one of {EVENT_TYPES}"
+            )
+        weights[name] = float(weight or 1)
+    return weights
+
+
+#
+# Measurements
+#
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    index = max(0, min(len(values) - 1, round(pct / 100 * len(values)) - 1))
+    return values[index]
+
+
+def latency_summary(latencies):
+    if not latencies:
+        return {}
+    return {
+        "count": len(latencies),
+        "min_ms": round(min(latencies) * 1000, 2),
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 2),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "max_ms": round(max(latencies) * 1000, 2),
+    }
+
+
+def process_tree(pid):
+    """pid and all its descendants, read from /proc"""
+    pids = [pid]
+    for current in pids:
+        try:
+            tasks = os.listdir(f"/proc/{current}/task")
+        except OSError:
+            continue
+        for task in tasks:
+            try:
+                with open(f"/proc/{current}/task/{task}/children") as f:
+                    pids.extend(int(child) for child in f.read().split())
+            except OSError:
+                continue
+    return pids
+
+
+def read_rss_kb(pid, field="VmRSS"):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+class RssSampler(threading.Thread):
+    """Samples the summed RSS of the Odoo process tree during the run"""
+
+    def __init__(self, pid, interval=0.2):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.peak_kb = 0
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                total = sum(read_rss_kb(pid) for pid in process_tree(self.pid))
+            except OSError:
+                total = 0
+            self.peak_kb = max(self.peak_kb, total)
+            self.stopped.wait(self.interval)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        hwm = {pid: read_rss_kb(pid, "VmHWM") for pid in process_tree(self.pid)}
+        return {
+            "peak_rss_mb": round(self.peak_kb / 1024, 1),
+            "peak_worker_hwm_mb": round(max(hwm.values() or [0]) / 1024, 1),
+            "processes": len(hwm),
+        }
+
+
+def read_query_counts(log_path, offset, connector_uuid):
+    """Query counts of our requests in the Odoo log written since offset"""
+    counts = []
+    sql_time = 0.0
+    with open(log_path, errors="replace") as f:
+        f.seek(offset)
+        for line in f:
+            match = ODOO_ACCESS_LINE.search(line)
+            if match and match["uuid"] == connector_uuid:
+                counts.append(int(match["queries"]))
+                sql_time += float(match["sql_time"])
+    if not counts:
+        return {}
+    return {
+        "requests_logged": len(counts),
+        "queries_total": sum(counts),
+        "queries_per_event_mean": round(statistics.fmean(counts), 2),
+        "queries_per_event_p95": percentile(counts, 95),
+        "queries_per_event_max": max(counts),
+        "sql_time_per_event_ms": round(sql_time / len(counts) * 1000, 2),
+    }
+
+
+#
+# Driver
+#
+
+
+def post(url, payload, timeout):
+    body = json.dumps(payload).encode()
+    request = urllib.request.Request(
+        url, data=body, headers={"Content-Type": "application/json"}, method="POST"
+    )
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except (urllib.error.URLError, TimeoutError, ConnectionError):
+        status = 0
+    return status, time.perf_counter() - started, len(body)
+
+
+def run(args):
+    endpoint = f"{args.url.rstrip('/')}/discuss_hub/connector/{args.uuid}"
+    generator = PayloadGenerator(
+        args.instance,
+        contacts=args.contacts,
+        media_kb=args.media_kb,
+        burst=args.contacts_burst,
+        seed=args.seed,
+    )
+    mix = parse_mix(args.mix)
+    kinds = generator.random.choices(
+        list(mix), weights=list(mix.values()), k=args.events
+    )
+    stub = None
+    if args.stub_port:
+        stub = ProviderStub(args.stub_port, latency=args.stub_latency_ms / 1000)
+        stub.start()
+    # seed some messages first so reactions/receipts/deletes have targets
+    for _i in range(min(args.warmup, args.events)):
+        contact = generator.random.choice(generator.remote_jids)
+        post(endpoint, generator.text(contact), args.timeout)
+
+    sampler = RssSampler(args.odoo_pid) if args.odoo_pid else None
+    log_offset = os.path.getsize(args.odoo_log) if args.odoo_log else 0
+
+    results = {kind: [] for kind in mix}
+    statuses = {}
+    bytes_sent = 0
+    lock = threading.Lock()
+
+    def send(kind):
+        nonlocal bytes_sent
+        status, elapsed, size = post(endpoint, generator.build(kind), args.timeout)
+        with lock:
+            results[kind].append(elapsed)
+            statuses[status] = statuses.get(status, 0) + 1
+            bytes_sent += size
+
+    if sampler:
+        sampler.start()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        list(executor.map(send, kinds))
+    duration = time.perf_counter() - started
+
+    all_latencies = [latency for values in results.values() for latency in values]
+    report = {
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "target": endpoint,
+        "config": {
+            "events": args.events,
+            "concurrency": args.concurrency,
+            "mix": mix,
+            "media_kb": args.media_kb,
+            "contacts": args.contacts,
+            "contacts_burst": args.contacts_burst,
+            "warmup": args.warmup,
+            "seed": args.seed,
+        },
+        "duration_s": round(duration, 3),
+        "throughput_eps": round(len(all_latencies) / duration, 2) if duration else None,
+        "bytes_sent": bytes_sent,
+        "status_codes": {str(k): v for k, v in sorted(statuses.items())},
+        "errors": sum(v for k, v in statuses.items() if not 200 <= k < 300),
+        "latency": latency_summary(all_latencies),
+        "latency_by_event": {
+            kind: latency_summary(values) for kind, values in results.items()
+        },
+    }
+    if args.odoo_log:
+        # give the log handler a moment to flush the last lines
+        time.sleep(0.5)
+        report["sql"] = read_query_counts(args.odoo_log, log_offset, args.uuid)
+    if sampler:
+        report["memory"] = sampler.stop()
+    if stub:
+        stub.shutdown()
+        report["provider_calls"] = dict(sorted(stub.calls.items()))
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--url", default="http://localhost:8069")
+    parser.add_argument("--uuid", required=True, help="connector uuid")
+    parser.add_argument("--instance", default="bench", help="connector name")
+    parser.add_argument("--events", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument(
+        "--mix",
+        default=DEFAULT_MIX,
+        help=f"weights of {','.join(EVENT_TYPES)} (default {DEFAULT_MIX})",
+    )
+    parser.add_argument("--media-kb", type=int, default=64)
+    parser.add_argument("--contacts", type=int, default=50)
+    parser.add_argument("--contacts-burst", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument(
+        "--stub-port", type=int, default=0, help="start the provider stub"
+    )
+    parser.add_argument("--stub-latency-ms", type=float, default=0)
+    parser.add_argument("--odoo-log", help="Odoo log file, for SQL per event")
+    parser.add_argument("--odoo-pid", type=int, help="Odoo main pid, for peak RSS")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    args = parser.parse_args(argv)
+
+    report = run(args)
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    print(output)
+    return 1 if report["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
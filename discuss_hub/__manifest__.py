@@ -19,6 +19,7 @@
         "views/res_partner_view.xml",
         # initial base_automation
         "datas/base_automation.xml",
+        "datas/ir_cron.xml",
         # wizards
         "wizard/mail_discuss_channel_forward.xml",
         "wizard/mail_discuss_channel_archive.xml",
@@ -5,9 +5,24 @@ import uuid
 from werkzeug.wrappers import Response
 
 from odoo import http
+from odoo.tools.misc import consteq
+
+from odoo.addons.discuss_hub.models import metrics, payload_log
 
 _logger = logging.getLogger(__name__)
 
+NDJSON_MIMETYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl")
+# events accepted in one batch request
+BATCH_MAX_EVENTS = 500
+
+
+def _loads_event(line):
+    """One NDJSON event, None when the line is not valid JSON"""
+    try:
+        return json.loads(line)
+    except json.decoder.JSONDecodeError:
+        return None
+
 
 class Evo(http.Controller):
     @http.route(
@@ -36,8 +51,16 @@ class Evo(http.Controller):
                 content_type="application/json",
             )
             return response
+        mimetype = http.request.httprequest.mimetype
         try:
-            if http.request.httprequest.mimetype == "application/json":
+            if mimetype in NDJSON_MIMETYPES:
+                # one event per line, relays and replays send them in bulk
+                incoming_payload = [
+                    _loads_event(line)
+                    for line in http.request.httprequest.data.splitlines()
+                    if line.strip()
+                ]
+            elif mimetype == "application/json":
                 incoming_payload = json.loads(http.request.httprequest.data)
             else:
                 # For form-encoded data
@@ -46,7 +69,7 @@ class Evo(http.Controller):
         except json.decoder.JSONDecodeError:
             _logger.error(
                 f"action:json_decode_error identifier:{identifier},"
-                + f" payload:{http.request.httprequest.data}"
+                + f" payload:{payload_log.raw_body(http.request.httprequest.data)}"
             )
             response = Response(
                 json.dumps({"message": "Invalid JSON Payload"}),
@@ -54,10 +77,37 @@ class Evo(http.Controller):
                 content_type="application/json",
             )
             return response
-        _logger.info(
-            f"action incoming_payload connector {connector.id}:"
-            + f" payload {json.dumps(incoming_payload)}"
-        )
+        batch = isinstance(incoming_payload, list)
+        if batch and len(incoming_payload) > BATCH_MAX_EVENTS:
+            return Response(
+                json.dumps(
+                    {"message": f"More than {BATCH_MAX_EVENTS} events in a batch"}
+                ),
+                status=413,
+                content_type="application/json",
+            )
+        if (
+            connector.queue_inbound
+            and http.request.httprequest.method == "POST"
+            and (mimetype == "application/json" or mimetype in NDJSON_MIMETYPES)
+        ):
+            # acknowledged now, processed in order by the ingest workers
+            queued = (
+                http.request.env["discuss_hub.inbound_event"]
+                .sudo()
+                .enqueue(connector, incoming_payload if batch else [incoming_payload])
+            )
+            return Response(
+                json.dumps(queued),
+                status=202,
+                content_type="application/json",
+            )
+        if batch:
+            return Response(
+                json.dumps(connector.process_payloads(incoming_payload)),
+                headers={"Content-Type": "application/json"},
+            )
+        # logged by process_payload, bounded and redacted
         response = connector.process_payload(incoming_payload)
         if isinstance(response, Response):
             # If the response is already a Response object, return it directly
@@ -99,7 +149,7 @@ class Evo(http.Controller):
         except json.decoder.JSONDecodeError:
             _logger.error(
                 f"action:json_decode_error identifier:{identifier},"
-                + f" payload:{http.request.httprequest.data}"
+                + f" payload:{payload_log.raw_body(http.request.httprequest.data)}"
             )
             response = Response(
                 json.dumps({"message": "Invalid JSON Payload"}),
@@ -107,9 +157,12 @@ class Evo(http.Controller):
                 content_type="application/json",
             )
             return response
-        _logger.info(
-            f"action incoming_payload botmanager {botmanager.id}:"
-            + f" payload {json.dumps(incoming_payload)}"
+        payload_log.log_event(
+            _logger,
+            "incoming_payload",
+            connector=f"bot_manager:{botmanager.id}",
+            event=incoming_payload.get("action"),
+            payload=incoming_payload,
         )
         response = botmanager.process_payload(incoming_payload)
         if isinstance(response, Response):
@@ -119,3 +172,67 @@ class Evo(http.Controller):
                 json.dumps(response),
                 headers={"Content-Type": "application/json"},
             )
+
+    @http.route(
+        [
+            "/discuss_hub/media/<int:attachment_id>/<int:expires>/<string:token>",
+            "/discuss_hub/media/<int:attachment_id>/<int:expires>/<string:token>"
+            + "/<string:filename>",
+        ],
+        auth="public",
+        csrf=False,
+        methods=["GET", "HEAD"],
+        type="http",
+    )
+    def media(self, attachment_id, expires, token, filename=None, **kw):
+        """
+        Stream an attachment straight from the filestore using a short-lived
+        signed url, so providers and bots can fetch media themselves.
+        """
+        attachment = (
+            http.request.env["ir.attachment"].sudo().browse(attachment_id).exists()
+        )
+        if not attachment or not attachment.discuss_hub_check_media_token(
+            expires, token
+        ):
+            _logger.warning(
+                f"action:media_forbidden attachment:{attachment_id} expires:{expires}"
+            )
+            return Response(
+                json.dumps({"message": "Invalid or expired media link"}),
+                status=403,
+                content_type="application/json",
+            )
+        stream = http.request.env["ir.binary"].sudo()._get_stream_from(attachment)
+        return stream.get_response()
+
+    @http.route(
+        "/discuss_hub/metrics",
+        auth="public",
+        csrf=False,
+        methods=["GET"],
+        type="http",
+    )
+    def stage_metrics(self, token=None, **kw):
+        """
+        Pipeline stage timings of all workers in the Prometheus text format.
+        Disabled until the discuss_hub.metrics_token parameter is set, the
+        scraper sends it as a bearer token or the token query parameter.
+        """
+        expected = (
+            http.request.env["ir.config_parameter"]
+            .sudo()
+            .get_param("discuss_hub.metrics_token")
+        )
+        if not expected:
+            return Response(status=404)
+        authorization = http.request.httprequest.headers.get("Authorization", "")
+        if authorization.startswith("Bearer "):
+            token = authorization[len("Bearer ") :]
+        if not consteq(expected, token or ""):
+            _logger.warning("action:metrics_forbidden invalid token")
+            return Response(status=403)
+        return Response(
+            metrics.render_prometheus(http.request.env(su=True)),
+            content_type="text/plain; version=0.0.4; charset=utf-8",
+        )
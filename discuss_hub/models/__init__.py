@@ -1,7 +1,12 @@
 from . import models
 from . import discuss_channel
+from . import agent_load
+from . import bus_presence
 from . import mail_message
 from . import ir_attachment
 from . import res_partner
 from . import routing_manager
 from . import bot_manager
+from . import outbox
+from . import webhook_delivery
+from . import inbound_queue
@@ -0,0 +1,154 @@
+import logging
+
+from odoo import api, fields, models
+
+_logger = logging.getLogger(__name__)
+
+
+class DiscussHubAgentLoad(models.Model):
+    """
+    Open conversations of each agent (internal user partner): the active
+    connector channels the agent is a member of. The counters are kept up to
+    date by the channel and member hooks, so the least busy routing reads
+    them instead of counting discuss.channel.member rows.
+    """
+
+    _name = "discuss_hub.agent_load"
+    _description = "Discuss Hub Agent Load"
+    _order = "open_count, partner_id"
+
+    partner_id = fields.Many2one(
+        comodel_name="res.partner",
+        required=True,
+        ondelete="cascade",
+    )
+    open_count = fields.Integer(
+        string="Open Conversations",
+        help="Active connector channels the agent is a member of.",
+    )
+
+    _sql_constraints = [
+        ("partner_uniq", "unique(partner_id)", "The agent already has a counter."),
+    ]
+
+    def init(self):
+        self._recompute_loads()
+
+    @api.model
+    def adjust(self, deltas):
+        """
+        Add deltas ({partner_id: delta}) to the counters of the partners
+        that are internal users, the others are not agents and are ignored
+        """
+        deltas = {pid: delta for pid, delta in deltas.items() if pid and delta}
+        if not deltas:
+            return
+        params = {
+            "partner_ids": list(deltas),
+            "deltas": list(deltas.values()),
+            "uid": self.env.uid,
+        }
+        self.env.cr.execute(
+            """
+            INSERT INTO discuss_hub_agent_load
+                (partner_id, open_count, create_uid, create_date,
+                 write_uid, write_date)
+            SELECT DISTINCT u.partner_id, 0,
+                   %(uid)s, now() at time zone 'UTC',
+                   %(uid)s, now() at time zone 'UTC'
+            FROM res_users u
+            WHERE u.partner_id = ANY(%(partner_ids)s) AND NOT u.share
+            ON CONFLICT (partner_id) DO NOTHING
+            """,
+            params,
+        )
+        self.env.cr.execute(
+            """
+            UPDATE discuss_hub_agent_load l
+            SET open_count = GREATEST(l.open_count + d.delta, 0),
+                write_uid = %(uid)s,
+                write_date = now() at time zone 'UTC'
+            FROM unnest(%(partner_ids)s::int[], %(deltas)s::int[])
+                AS d(partner_id, delta)
+            WHERE l.partner_id = d.partner_id
+            """,
+            params,
+        )
+        self.invalidate_model(["open_count", "write_uid", "write_date"])
+
+    @api.model
+    def _recompute_loads(self):
+        """Recount every counter from the channel members"""
+        self.env.cr.execute(
+            """
+            WITH counted AS (
+                SELECT u.partner_id, count(DISTINCT m.channel_id) AS open_count
+                FROM res_users u
+                LEFT JOIN discuss_channel_member m ON m.partner_id = u.partner_id
+                    AND EXISTS (
+                        SELECT 1 FROM discuss_channel c
+                        WHERE c.id = m.channel_id
+                          AND c.active
+                          AND c.discuss_hub_connector IS NOT NULL
+                    )
+                WHERE NOT u.share
+                GROUP BY u.partner_id
+            )
+            INSERT INTO discuss_hub_agent_load
+                (partner_id, open_count, create_uid, create_date,
+                 write_uid, write_date)
+            SELECT partner_id, open_count,
+                   %(uid)s, now() at time zone 'UTC',
+                   %(uid)s, now() at time zone 'UTC'
+            FROM counted
+            ON CONFLICT (partner_id) DO UPDATE
+                SET open_count = EXCLUDED.open_count,
+                    write_uid = EXCLUDED.write_uid,
+                    write_date = EXCLUDED.write_date
+                WHERE discuss_hub_agent_load.open_count <> EXCLUDED.open_count
+            """,
+            {"uid": self.env.uid},
+        )
+        self.invalidate_model()
+
+    @api.model
+    def _cron_recompute_loads(self):
+        self._recompute_loads()
+        _logger.info("action:agent_load counters recomputed")
+
+    @api.model
+    def get_least_busy_user(self, users):
+        """User of users with the fewest open conversations"""
+        if not users:
+            return self.env["res.users"]
+        self.flush_model()
+        self.env.cr.execute(
+            """
+            SELECT u.id
+            FROM res_users u
+            LEFT JOIN discuss_hub_agent_load l ON l.partner_id = u.partner_id
+            WHERE u.id = ANY(%s)
+            ORDER BY COALESCE(l.open_count, 0), u.id
+            LIMIT 1
+            """,
+            (list(users.ids),),
+        )
+        row = self.env.cr.fetchone()
+        return self.env["res.users"].browse(row[0] if row else [])
+
+    @api.model
+    def get_open_counts(self, users):
+        """Open conversations of each user, as a dict user id: count"""
+        if not users:
+            return {}
+        self.flush_model()
+        self.env.cr.execute(
+            """
+            SELECT u.id, COALESCE(l.open_count, 0)
+            FROM res_users u
+            LEFT JOIN discuss_hub_agent_load l ON l.partner_id = u.partner_id
+            WHERE u.id = ANY(%s)
+            """,
+            (list(users.ids),),
+        )
+        return dict(self.env.cr.fetchall())
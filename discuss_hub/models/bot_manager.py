@@ -1,16 +1,42 @@
 import base64
+import hashlib
+import json
 import logging
+import re
+import threading
+import time
+import unicodedata
 import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
 from urllib.parse import urljoin, urlparse
 
 import requests
 from markupsafe import Markup
+from psycopg2 import IntegrityError
+from psycopg2.errors import SerializationFailure
 
-from odoo import fields, models
+from odoo import SUPERUSER_ID, api, fields, models
 from odoo.tools import html2plaintext
 
+from . import metrics, payload_log, wakeup
+
 _logger = logging.getLogger(__name__)
 
+# in-process cache of the active typebot session of each (db, bot, channel),
+# so a running conversation does not look its session up on every message.
+# A hit is checked against the expired flag of the session row by its id, as
+# another worker may have restarted the session or the cron expired it.
+SESSION_CACHE_TTL = 60
+_session_cache = {}
+_session_cache_lock = threading.Lock()
+
+# parallel downloads of the media bubbles of one bot reply
+MEDIA_DOWNLOAD_WORKERS = 4
+# seconds the workers of a cron run claim jobs at most, less within the time
+# limits of the cron workers (see wakeup.cron_run_seconds)
+BOT_JOBS_RUN_SECONDS = 240
+
 
 class DiscussHubBotManager(models.Model):
     """
@@ -66,41 +92,297 @@ class DiscussHubBotManager(models.Model):
         + "Please try again later.",
         help="Message to send when an error occurs while processing a request.",
     )
+    attachment_mode = fields.Selection(
+        selection=[
+            ("base64", "Inline Base64"),
+            ("url", "Signed URL"),
+        ],
+        default="base64",
+        required=True,
+        help="How attachments of incoming messages are passed to the bot: "
+        "audio inlined as base64, or a short-lived signed download URL with "
+        "the attachment metadata.",
+    )
+    attachment_url_ttl = fields.Integer(
+        string="Attachment URL TTL",
+        default=900,
+        help="Validity in seconds of the signed attachment URLs sent to the bot.",
+    )
+    response_cache_enabled = fields.Boolean(
+        string="Cache Responses",
+        help="Answer repeated prompts (same normalized text) from a cache "
+        "instead of calling the bot. Only for generic bots with deterministic "
+        "answers, messages with attachments are never cached.",
+    )
+    response_cache_ttl = fields.Integer(
+        string="Response Cache TTL",
+        default=3600,
+        help="Seconds a cached response is reused.",
+    )
+    response_cache_size = fields.Integer(
+        default=1000,
+        help="Maximum number of cached responses, least recently used "
+        "are dropped first.",
+    )
+    response_cache_context_keys = fields.Char(
+        help="Comma separated payload keys also part of the cache key, "
+        "e.g. message_author_id for per contact answers.",
+    )
+    response_cache_hits = fields.Integer(readonly=True, copy=False)
+    response_cache_misses = fields.Integer(readonly=True, copy=False)
+    response_cache_hit_rate = fields.Float(
+        compute="_compute_response_cache_hit_rate",
+        help="Percentage of prompts answered from the cache.",
+    )
+    async_dispatch = fields.Boolean(
+        default=True,
+        help="Call the bot from a background job instead of inside the "
+        "incoming message transaction, so a slow bot does not hold the webhook.",
+    )
+    max_concurrency = fields.Integer(
+        default=4,
+        help="Maximum number of conversations processed by this bot at once.",
+    )
+    job_pending_count = fields.Integer(
+        string="Pending Jobs", compute="_compute_job_pending_count"
+    )
+    session_ttl_hours = fields.Integer(
+        string="Session TTL (hours)",
+        default=24,
+        help="Bot sessions idle for longer are expired and the next message "
+        "starts a new chat. 0 keeps sessions until the bot rejects them.",
+    )
 
-    def generic_handle(self, message, channel, partner):
-        timed_out = False
-        message_audio_base64 = None
-        attachment_id = None
-        try:
-            request_data = requests.post(
-                self.bot_url,
-                json={
-                    "message_body": message.body,
-                    "message_author_name": message.author_id.name,
-                    "message_author_id": message.author_id.id,
-                    "message_audio_base64": message_audio_base64,
-                    "attachment_id": attachment_id,
+    def _compute_job_pending_count(self):
+        for bot in self:
+            bot.job_pending_count = self.env[
+                "discuss_hub.bot_manager.job"
+            ].search_count(
+                [
+                    ("bot_manager_id", "=", bot.id),
+                    ("state", "in", ["pending", "running"]),
+                ]
+            )
+
+    def dispatch(self, channel, partner):
+        """
+        Entry point of the bot automation: queue the last message of the
+        channel for the bot, or answer inline if async_dispatch is disabled.
+        """
+        self.ensure_one()
+        message = channel.message_ids[:1]
+        if not self.async_dispatch:
+            with metrics.stage_timer(
+                channel.discuss_hub_connector, f"bot_{self.bot_type}", event="bot"
+            ):
+                return self.outgo(channel, partner, message=message)
+        job = (
+            self.env["discuss_hub.bot_manager.job"]
+            .sudo()
+            .create(
+                {
+                    "bot_manager_id": self.id,
                     "channel_id": channel.id,
-                },
-                timeout=self.bot_url_timeout,  # Set a timeout for the request
+                    "partner_id": partner.id,
+                    "message_id": message.id,
+                }
             )
-        except requests.Timeout as e:
-            _logger.error(f"Timeout while sending message to bot {self.bot_url}: {e}")
-            timed_out = True
-        if request_data.status_code != 200 or timed_out or not request_data.content:
-            _logger.error(f"Failed to send message to bot {self}: {request_data.text}")
-            # sending default error message
-            error_message = channel.message_post(
-                body=self.on_error_message,
-                author_id=partner.id,
-                message_type="comment",
-                subtype_xmlid="mail.mt_comment",
+        )
+        _logger.info(f"BOTMANAGER: queued {job} for bot {self.id} at {channel.id}")
+        wakeup.wake(self.env, "bot_jobs", "discuss_hub.ir_cron_discuss_hub_bot_jobs")
+        return job
+
+    def _compute_response_cache_hit_rate(self):
+        for bot in self:
+            total = bot.response_cache_hits + bot.response_cache_misses
+            bot.response_cache_hit_rate = (
+                100.0 * bot.response_cache_hits / total if total else 0.0
             )
-            channel.discuss_hub_connector.outgo_message(channel, error_message)
-            return True
 
-        # for each message
-        for received_message in request_data.json():
+    @api.model
+    def _normalize_prompt(self, text):
+        """Lowercase text without html, accents, punctuation nor extra spaces"""
+        text = html2plaintext(text or "").lower()
+        text = unicodedata.normalize("NFKD", text)
+        text = "".join(c for c in text if not unicodedata.combining(c))
+        return " ".join(re.sub(r"[^\w\s]", " ", text).split())
+
+    def _response_cache_key(self, message, payload):
+        """Cache key of message, or None when the response cannot be cached"""
+        if not self.response_cache_enabled or message.attachment_ids:
+            return None
+        prompt = self._normalize_prompt(message.body)
+        if not prompt:
+            return None
+        context_keys = [
+            key.strip()
+            for key in (self.response_cache_context_keys or "").split(",")
+            if key.strip()
+        ]
+        context = {key: payload.get(key) for key in context_keys}
+        raw_key = json.dumps([prompt, context], sort_keys=True, default=str)
+        return prompt, hashlib.sha256(raw_key.encode()).hexdigest()
+
+    def _response_cache_count(self, column, cached=None):
+        """
+        Count a hit or a miss once the transaction commits, from a short cursor
+        of its own: the bot and cached rows are not locked while the job runs.
+        """
+        registry = self.env.registry
+        bot_id, cached_id = self.id, cached.id if cached else None
+
+        def _count():
+            try:
+                with registry.cursor() as cr:
+                    # plain increments, concurrent workers do not conflict
+                    cr.execute(
+                        f"UPDATE discuss_hub_bot_manager SET {column} = {column} + 1 "
+                        + "WHERE id = %s",
+                        (bot_id,),
+                    )
+                    if cached_id:
+                        cr.execute(
+                            """
+                            UPDATE discuss_hub_bot_manager_response_cache
+                            SET hit_count = hit_count + 1,
+                                last_used_date = now() at time zone 'UTC'
+                            WHERE id = %s
+                            """,
+                            (cached_id,),
+                        )
+            except Exception as e:
+                _logger.warning(f"BOTMANAGER: could not count {column}: {e}")
+
+        self.env.cr.postcommit.add(_count)
+
+    def response_cache_get(self, message, payload):
+        """Cached replies for message, None when not cached"""
+        key = self._response_cache_key(message, payload)
+        if not key:
+            return None
+        cached = (
+            self.env["discuss_hub.bot_manager.response_cache"]
+            .sudo()
+            .search(
+                [
+                    ("bot_manager_id", "=", self.id),
+                    ("key", "=", key[1]),
+                    ("expires_at", ">", fields.Datetime.now()),
+                ],
+                limit=1,
+            )
+        )
+        if not cached:
+            self._response_cache_count("response_cache_misses")
+            return None
+        self._response_cache_count("response_cache_hits", cached)
+        _logger.info(f"BOTMANAGER: bot {self.id} answered '{key[0]}' from cache")
+        return json.loads(cached.response)
+
+    def response_cache_set(self, message, payload, replies):
+        key = self._response_cache_key(message, payload)
+        if not key:
+            return
+        self.env["discuss_hub.bot_manager.response_cache"].sudo().store(
+            self, key[0], key[1], replies
+        )
+
+    def action_purge_response_cache(self):
+        self.env["discuss_hub.bot_manager.response_cache"].sudo().search(
+            [("bot_manager_id", "in", self.ids)]
+        ).unlink()
+        self.write({"response_cache_hits": 0, "response_cache_misses": 0})
+
+    def _request_timeout(self):
+        """
+        bot_url_timeout, capped so the calls of a job claimed at the end of a
+        cron run still end within the time limits of the cron worker
+        """
+        return min(
+            self.bot_url_timeout, wakeup.cron_run_seconds(self.bot_url_timeout) / 2
+        )
+
+    def post_error_message(self, channel, partner):
+        """Post on_error_message in the channel and send it to the provider"""
+        error_message = channel.message_post(
+            body=self.on_error_message,
+            author_id=partner.id,
+            message_type="comment",
+            subtype_xmlid="mail.mt_comment",
+        )
+        channel.discuss_hub_connector.outgo_message(channel, error_message)
+        return error_message
+
+    def get_attachment_variables(self, message):
+        """
+        Attachment of message as sent to the bot. In url mode the bot gets
+        a signed download URL and metadata, the file is not read at all.
+        """
+        attachment = message.attachment_ids[:1]
+        variables = {
+            "message_audio_base64": None,
+            "attachment_id": None,
+        }
+        if not attachment:
+            return variables
+        if self.attachment_mode == "url":
+            variables.update(
+                {
+                    "attachment_id": attachment.id,
+                    "attachment_url": attachment.sudo().discuss_hub_media_url(
+                        ttl=self.attachment_url_ttl
+                    ),
+                    "attachment_name": attachment.name,
+                    "attachment_mimetype": attachment.mimetype,
+                    "attachment_size": attachment.file_size,
+                }
+            )
+        elif "audio" in (attachment.mimetype or ""):
+            variables.update(
+                {
+                    "attachment_id": attachment.id,
+                    "message_audio_base64": attachment.datas.decode("utf-8"),
+                }
+            )
+        return variables
+
+    def generic_handle(self, message, channel, partner):
+        timed_out = False
+        request_data = None
+        payload = {
+            "message_body": message.body,
+            "message_author_name": message.author_id.name,
+            "message_author_id": message.author_id.id,
+            **self.get_attachment_variables(message),
+            "channel_id": channel.id,
+        }
+        replies = self.response_cache_get(message, payload)
+        if replies is None:
+            try:
+                request_data = requests.post(
+                    self.bot_url,
+                    json=payload,
+                    timeout=self._request_timeout(),
+                )
+            except requests.Timeout as e:
+                _logger.error(
+                    f"Timeout while sending message to bot {self.bot_url}: {e}"
+                )
+                timed_out = True
+            if timed_out or request_data.status_code != 200 or not request_data.content:
+                _logger.error(
+                    f"Failed to send message to bot {self}: "
+                    + f"{request_data.text if request_data is not None else 'timeout'}"
+                )
+                # sending default error message
+                self.post_error_message(channel, partner)
+                return True
+            replies = request_data.json()
+            self.response_cache_set(message, payload, replies)
+
+        # post every message first, then send them in order
+        new_messages = self.env["mail.message"]
+        for received_message in replies:
             attachments = []
             # go thru each type, except text
             for content_type, content in received_message.items():
@@ -121,14 +403,64 @@ class DiscussHubBotManager(models.Model):
                         )
                         pass
 
-            new_message = channel.message_post(
+            new_messages |= channel.message_post(
                 body=received_message.get("text", ""),
                 author_id=partner.id,
                 message_type="comment",
                 subtype_xmlid="mail.mt_comment",
                 attachments=attachments,
             )
-            channel.discuss_hub_connector.outgo_message(channel, new_message)
+        channel.discuss_hub_connector.outgo_messages(channel, new_messages)
+
+    def _session_cache_key(self, channel):
+        return (self.env.cr.dbname, self.id, channel.id)
+
+    def typebot_get_session_id(self, channel):
+        """Session id of the active session of channel, or None"""
+        key = self._session_cache_key(channel)
+        with _session_cache_lock:
+            cached = _session_cache.get(key)
+        if (
+            cached
+            and time.monotonic() - cached[2] < SESSION_CACHE_TTL
+            and self._session_still_active(cached[0])
+        ):
+            return cached[1]
+        latest_session = self.typebot_get_latest_session(channel)
+        if not latest_session:
+            self._session_cache_drop(channel)
+            return None
+        latest_session.last_used_date = fields.Datetime.now()
+        self._session_cache_set(channel, latest_session)
+        return latest_session.session_id
+
+    def _session_still_active(self, session_row_id):
+        """Whether the cached session row is still the active one, by id"""
+        self.env["discuss_hub.bot_manager.session"].flush_model(["expired"])
+        self.env.cr.execute(
+            """
+            SELECT 1 FROM discuss_hub_bot_manager_session
+            WHERE id = %s AND NOT expired
+            """,
+            (session_row_id,),
+        )
+        return bool(self.env.cr.fetchone())
+
+    def _session_cache_set(self, channel, session):
+        """Cache session once committed, a rolled back session is not kept"""
+        key = self._session_cache_key(channel)
+        self._session_cache_drop(channel)
+        value = (session.id, session.session_id)
+
+        def _set():
+            with _session_cache_lock:
+                _session_cache[key] = (*value, time.monotonic())
+
+        self.env.cr.postcommit.add(_set)
+
+    def _session_cache_drop(self, channel):
+        with _session_cache_lock:
+            _session_cache.pop(self._session_cache_key(channel), None)
 
     def typebot_get_latest_session(self, channel):
         latest_session = self.env["discuss_hub.bot_manager.session"].search(
@@ -146,14 +478,15 @@ class DiscussHubBotManager(models.Model):
         # add the necessary sub path
         # bot_url should be like: http://localhost:8081/api/v1/typebots/odoo/
         logging.info(
-            f"BOTMANAGER - Starting chat with bot {self.id} and payload {payload}"
+            f"BOTMANAGER - Starting chat with bot {self.id} and payload "
+            + payload_log.dumps(payload)
         )
         url = urljoin(self.bot_url, "startChat")
         request_data = requests.post(
             url,
             headers={"Authorization": "Bearer {self.bot_api_key}"},
             json=payload,
-            timeout=self.bot_url_timeout,
+            timeout=self._request_timeout(),
         )
         return request_data
 
@@ -174,6 +507,7 @@ class DiscussHubBotManager(models.Model):
                 "session_id": session_id,
             }
         )
+        self._session_cache_set(channel, new_session)
         return new_session
 
     def typebot_continue_chat(self, channel, session_id, payload):
@@ -195,28 +529,28 @@ class DiscussHubBotManager(models.Model):
             new_url,
             headers={"Authorization": "Bearer {self.bot_api_key}"},
             json=payload,
-            timeout=self.bot_url_timeout,
+            timeout=self._request_timeout(),
         )
         logging.info(
             f"CONTINUING CHAT FOR {channel.id} bot {self.id} session: {session_id}"
-            + f" with payload {payload}. Got response: {request_data.json()}"
+            + f" with payload {payload_log.dumps(payload)}. Got response: "
+            + payload_log.dumps(request_data.json())
         )
         return request_data
 
-    def outgo(self, channel, partner):
+    def outgo(self, channel, partner, message=None):
         """
         Send a message to the bot.
-        :param message: The message to send.
+        :param message: The message to send, the last one of the channel
+            by default.
         :return: True if the message was sent successfully, False otherwise.
         """
-        message = channel.message_ids[0]
+        # bot replies are new outgoing messages, even when the bot is called
+        # while processing the inbound webhook
+        channel = channel.with_context(discuss_hub_inbound=False)
+        message = message or channel.message_ids[0]
         # Simulate sending a message to the bot
         _logger.info(f"Sending message to bot {self.bot_url}: {message} at {channel}")
-        message_audio_base64 = None
-        attachment_id = None
-        if message.attachment_ids and "audio" in message.attachment_ids[0].mimetype:
-            attachment_id = message.attachment_ids[0].id
-            message_audio_base64 = message.attachment_ids[0].datas.decode("utf-8")
 
         if self.bot_type == "generic":
             self.generic_handle(message, channel, partner)
@@ -232,8 +566,7 @@ class DiscussHubBotManager(models.Model):
                     "message_body": html2plaintext(str(message.body)),
                     "message_author_name": message.author_id.name,
                     "message_author_id": message.author_id.id,
-                    "message_audio_base64": message_audio_base64,
-                    "attachment_id": attachment_id,
+                    **self.get_attachment_variables(message),
                     "channel_id": channel.id,
                 },
                 "textBubbleContentFormat": "markdown",
@@ -241,14 +574,14 @@ class DiscussHubBotManager(models.Model):
             logging.info(
                 f"Getting Latest session for bot {self} at channel {channel.id}..."
             )
-            latest_session = self.typebot_get_latest_session(channel)
+            session_id = self.typebot_get_session_id(channel)
             new_session = None
             messages = []
             # no last session
-            if not latest_session:
+            if not session_id:
                 logging.info(
                     f"BOTMANAGER: Session for {self} not found, "
-                    + f"creating with payload {payload}"
+                    + f"creating with payload {payload_log.dumps(payload)}"
                 )
                 try:
                     new_session = self.typebot_start_chat(channel, payload)
@@ -272,9 +605,8 @@ class DiscussHubBotManager(models.Model):
             else:
                 logging.info(
                     "BOTMANAGER: Found existing session for bot "
-                    + f"{self.id}: {latest_session.session_id}. Continuing chat"
+                    + f"{self.id}: {session_id}. Continuing chat"
                 )
-                session_id = latest_session.session_id
                 # previous session found, try to continue chat
                 continue_chat = self.typebot_continue_chat(channel, session_id, payload)
                 if continue_chat.ok:
@@ -290,43 +622,67 @@ class DiscussHubBotManager(models.Model):
                         f"BOTMANAGER: Failed to continue {self}: {continue_chat.json()}"
                     )
 
-            for message in messages:
-                body = ""
-                attachments = []
-                logging.info(
-                    f"BOTMANAGER {self.id}, session_id:{session_id}, "
-                    + f"Message from bot: {message}"
-                )
-                if message.get("type") == "text":
-                    body = message.get("content", {}).get("markdown")
-                # TODO: try to cache those files as they will be repeating
-                if message.get("type") in ["image", "audio", "video", "file"]:
-                    url = message.get("content", {}).get("url")
-                    query = requests.get(url, timeout=self.bot_url_timeout)
-                    if query.ok:
-                        content_type = query.headers["Content-Type"]
-                        if message.get("type") == "audio":
-                            content_type = "audio.mp3"
-                        if message.get("type") == "video":
-                            content_type = "video.mp4"
-                        attachments.append((content_type, query.content))
-                    else:
-                        logging.warning(
-                            f"BOTMANAGER {self.id}, session_id:{session_id}, "
-                            + f"Failed to download media: {query.status_code}"
-                        )
-                # handle typebot markdown. first, replace \n to <br>
-                body = body.replace("\n", "<br>")
-                new_message = channel.message_post(
-                    body=Markup(body),
-                    author_id=partner.id,
-                    message_type="comment",
-                    subtype_xmlid="mail.mt_comment",
-                    attachments=attachments,
-                )
-                channel.discuss_hub_connector.outgo_message(channel, new_message)
+            self.typebot_post_bubbles(channel, partner, session_id, messages)
         return True
 
+    def typebot_post_bubbles(self, channel, partner, session_id, messages):
+        """
+        Post the bubbles of a bot reply at once and send them in order.
+        Media bubbles repeat a lot (welcome videos, ...), they are downloaded
+        in parallel through the media cache before anything is posted, so
+        text bubbles never wait behind a download.
+        """
+        media_urls = [
+            message.get("content", {}).get("url")
+            for message in messages
+            if message.get("type") in ["image", "audio", "video", "file"]
+        ]
+        media = {}
+        if media_urls:
+            media = (
+                self.env["discuss_hub.bot_media_cache"]
+                .sudo()
+                .fetch_many(media_urls, timeout=self._request_timeout())
+            )
+        new_messages = self.env["mail.message"]
+        for message in messages:
+            body = ""
+            attachment_ids = []
+            logging.info(
+                f"BOTMANAGER {self.id}, session_id:{session_id}, "
+                + f"Message from bot: {message}"
+            )
+            if message.get("type") == "text":
+                body = message.get("content", {}).get("markdown")
+            if message.get("type") in ["image", "audio", "video", "file"]:
+                url = message.get("content", {}).get("url")
+                cached = media.get(url)
+                if cached:
+                    content_type = cached.mimetype
+                    if message.get("type") == "audio":
+                        content_type = "audio.mp3"
+                    if message.get("type") == "video":
+                        content_type = "video.mp4"
+                    attachment_ids.append(
+                        cached.attach_to(channel, name=content_type).id
+                    )
+                else:
+                    logging.warning(
+                        f"BOTMANAGER {self.id}, session_id:{session_id}, "
+                        + f"Failed to download media: {url}"
+                    )
+            # handle typebot markdown. first, replace \n to <br>
+            body = body.replace("\n", "<br>")
+            new_messages |= channel.message_post(
+                body=Markup(body),
+                author_id=partner.id,
+                message_type="comment",
+                subtype_xmlid="mail.mt_comment",
+                attachment_ids=attachment_ids,
+            )
+        channel.discuss_hub_connector.outgo_messages(channel, new_messages)
+        return new_messages
+
     # def process_payload(self, payload):
     #     """
     #     Process an incoming payload from the bot.
@@ -431,3 +787,564 @@ class DiscussHubBotManagerSession(models.Model):
         default=False,
         help="Indicates if the session has expired.",
     )
+    last_used_date = fields.Datetime(
+        default=fields.Datetime.now,
+        help="Last time the session was used, refreshed at most once a minute.",
+    )
+
+    def init(self):
+        self.env.cr.execute(
+            """
+            CREATE INDEX IF NOT EXISTS discuss_hub_bot_manager_session_lookup_idx
+            ON discuss_hub_bot_manager_session (bot_manager_id, channel_id, expired)
+            """
+        )
+
+    @api.model
+    def _cron_expire_sessions(self):
+        """Expire, in one statement, the sessions idle past their bot TTL"""
+        self.env.cr.execute(
+            """
+            UPDATE discuss_hub_bot_manager_session s
+            SET expired = true,
+                write_date = now() at time zone 'UTC',
+                write_uid = %s
+            FROM discuss_hub_bot_manager b
+            WHERE b.id = s.bot_manager_id
+              AND NOT s.expired
+              AND b.session_ttl_hours > 0
+              AND s.last_used_date
+                < now() at time zone 'UTC' - b.session_ttl_hours * interval '1 hour'
+            RETURNING s.bot_manager_id, s.channel_id
+            """,
+            (self.env.uid,),
+        )
+        rows = self.env.cr.fetchall()
+        self.invalidate_model(["expired", "write_date", "write_uid"])
+        with _session_cache_lock:
+            for bot_manager_id, channel_id in rows:
+                _session_cache.pop(
+                    (self.env.cr.dbname, bot_manager_id, channel_id), None
+                )
+        _logger.info(f"BOTMANAGER: expired {len(rows)} idle bot sessions")
+
+
+class DiscussHubBotManagerJob(models.Model):
+    """
+    Bot invocation queued by the bot automation. Jobs are run by a pool of
+    threads started by the bot jobs cron, at most max_concurrency at a time
+    per bot and one at a time per channel, so conversations keep their order.
+    """
+
+    _name = "discuss_hub.bot_manager.job"
+    _description = "Discuss Hub Bot Manager Job"
+    _order = "id"
+
+    bot_manager_id = fields.Many2one(
+        comodel_name="discuss_hub.bot_manager",
+        required=True,
+        index=True,
+        ondelete="cascade",
+    )
+    channel_id = fields.Many2one(
+        comodel_name="discuss.channel",
+        required=True,
+        ondelete="cascade",
+    )
+    partner_id = fields.Many2one(
+        comodel_name="res.partner",
+        required=True,
+        ondelete="cascade",
+        help="Bot partner answering in the channel.",
+    )
+    message_id = fields.Many2one(
+        comodel_name="mail.message",
+        ondelete="cascade",
+        help="Message the bot answers to.",
+    )
+    state = fields.Selection(
+        selection=[
+            ("pending", "Pending"),
+            ("running", "Running"),
+            ("done", "Done"),
+            ("failed", "Failed"),
+        ],
+        default="pending",
+        required=True,
+        index=True,
+    )
+    started_date = fields.Datetime()
+    done_date = fields.Datetime()
+    error = fields.Text()
+
+    @api.model
+    def _cron_process_jobs(self, max_workers=None):
+        """
+        Run pending bot jobs with a pool of threads, for BOT_JOBS_RUN_SECONDS
+        at most: what is left is run by the next run
+        """
+        self._fail_stuck_jobs()
+        if getattr(threading.current_thread(), "testing", False):
+            # no threads (nor commits) inside tests
+            while self._run_next_job(self.env):
+                pass
+            return
+        if max_workers is None:
+            max_workers = int(
+                self.env["ir.config_parameter"]
+                .sudo()
+                .get_param("discuss_hub.bot_workers", 4)
+            )
+        deadline = time.monotonic() + wakeup.cron_run_seconds(BOT_JOBS_RUN_SECONDS)
+        with ThreadPoolExecutor(
+            max_workers=max(max_workers, 1), thread_name_prefix="discuss_hub_bot"
+        ) as pool:
+            futures = [
+                pool.submit(self._worker_loop, deadline)
+                for _i in range(max(max_workers, 1))
+            ]
+        left = False
+        for future in futures:
+            try:
+                left = future.result() or left
+            except Exception as e:
+                _logger.error(f"BOTMANAGER: job worker failed: {e}")
+                left = True
+        if left:
+            wakeup.wake(
+                self.env, "bot_jobs", "discuss_hub.ir_cron_discuss_hub_bot_jobs"
+            )
+
+    @api.model
+    def _worker_loop(self, deadline=None):
+        """
+        Run jobs until none is runnable (False) or until deadline, a
+        time.monotonic() value (True)
+        """
+        registry = self.env.registry
+        while deadline is None or time.monotonic() < deadline:
+            with registry.cursor() as cr:
+                env = api.Environment(cr, SUPERUSER_ID, {})
+                if not env["discuss_hub.bot_manager.job"]._run_next_job(env):
+                    return False
+        return True
+
+    @api.model
+    def _claim_next_job(self):
+        """Mark the next runnable job as running and return it"""
+        cr = self.env.cr
+        # claims are serialized so the concurrency counts stay exact
+        cr.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", ("discuss_hub.bot",))
+        cr.execute(
+            """
+            SELECT j.id FROM discuss_hub_bot_manager_job j
+            JOIN discuss_hub_bot_manager b ON b.id = j.bot_manager_id
+            WHERE j.state = 'pending'
+              AND NOT EXISTS (
+                SELECT 1 FROM discuss_hub_bot_manager_job r
+                WHERE r.channel_id = j.channel_id AND r.state = 'running'
+              )
+              AND (
+                SELECT count(*) FROM discuss_hub_bot_manager_job r
+                WHERE r.bot_manager_id = j.bot_manager_id AND r.state = 'running'
+              ) < GREATEST(b.max_concurrency, 1)
+            ORDER BY j.id
+            LIMIT 1
+            FOR UPDATE OF j SKIP LOCKED
+            """
+        )
+        row = cr.fetchone()
+        if not row:
+            return self.browse()
+        job = self.browse(row[0])
+        job.write({"state": "running", "started_date": fields.Datetime.now()})
+        return job
+
+    @api.model
+    def _run_next_job(self, env):
+        job = env["discuss_hub.bot_manager.job"]._claim_next_job()
+        if not job:
+            return False
+        auto_commit = not getattr(threading.current_thread(), "testing", False)
+        if auto_commit:
+            env.cr.commit()
+        job._execute()
+        if auto_commit:
+            env.cr.commit()
+        return True
+
+    def _execute(self):
+        """Call the bot, posting on_error_message if it fails"""
+        self.ensure_one()
+        bot = self.bot_manager_id
+        channel = self.channel_id
+        try:
+            with (
+                self.env.cr.savepoint(),
+                metrics.stage_timer(
+                    channel.discuss_hub_connector, f"bot_{bot.bot_type}", event="bot"
+                ),
+            ):
+                bot.outgo(channel, self.partner_id, message=self.message_id)
+        except Exception as e:
+            _logger.error(f"BOTMANAGER: job {self.id} for bot {bot.id} failed: {e}")
+            bot.post_error_message(channel, self.partner_id)
+            self.write(
+                {
+                    "state": "failed",
+                    "error": str(e),
+                    "done_date": fields.Datetime.now(),
+                }
+            )
+            return False
+        self.write({"state": "done", "done_date": fields.Datetime.now()})
+        return True
+
+    @api.model
+    def _fail_stuck_jobs(self):
+        """Jobs running longer than their bot timeout lost their worker"""
+        for job in self.search([("state", "=", "running")]):
+            limit = job.started_date + timedelta(
+                seconds=job.bot_manager_id._request_timeout() + 60
+            )
+            if limit < fields.Datetime.now():
+                job.bot_manager_id.post_error_message(job.channel_id, job.partner_id)
+                job.write(
+                    {
+                        "state": "failed",
+                        "error": "Timed out",
+                        "done_date": fields.Datetime.now(),
+                    }
+                )
+
+    @api.autovacuum
+    def _gc_done_jobs(self):
+        self.search(
+            [
+                ("state", "in", ["done", "failed"]),
+                ("done_date", "<", fields.Datetime.now() - timedelta(days=7)),
+            ]
+        ).unlink()
+
+
+class DiscussHubBotManagerResponseCache(models.Model):
+    """Bot replies cached by normalized prompt, see response_cache_enabled"""
+
+    _name = "discuss_hub.bot_manager.response_cache"
+    _description = "Discuss Hub Bot Manager Response Cache"
+    _order = "last_used_date desc, id desc"
+
+    bot_manager_id = fields.Many2one(
+        comodel_name="discuss_hub.bot_manager",
+        required=True,
+        ondelete="cascade",
+    )
+    key = fields.Char(required=True)
+    prompt = fields.Char(help="Normalized prompt text.")
+    response = fields.Text(required=True, help="Bot replies, as JSON.")
+    expires_at = fields.Datetime(required=True)
+    last_used_date = fields.Datetime(default=fields.Datetime.now)
+    hit_count = fields.Integer()
+
+    _sql_constraints = [
+        (
+            "bot_key_uniq",
+            "unique(bot_manager_id, key)",
+            "This prompt is already cached for the bot.",
+        ),
+    ]
+
+    @api.model
+    def store(self, bot, prompt, key, replies):
+        """Cache (or refresh) the replies to prompt and apply the size limit"""
+        now = fields.Datetime.now()
+        self.env.cr.execute(
+            """
+            INSERT INTO discuss_hub_bot_manager_response_cache
+                (bot_manager_id, key, prompt, response, expires_at,
+                 last_used_date, hit_count,
+                 create_uid, create_date, write_uid, write_date)
+            VALUES (%s, %s, %s, %s, %s, %s, 0, %s, %s, %s, %s)
+            ON CONFLICT (bot_manager_id, key) DO UPDATE
+                SET response = EXCLUDED.response,
+                    expires_at = EXCLUDED.expires_at,
+                    last_used_date = EXCLUDED.last_used_date,
+                    write_uid = EXCLUDED.write_uid,
+                    write_date = EXCLUDED.write_date
+            """,
+            (
+                bot.id,
+                key,
+                prompt,
+                json.dumps(replies),
+                now + timedelta(seconds=bot.response_cache_ttl),
+                now,
+                self.env.uid,
+                now,
+                self.env.uid,
+                now,
+            ),
+        )
+        # least recently used responses above the size limit
+        self.env.cr.execute(
+            """
+            DELETE FROM discuss_hub_bot_manager_response_cache
+            WHERE id IN (
+                SELECT id FROM discuss_hub_bot_manager_response_cache
+                WHERE bot_manager_id = %s
+                ORDER BY last_used_date DESC, id DESC
+                OFFSET %s
+            )
+            """,
+            (bot.id, max(bot.response_cache_size, 1)),
+        )
+        self.invalidate_model()
+
+    @api.autovacuum
+    def _gc_expired_responses(self):
+        self.search([("expires_at", "<", fields.Datetime.now())]).unlink()
+
+
+def _download_media(url, headers, timeout):
+    """Plain HTTP download, safe to run in a thread (no ORM/cursor)"""
+    try:
+        return requests.get(url, headers=headers, timeout=timeout)
+    except requests.RequestException as e:
+        _logger.warning(f"BOTMANAGER: failed to download media {url}: {e}")
+        return None
+
+
+class DiscussHubBotMediaCache(models.Model):
+    """
+    Media downloaded from bot bubbles, keyed by url and by content checksum.
+    Cached files are revalidated with ETag/Last-Modified and are attached to
+    new messages by sharing the cached filestore blob. The least recently
+    used entries are evicted above discuss_hub.bot_media_cache_size_mb.
+    """
+
+    _name = "discuss_hub.bot_media_cache"
+    _description = "Discuss Hub Bot Media Cache"
+    _order = "last_used_date desc, id desc"
+
+    url = fields.Char(required=True)
+    attachment_id = fields.Many2one(
+        comodel_name="ir.attachment",
+        required=True,
+        ondelete="cascade",
+    )
+    checksum = fields.Char(index=True)
+    file_size = fields.Integer()
+    mimetype = fields.Char()
+    etag = fields.Char()
+    last_modified = fields.Char()
+    fresh_until = fields.Datetime(
+        help="Until this date (Cache-Control max-age) the url is not revalidated."
+    )
+    last_used_date = fields.Datetime(default=fields.Datetime.now, index=True)
+    hit_count = fields.Integer()
+
+    _sql_constraints = [
+        ("url_uniq", "unique(url)", "This url is already cached."),
+    ]
+
+    @api.model
+    def fetch(self, url, timeout=30):
+        """
+        Return the cache entry holding the media at url, downloading it only
+        when it is unknown or changed. Returns an empty recordset on failure.
+        """
+        return self.fetch_many([url], timeout=timeout)[url]
+
+    @api.model
+    def fetch_many(self, urls, timeout=30):
+        """
+        Same as fetch for several urls, as a dict url: entry. Downloads run
+        in parallel threads that only do HTTP, the ORM stays in this thread.
+        """
+        entries = {}
+        downloads = {}
+        for url in dict.fromkeys(urls):
+            entry = self.search([("url", "=", url)], limit=1)
+            if entry.fresh_until and entry.fresh_until > fields.Datetime.now():
+                entries[url] = entry._hit()
+                continue
+            headers = {}
+            if entry.etag:
+                headers["If-None-Match"] = entry.etag
+            if entry.last_modified:
+                headers["If-Modified-Since"] = entry.last_modified
+            downloads[url] = (entry, headers)
+        if downloads:
+            with ThreadPoolExecutor(
+                max_workers=min(len(downloads), MEDIA_DOWNLOAD_WORKERS),
+                thread_name_prefix="discuss_hub_bot_media",
+            ) as pool:
+                responses = pool.map(
+                    lambda url: _download_media(url, downloads[url][1], timeout),
+                    downloads,
+                )
+                responses = dict(zip(downloads, responses, strict=True))
+            for url, (entry, _headers) in downloads.items():
+                entries[url] = self._store_response(url, entry, responses[url])
+            self._evict(keep=self.union(*entries.values()))
+        return entries
+
+    @api.model
+    def _store_response(self, url, entry, response):
+        if response is None:
+            return self.browse()
+        if entry and response.status_code == 304:
+            return entry._hit(fresh_until=self._fresh_until(response))
+        if not response.ok:
+            _logger.warning(
+                f"BOTMANAGER: failed to download media {url}: {response.status_code}"
+            )
+            return self.browse()
+
+        Attachment = self.env["ir.attachment"]
+        checksum = Attachment._compute_checksum(response.content)
+        mimetype = response.headers.get("Content-Type")
+        # same content under another url: share its blob
+        same_content = self.search([("checksum", "=", checksum)], limit=1)
+        if entry.checksum == checksum:
+            attachment = entry.attachment_id
+        elif same_content:
+            attachment = same_content.attachment_id
+        else:
+            attachment = Attachment.create(
+                {
+                    "name": urlparse(url).path.rsplit("/", 1)[-1] or "media",
+                    "raw": response.content,
+                    "mimetype": mimetype,
+                    "res_model": self._name,
+                }
+            )
+        values = {
+            "url": url,
+            "attachment_id": attachment.id,
+            "checksum": checksum,
+            "file_size": len(response.content),
+            "mimetype": mimetype,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "fresh_until": self._fresh_until(response),
+            "last_used_date": fields.Datetime.now(),
+        }
+        if entry:
+            previous_attachment = entry.attachment_id
+            entry.write(values)
+            self._unlink_orphan_attachments(previous_attachment)
+        else:
+            try:
+                with self.env.cr.savepoint():
+                    entry = self.create(values)
+            except (IntegrityError, SerializationFailure):
+                # cached meanwhile by another worker, its row is not visible
+                # from this transaction: this download is used, uncached
+                entry = self.new(values)
+                if not same_content:
+                    self.env.cr.precommit.add(attachment.unlink)
+        return entry
+
+    @api.model
+    def _fresh_until(self, response):
+        for directive in response.headers.get("Cache-Control", "").split(","):
+            name, _sep, value = directive.strip().partition("=")
+            if name.lower() == "max-age" and value.isdigit():
+                return fields.Datetime.now() + timedelta(seconds=int(value))
+        return False
+
+    def _hit(self, fresh_until=None):
+        """
+        Count a use of the entry, revalidated until fresh_until if given, once
+        the transaction commits and from a short cursor of its own: popular
+        entries are hit by concurrent jobs.
+        """
+        self.ensure_one()
+        registry, entry_id = self.env.registry, self.id
+        query = """
+            UPDATE discuss_hub_bot_media_cache
+            SET hit_count = hit_count + 1,
+                last_used_date = now() at time zone 'UTC'
+        """
+        params = []
+        if fresh_until is not None:
+            query += ", fresh_until = %s"
+            params.append(fresh_until or None)
+
+        def _count():
+            try:
+                with registry.cursor() as cr:
+                    cr.execute(query + " WHERE id = %s", (*params, entry_id))
+            except Exception as e:
+                _logger.warning(f"BOTMANAGER: could not count media cache hit: {e}")
+
+        self.env.cr.postcommit.add(_count)
+        return self
+
+    def attach_to(self, channel, name=None):
+        """
+        Attachment for a message of channel, sharing the cached filestore
+        blob instead of storing the file again.
+        """
+        self.ensure_one()
+        return self.attachment_id.copy(
+            {
+                "name": name or self.attachment_id.name,
+                "res_model": "discuss.channel",
+                "res_id": channel.id,
+            }
+        )
+
+    @api.model
+    def _unlink_orphan_attachments(self, attachments):
+        used = self.search([("attachment_id", "in", attachments.ids)]).attachment_id
+        (attachments - used).unlink()
+
+    @api.model
+    def _evict(self, keep=None):
+        """Drop the least recently used entries above the size cap"""
+        size_cap = (
+            int(
+                self.env["ir.config_parameter"]
+                .sudo()
+                .get_param("discuss_hub.bot_media_cache_size_mb", 256)
+            )
+            * 1024
+            * 1024
+        )
+        keep = keep or self.browse()
+        self.flush_model(["attachment_id", "file_size", "last_used_date"])
+        # running size of the distinct attachments, most recently used first,
+        # computed in the database rather than by browsing the whole cache
+        self.env.cr.execute(
+            """
+            SELECT id FROM (
+                SELECT id, SUM(size) OVER (
+                    ORDER BY last_used_date DESC NULLS LAST, id DESC
+                ) AS total
+                FROM (
+                    SELECT id, last_used_date,
+                        CASE WHEN ROW_NUMBER() OVER (
+                            PARTITION BY attachment_id
+                            ORDER BY last_used_date DESC NULLS LAST, id DESC
+                        ) = 1 THEN COALESCE(file_size, 0) ELSE 0 END AS size
+                    FROM discuss_hub_bot_media_cache
+                ) AS sized
+            ) AS running
+            WHERE total > %s
+            """,
+            (size_cap,),
+        )
+        evicted = self.browse([row[0] for row in self.env.cr.fetchall()])
+        evicted = evicted.filtered(lambda entry: entry not in keep)
+        if evicted:
+            _logger.info(f"BOTMANAGER: evicting {len(evicted)} cached bot media")
+            attachments = evicted.attachment_id
+            evicted.unlink()
+            self._unlink_orphan_attachments(attachments)
+
+    def action_purge(self):
+        attachments = self.attachment_id
+        self.unlink()
+        self._unlink_orphan_attachments(attachments)
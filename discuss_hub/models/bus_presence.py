@@ -0,0 +1,84 @@
+import logging
+import threading
+import time
+
+from odoo import api, models
+
+_logger = logging.getLogger(__name__)
+
+# seconds a worker trusts its presence snapshot before reading it again
+PRESENCE_SNAPSHOT_TTL = 10
+
+# per worker snapshot of the internal users presence, by database:
+# {dbname: (refreshed_at, {user_id: im_status})}
+_presence_snapshots = {}
+_presence_lock = threading.Lock()
+
+
+def get_presence_snapshot(env):
+    """
+    Presence of the internal users as {user_id: im_status}, read at most
+    every PRESENCE_SNAPSHOT_TTL seconds with a single batched read.
+    Users missing from the snapshot are offline.
+    """
+    dbname = env.cr.dbname
+    with _presence_lock:
+        snapshot = _presence_snapshots.get(dbname)
+    if snapshot and time.monotonic() - snapshot[0] < PRESENCE_SNAPSHOT_TTL:
+        return snapshot[1]
+    users = (
+        env["res.users"]
+        .sudo()
+        .search_read([("share", "=", False)], ["im_status"], load=None)
+    )
+    statuses = {
+        user["id"]: user["im_status"]
+        for user in users
+        if user["im_status"] and user["im_status"] != "offline"
+    }
+    with _presence_lock:
+        _presence_snapshots[dbname] = (time.monotonic(), statuses)
+    return statuses
+
+
+def update_presence_snapshot(env, statuses):
+    """Apply known presence changes ({user_id: im_status}) to the snapshot"""
+    with _presence_lock:
+        snapshot = _presence_snapshots.get(env.cr.dbname)
+        if not snapshot:
+            return
+        presence = dict(snapshot[1])
+        for user_id, status in statuses.items():
+            if status and status != "offline":
+                presence[user_id] = status
+            else:
+                presence.pop(user_id, None)
+        _presence_snapshots[env.cr.dbname] = (snapshot[0], presence)
+
+
+class BusPresence(models.Model):
+    """Feed the routing presence snapshot of this worker"""
+
+    _inherit = "bus.presence"
+
+    def _discuss_hub_update_snapshot(self):
+        update_presence_snapshot(
+            self.env,
+            {
+                presence.user_id.id: presence.status
+                for presence in self
+                if presence.user_id
+            },
+        )
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        presences = super().create(vals_list)
+        presences._discuss_hub_update_snapshot()
+        return presences
+
+    def write(self, vals):
+        res = super().write(vals)
+        if "status" in vals:
+            self._discuss_hub_update_snapshot()
+        return res
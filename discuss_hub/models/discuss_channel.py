@@ -1,4 +1,6 @@
-from odoo import fields, models
+from collections import Counter
+
+from odoo import api, fields, models
 
 
 class DiscussChannel(models.Model):
@@ -19,3 +21,134 @@ class DiscussChannel(models.Model):
     discuss_hub_outgoing_destination = fields.Char(
         string="Discuss Hub Outgoing Destination for this channel"
     )
+    discuss_hub_last_inbound_date = fields.Datetime(
+        string="Last Inbound Message",
+        readonly=True,
+        help="Last message received from the provider.",
+    )
+    discuss_hub_last_outbound_date = fields.Datetime(
+        string="Last Outbound Message",
+        readonly=True,
+        help="Last message posted by an agent or a bot.",
+    )
+    discuss_hub_last_activity_date = fields.Datetime(
+        string="Last Activity",
+        readonly=True,
+        help="Last inbound or outbound message, drives the auto archive.",
+    )
+
+    def init(self):
+        # idle open hub channels lookup of the auto archive cron
+        self.env.cr.execute(
+            """
+            CREATE INDEX IF NOT EXISTS discuss_channel_discuss_hub_idle_idx
+            ON discuss_channel (discuss_hub_connector, discuss_hub_last_activity_date)
+            WHERE active AND discuss_hub_connector IS NOT NULL
+            """
+        )
+        # channels created before the activity dates existed
+        self.env.cr.execute(
+            """
+            UPDATE discuss_channel c
+            SET discuss_hub_last_activity_date = COALESCE(
+                (
+                    SELECT max(m.create_date) FROM mail_message m
+                    WHERE m.model = 'discuss.channel' AND m.res_id = c.id
+                ),
+                c.create_date
+            )
+            WHERE c.discuss_hub_connector IS NOT NULL
+              AND c.discuss_hub_last_activity_date IS NULL
+            """
+        )
+
+    def _discuss_hub_touch(self, inbound):
+        """Record an inbound/outbound message on the hub channels of self"""
+        column = (
+            "discuss_hub_last_inbound_date"
+            if inbound
+            else "discuss_hub_last_outbound_date"
+        )
+        self.env.cr.execute(
+            f"""
+            UPDATE discuss_channel
+            SET {column} = now() at time zone 'UTC',
+                discuss_hub_last_activity_date = now() at time zone 'UTC'
+            WHERE id = ANY(%s) AND discuss_hub_connector IS NOT NULL
+            """,
+            (list(self.ids),),
+        )
+        self.invalidate_recordset([column, "discuss_hub_last_activity_date"])
+
+    def _discuss_hub_open_partners(self):
+        """Member partners of the open connector channels, with repetitions"""
+        return Counter(
+            member.partner_id.id
+            for channel in self
+            if channel.active and channel.discuss_hub_connector
+            for member in channel.channel_member_ids
+            if member.partner_id
+        )
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        # not a field default, so that the install leaves existing rows empty
+        # for the backfill of init
+        now = fields.Datetime.now()
+        vals_list = [
+            dict({"discuss_hub_last_activity_date": now}, **vals) for vals in vals_list
+        ]
+        return super().create(vals_list)
+
+    def write(self, vals):
+        # archiving/unarchiving opens or closes the agents conversations
+        if vals.get("active"):
+            # a reopened conversation is not idle
+            vals = dict(vals, discuss_hub_last_activity_date=fields.Datetime.now())
+        tracked = {"active", "discuss_hub_connector"} & vals.keys()
+        if tracked:
+            before = self._discuss_hub_open_partners()
+        res = super().write(vals)
+        if tracked:
+            after = self._discuss_hub_open_partners()
+            deltas = {
+                partner_id: after[partner_id] - before[partner_id]
+                for partner_id in before.keys() | after.keys()
+            }
+            self.env["discuss_hub.agent_load"].sudo().adjust(deltas)
+        return res
+
+    def unlink(self):
+        closed = self._discuss_hub_open_partners()
+        res = super().unlink()
+        self.env["discuss_hub.agent_load"].sudo().adjust(
+            {partner_id: -count for partner_id, count in closed.items()}
+        )
+        return res
+
+
+class DiscussChannelMember(models.Model):
+    _inherit = ["discuss.channel.member"]
+
+    def _discuss_hub_adjust_load(self, sign):
+        channels = self.channel_id.filtered(
+            lambda c: c.active and c.discuss_hub_connector
+        )
+        counts = Counter(
+            member.partner_id.id
+            for member in self
+            if member.partner_id and member.channel_id in channels
+        )
+        self.env["discuss_hub.agent_load"].sudo().adjust(
+            {partner_id: sign * count for partner_id, count in counts.items()}
+        )
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        members = super().create(vals_list)
+        members._discuss_hub_adjust_load(1)
+        return members
+
+    def unlink(self):
+        self._discuss_hub_adjust_load(-1)
+        return super().unlink()
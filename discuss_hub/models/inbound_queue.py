@@ -0,0 +1,503 @@
+import logging
+import os
+import socket
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from psycopg2.errors import (
+    DeadlockDetected,
+    LockNotAvailable,
+    SerializationFailure,
+)
+
+from odoo import SUPERUSER_ID, api, fields, models
+from odoo.tools import SQL
+
+from . import metrics, wakeup
+
+_logger = logging.getLogger(__name__)
+
+# fixed number of partitions, events of a (connector, contact) always land
+# in the same one. Changing it reorders the events queued meanwhile
+INGEST_PARTITIONS = 64
+# workers refresh their heartbeat, and their partitions, this often
+WORKER_HEARTBEAT_INTERVAL = 5
+# a worker silent for this long left, its partitions move to the others
+WORKER_HEARTBEAT_TTL = 30
+# seconds an idle worker waits while partitions of others are still busy
+WORKER_IDLE_WAIT = 0.5
+# seconds the workers of a cron run take events at most, less within the
+# time limits of the cron workers (see wakeup.cron_run_seconds). The run is
+# then triggered again
+INGEST_RUN_SECONDS = 240
+# attempts of an event failing on a concurrent update before it is failed
+INBOUND_MAX_ATTEMPTS = 5
+CONCURRENCY_ERRORS = (SerializationFailure, LockNotAvailable, DeadlockDetected)
+# lower value is processed first
+INBOUND_LANES = [
+    ("0", "Live Messages"),
+    ("1", "Reactions, Edits and Deletes"),
+    ("2", "Receipts"),
+    ("3", "Contacts, History and Admin"),
+]
+# lane of each event type, see Plugin.get_lane
+LANE_BY_EVENT = {
+    # Evolution
+    "messages.upsert": "0",
+    "messages.edited": "1",
+    "messages.delete": "1",
+    "messages.update": "2",
+    # WhatsApp Cloud
+    "messages": "0",
+    "statuses": "2",
+    # Notificame
+    "MESSAGE": "0",
+    "MESSAGE_STATUS": "2",
+    # Example
+    "text": "0",
+    "read": "2",
+}
+# contacts and chats syncs, history, presence, qrcode/connection updates...
+DEFAULT_LANE = "3"
+# percentage of the ingest workers reserved to each lane
+DEFAULT_LANE_SHARES = "50,20,15,15"
+
+
+def partition_of(connector_id, key):
+    """Partition of the events of contact key on connector"""
+    return zlib.crc32(f"{connector_id}:{key or ''}".encode()) % INGEST_PARTITIONS
+
+
+def lane_workers(max_workers, shares=DEFAULT_LANE_SHARES):
+    """
+    Home lane of each of max_workers workers: one per lane with a share, by
+    priority, the others spread by share. A worker runs the events of its
+    lane first and helps the other lanes when its own one is empty.
+    """
+    lanes = [lane for lane, _label in INBOUND_LANES]
+    values = [float(share) for share in str(shares).split(",")]
+    weights = dict(zip(lanes, values + [0.0] * len(lanes), strict=False))
+    counts = dict.fromkeys(lanes, 0)
+    for lane in [lane for lane in lanes if weights[lane] > 0][:max_workers]:
+        counts[lane] = 1
+    total = sum(weights.values()) or 1
+    for _i in range(max_workers - sum(counts.values())):
+        # next worker to the lane the furthest below its share
+        lane = max(
+            lanes, key=lambda lane: weights[lane] / total - counts[lane] / max_workers
+        )
+        counts[lane] += 1
+    return [lane for lane in lanes for _i in range(counts[lane])]
+
+
+def owned_partitions(worker_id, workers):
+    """
+    Partitions handled by worker_id among the live workers. Rendezvous
+    hashing: when a worker joins or leaves only its own partitions move.
+    """
+    if worker_id not in workers:
+        return []
+    return [
+        partition
+        for partition in range(INGEST_PARTITIONS)
+        if max(workers, key=lambda w: zlib.crc32(f"{w}:{partition}".encode()))
+        == worker_id
+    ]
+
+
+class DiscussHubInboundEvent(models.Model):
+    """
+    Webhook events staged by connectors with queue_inbound, processed by the
+    ingest workers. Events are partitioned by connector and contact: a
+    partition is processed in order by one worker at a time, different
+    partitions in parallel by the workers of every process and node. Live
+    messages go first, see INBOUND_LANES.
+    """
+
+    _name = "discuss_hub.inbound_event"
+    _description = "Discuss Hub Inbound Event"
+    _order = "id"
+
+    connector_id = fields.Many2one(
+        comodel_name="discuss_hub.connector",
+        required=True,
+        index=True,
+        ondelete="cascade",
+    )
+    event = fields.Char()
+    partition_key = fields.Char(
+        string="Contact",
+        help="Contact identifier the event belongs to, its events keep their order.",
+    )
+    partition = fields.Integer(required=True)
+    lane = fields.Selection(
+        selection=INBOUND_LANES,
+        default="0",
+        required=True,
+    )
+    payload = fields.Json(required=True)
+    state = fields.Selection(
+        selection=[
+            ("pending", "Pending"),
+            ("done", "Done"),
+            ("failed", "Failed"),
+        ],
+        default="pending",
+        required=True,
+        index=True,
+    )
+    done_date = fields.Datetime()
+    error = fields.Text()
+    attempt_count = fields.Integer(
+        help="Attempts that failed on a concurrent update, the event was retried.",
+    )
+
+    def init(self):
+        self.env.cr.execute(
+            """
+            CREATE INDEX IF NOT EXISTS discuss_hub_inbound_event_pending_idx
+            ON discuss_hub_inbound_event (partition, id)
+            WHERE state = 'pending'
+            """
+        )
+        self.env.cr.execute(
+            """
+            CREATE INDEX IF NOT EXISTS discuss_hub_inbound_event_lane_idx
+            ON discuss_hub_inbound_event (lane, id)
+            WHERE state = 'pending'
+            """
+        )
+        # live ingest workers of every process and node, see _heartbeat
+        self.env.cr.execute(
+            """
+            CREATE TABLE IF NOT EXISTS discuss_hub_ingest_worker (
+                worker_id varchar PRIMARY KEY,
+                heartbeat timestamp NOT NULL,
+                partition_count integer NOT NULL DEFAULT 0
+            )
+            """
+        )
+        self.env.cr.execute(
+            """
+            ALTER TABLE discuss_hub_ingest_worker
+            ADD COLUMN IF NOT EXISTS lane varchar NOT NULL DEFAULT '0'
+            """
+        )
+
+    @api.model
+    def enqueue(self, connector, payloads):
+        """Stage webhook events of connector and wake up the ingest workers"""
+        plugin = connector.get_plugin()
+        vals_list = []
+        invalid = []
+        for index, payload in enumerate(payloads):
+            if not isinstance(payload, dict):
+                invalid.append(index)
+                continue
+            key = plugin.get_partition_key(payload)
+            vals_list.append(
+                {
+                    "connector_id": connector.id,
+                    "event": plugin.get_event_type(payload),
+                    "partition_key": key,
+                    "partition": partition_of(connector.id, key),
+                    "lane": plugin.get_lane(payload),
+                    "payload": payload,
+                }
+            )
+        events = self.create(vals_list)
+        _logger.info(
+            f"action:inbound_enqueue connector {connector.name} "
+            + f"queued {len(events)} invalid {len(invalid)}"
+        )
+        if events:
+            wakeup.wake(self.env, "inbound", "discuss_hub.ir_cron_discuss_hub_inbound")
+        return {"success": not invalid, "queued": len(events), "invalid": invalid}
+
+    @api.model
+    def _cron_process_inbound(self, max_workers=None):
+        """
+        Run the ingest workers of this process until the queue is empty, for
+        INGEST_RUN_SECONDS at most: what is left is processed by the next run
+        """
+        if getattr(threading.current_thread(), "testing", False):
+            # no threads (nor commits) inside tests
+            while self._run_next_event():
+                pass
+            return
+        params = self.env["ir.config_parameter"].sudo()
+        if max_workers is None:
+            max_workers = int(params.get_param("discuss_hub.ingest_workers", 4))
+        lanes = lane_workers(
+            max(max_workers, 1),
+            params.get_param("discuss_hub.ingest_lane_shares", DEFAULT_LANE_SHARES),
+        )
+        dbname = self.env.cr.dbname
+        prefix = f"{socket.gethostname()}:{os.getpid()}:{time.time_ns()}"
+        deadline = time.monotonic() + wakeup.cron_run_seconds(INGEST_RUN_SECONDS)
+        with ThreadPoolExecutor(
+            max_workers=len(lanes), thread_name_prefix="discuss_hub_ingest"
+        ) as pool:
+            futures = [
+                pool.submit(
+                    self._worker_loop, dbname, f"{prefix}:{index}", lane, deadline
+                )
+                for index, lane in enumerate(lanes)
+            ]
+        left = False
+        for future in futures:
+            try:
+                left = future.result() or left
+            except Exception as e:
+                _logger.error(f"action:ingest_worker database {dbname} failed: {e}")
+                left = True
+        if left:
+            wakeup.wake(self.env, "inbound", "discuss_hub.ir_cron_discuss_hub_inbound")
+
+    @api.model
+    def _worker_loop(self, dbname, worker_id, lane="0", deadline=None):
+        """
+        Take events until the queue is empty (False) or until deadline, a
+        time.monotonic() value, with events left (True). A failing iteration
+        is logged and the worker goes on.
+        """
+        registry = self.env.registry
+        partitions = []
+        refreshed = 0
+        try:
+            while deadline is None or time.monotonic() < deadline:
+                try:
+                    with registry.cursor() as cr:
+                        env = api.Environment(cr, SUPERUSER_ID, {})
+                        Event = env["discuss_hub.inbound_event"]
+                        if time.monotonic() - refreshed > WORKER_HEARTBEAT_INTERVAL:
+                            owned = Event._heartbeat(worker_id, lane)
+                            if owned != partitions:
+                                _logger.info(
+                                    f"action:ingest_rebalance worker {worker_id} "
+                                    + f"lane {lane} owns {len(owned)} partitions"
+                                )
+                            partitions = owned
+                            refreshed = time.monotonic()
+                        # its lane in its partitions first, then help the others
+                        if Event._run_next_event(partitions, [lane]) or (
+                            Event._run_next_event()
+                        ):
+                            continue
+                        if not Event.search_count([("state", "=", "pending")], limit=1):
+                            return False
+                except Exception as e:
+                    _logger.error(
+                        f"action:ingest_worker worker {worker_id} lane {lane} "
+                        + f"failed: {e}"
+                    )
+                # the other partitions are busy, or their worker left: look
+                # at the members again after a short wait
+                refreshed = 0
+                time.sleep(WORKER_IDLE_WAIT)
+            return True
+        finally:
+            with registry.cursor() as cr:
+                cr.execute(
+                    "DELETE FROM discuss_hub_ingest_worker WHERE worker_id = %s",
+                    (worker_id,),
+                )
+
+    @api.model
+    def _heartbeat(self, worker_id, lane="0"):
+        """
+        Mark worker_id alive and return the partitions it owns now among the
+        workers of its lane
+        """
+        cr = self.env.cr
+        cr.execute(
+            """
+            DELETE FROM discuss_hub_ingest_worker
+            WHERE heartbeat < now() at time zone 'UTC' - %s * interval '1 second'
+            """,
+            (WORKER_HEARTBEAT_TTL,),
+        )
+        cr.execute(
+            """
+            INSERT INTO discuss_hub_ingest_worker (worker_id, heartbeat, lane)
+            VALUES (%s, now() at time zone 'UTC', %s)
+            ON CONFLICT (worker_id) DO UPDATE SET heartbeat = EXCLUDED.heartbeat
+            """,
+            (worker_id, lane),
+        )
+        cr.execute(
+            "SELECT worker_id FROM discuss_hub_ingest_worker WHERE lane = %s", (lane,)
+        )
+        workers = [row[0] for row in cr.fetchall()]
+        partitions = owned_partitions(worker_id, workers)
+        cr.execute(
+            """
+            UPDATE discuss_hub_ingest_worker SET partition_count = %s
+            WHERE worker_id = %s
+            """,
+            (len(partitions), worker_id),
+        )
+        return partitions
+
+    @api.model
+    def _run_next_event(self, partitions=None, lanes=None):
+        """
+        Process the next runnable event of partitions (all by default) and
+        lanes (all by default, by priority), if any
+        """
+        if partitions is not None and not partitions:
+            return False
+        conditions = [SQL("e.state = 'pending'")]
+        if partitions is not None:
+            conditions.append(SQL("e.partition = ANY(%s)", list(partitions)))
+        if lanes is not None:
+            conditions.append(SQL("e.lane = ANY(%s)", list(lanes)))
+        busy = []
+        while True:
+            # an event waits for the earlier events of its partition in its
+            # lane or a more urgent one, and stays locked until processed: a
+            # receipt never runs before its message, a live message can pass
+            # a contacts sync of the same contact
+            self.env.cr.execute(
+                SQL(
+                    """
+                    SELECT e.id, e.partition FROM discuss_hub_inbound_event e
+                    WHERE %s
+                      AND e.partition <> ALL(%s)
+                      AND NOT EXISTS (
+                        SELECT 1 FROM discuss_hub_inbound_event o
+                        WHERE o.partition = e.partition AND o.state = 'pending'
+                          AND o.id < e.id AND o.lane <= e.lane
+                      )
+                    ORDER BY e.lane, e.id
+                    LIMIT 1
+                    FOR UPDATE OF e SKIP LOCKED
+                    """,
+                    SQL(" AND ").join(conditions),
+                    busy,
+                )
+            )
+            row = self.env.cr.fetchone()
+            if not row:
+                return False
+            # events of different lanes of a contact may be runnable at once,
+            # one worker at a time per partition
+            self.env.cr.execute(
+                "SELECT pg_try_advisory_xact_lock(hashtext(%s), %s)",
+                ("discuss_hub.inbound_event", row[1]),
+            )
+            if self.env.cr.fetchone()[0]:
+                break
+            busy.append(row[1])
+        self.browse(row[0])._process()
+        return True
+
+    def _process(self):
+        self.ensure_one()
+        connector = self.connector_id
+        metrics.record(
+            self.env.cr.dbname,
+            connector.id,
+            self.event,
+            "inbound_queue",
+            (fields.Datetime.now() - self.create_date).total_seconds(),
+        )
+        try:
+            with self.env.cr.savepoint():
+                connector.process_payload(self.payload)
+        except CONCURRENCY_ERRORS as e:
+            if self.attempt_count + 1 < INBOUND_MAX_ATTEMPTS:
+                # its snapshot is stale: retried in the next transaction
+                _logger.info(
+                    f"action:inbound_retry connector {connector.name} event "
+                    + f"{self.id} partition {self.partition}: {e}"
+                )
+                self.write({"attempt_count": self.attempt_count + 1, "error": str(e)})
+                return False
+            _logger.error(
+                f"action:inbound_process connector {connector.name} event {self.id} "
+                + f"partition {self.partition} failed: {e}"
+            )
+            self.write(
+                {"state": "failed", "error": str(e), "done_date": fields.Datetime.now()}
+            )
+            return False
+        except Exception as e:
+            _logger.error(
+                f"action:inbound_process connector {connector.name} event {self.id} "
+                + f"partition {self.partition} failed: {e}"
+            )
+            self.write(
+                {"state": "failed", "error": str(e), "done_date": fields.Datetime.now()}
+            )
+            return False
+        self.write({"state": "done", "done_date": fields.Datetime.now()})
+        return True
+
+    @api.model
+    def _partition_lag(self):
+        """
+        Pending events, age of the oldest one and worker of each partition of
+        each lane
+        """
+        self.env.cr.execute(
+            """
+            SELECT lane, partition, count(*), min(create_date)
+            FROM discuss_hub_inbound_event
+            WHERE state = 'pending'
+            GROUP BY lane, partition
+            ORDER BY lane, partition
+            """
+        )
+        rows = self.env.cr.fetchall()
+        self.env.cr.execute(
+            """
+            SELECT lane, worker_id FROM discuss_hub_ingest_worker
+            WHERE heartbeat >= now() at time zone 'UTC' - %s * interval '1 second'
+            """,
+            (WORKER_HEARTBEAT_TTL,),
+        )
+        workers = {}
+        for lane, worker in self.env.cr.fetchall():
+            workers.setdefault(lane, []).append(worker)
+        owners = {
+            (lane, partition): worker
+            for lane, members in workers.items()
+            for worker in members
+            for partition in owned_partitions(worker, members)
+        }
+        now = fields.Datetime.now()
+        return [
+            {
+                "lane": lane,
+                "partition": partition,
+                "pending": pending,
+                "lag_seconds": max((now - oldest).total_seconds(), 0),
+                "worker": owners.get((lane, partition)),
+            }
+            for lane, partition, pending, oldest in rows
+        ]
+
+    def action_retry(self):
+        self.write(
+            {"state": "pending", "error": False, "done_date": False, "attempt_count": 0}
+        )
+        wakeup.wake(self.env, "inbound", "discuss_hub.ir_cron_discuss_hub_inbound")
+
+    @api.autovacuum
+    def _gc_processed_events(self):
+        # one row per inbound event, too many to unlink through the ORM
+        self.env.cr.execute(
+            """
+            DELETE FROM discuss_hub_inbound_event
+            WHERE (state = 'done' AND done_date < %s)
+               OR (state = 'failed' AND done_date < %s)
+            """,
+            (
+                fields.Datetime.now() - timedelta(days=1),
+                fields.Datetime.now() - timedelta(days=7),
+            ),
+        )
@@ -1,4 +1,11 @@
+import os
+import time
+from urllib.parse import quote, urljoin
+
 from odoo import fields, models
+from odoo.tools.misc import consteq, hmac
+
+MEDIA_TOKEN_SCOPE = "discuss_hub.media"
 
 
 class IrAttachment(models.Model):
@@ -12,3 +19,32 @@ class IrAttachment(models.Model):
     evo_remote_message_id = fields.Char(string="Evo Remote Message ID")
     # To store the message that originated this attachment"
     evo_local_message_id = fields.Integer(string="Evo Local Message ID")
+
+    def _discuss_hub_media_token(self, expires):
+        """Token signing this attachment download until expires (epoch)"""
+        self.ensure_one()
+        return hmac(self.env, MEDIA_TOKEN_SCOPE, (self.id, int(expires)))
+
+    def discuss_hub_check_media_token(self, expires, token):
+        """Check a signed download token, refusing expired ones"""
+        self.ensure_one()
+        if int(expires) < time.time():
+            return False
+        return consteq(self._discuss_hub_media_token(expires), token or "")
+
+    def discuss_hub_media_path(self, ttl=900):
+        """
+        Short-lived signed path to download this attachment straight from the
+        filestore, so the file can be fetched by providers/bots instead of
+        being inlined as base64.
+        """
+        self.ensure_one()
+        expires = int(time.time()) + ttl
+        token = self._discuss_hub_media_token(expires)
+        filename = quote(self.name or "file", safe="")
+        return f"/discuss_hub/media/{self.id}/{expires}/{token}/{filename}"
+
+    def discuss_hub_media_url(self, ttl=900):
+        """Absolute signed URL, DISCUSS_HUB_INTERNAL_HOST taking precedence"""
+        base_url = os.getenv("DISCUSS_HUB_INTERNAL_HOST") or self.get_base_url()
+        return urljoin(base_url, self.discuss_hub_media_path(ttl=ttl))
@@ -1,4 +1,4 @@
-from odoo import fields, models
+from odoo import api, fields, models
 
 
 class Message(models.Model):
@@ -9,3 +9,39 @@ class Message(models.Model):
 
     _inherit = ["mail.message"]
     discuss_hub_message_id = fields.Char(string="Discuss Hub Message ID", index=True)
+    discuss_hub_inbound = fields.Boolean(
+        string="Received from Provider",
+        default=lambda self: bool(self.env.context.get("discuss_hub_inbound")),
+        help="Created while processing a provider webhook, it must not be sent "
+        "back to the provider.",
+    )
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        messages = super().create(vals_list)
+        # keep the activity dates of the hub channels, for the auto archive
+        channel_messages = messages.filtered(
+            lambda m: m.model == "discuss.channel" and m.message_type == "comment"
+        )
+        for inbound in (True, False):
+            channel_ids = {
+                m.res_id
+                for m in channel_messages
+                if bool(m.discuss_hub_inbound) == inbound
+            }
+            if channel_ids:
+                self.env["discuss.channel"].browse(channel_ids)._discuss_hub_touch(
+                    inbound
+                )
+        return messages
+
+
+class MessageReaction(models.Model):
+    _inherit = ["mail.message.reaction"]
+
+    discuss_hub_inbound = fields.Boolean(
+        string="Received from Provider",
+        default=lambda self: bool(self.env.context.get("discuss_hub_inbound")),
+        help="Created while processing a provider webhook, it must not be sent "
+        "back to the provider.",
+    )
@@ -0,0 +1,218 @@
+import functools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from odoo import sql_db
+
+_logger = logging.getLogger(__name__)
+
+# upper bounds (seconds) of the stage duration histogram
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# seconds a worker keeps its timings in memory before adding them to the
+# discuss_hub_stage_metric table shared by all workers
+METRICS_FLUSH_INTERVAL = 10
+# plugin methods timed on top of process_payload, handle_* are timed too
+INSTRUMENTED_STAGES = ("get_or_create_partner", "get_or_create_channel")
+
+# per worker timings not flushed yet, by database:
+# {dbname: {(connector_id, event, stage): [count, errors, seconds, buckets]}}
+_pending = {}
+_pending_lock = threading.Lock()
+_flush_timers = {}
+_current = threading.local()
+
+
+def current_event():
+    """Event type being processed by this thread, if any"""
+    return getattr(_current, "event", None)
+
+
+@contextmanager
+def event_scope(event):
+    """Label the stages timed by this thread with event"""
+    previous = current_event()
+    _current.event = event
+    try:
+        yield
+    finally:
+        _current.event = previous
+
+
+def record(dbname, connector_id, event, stage, seconds, error=False):
+    """Add one timing to the worker totals, flushed every few seconds"""
+    bucket = len(STAGE_BUCKETS)
+    for index, bound in enumerate(STAGE_BUCKETS):
+        if seconds <= bound:
+            bucket = index
+            break
+    key = (connector_id or 0, event or "none", stage)
+    with _pending_lock:
+        stats = _pending.setdefault(dbname, {}).get(key)
+        if stats is None:
+            stats = _pending[dbname][key] = [0, 0, 0.0, [0] * (len(STAGE_BUCKETS) + 1)]
+        stats[0] += 1
+        stats[1] += int(error)
+        stats[2] += seconds
+        stats[3][bucket] += 1
+        if dbname not in _flush_timers and not getattr(
+            threading.current_thread(), "testing", False
+        ):
+            timer = threading.Timer(METRICS_FLUSH_INTERVAL, _flush_db, (dbname,))
+            timer.daemon = True
+            _flush_timers[dbname] = timer
+            timer.start()
+
+
+@contextmanager
+def stage_timer(connector, stage, event=None):
+    """Time the enclosed block as stage of event for connector"""
+    started = time.perf_counter()
+    error = False
+    try:
+        yield
+    except Exception:
+        error = True
+        raise
+    finally:
+        record(
+            connector.env.cr.dbname,
+            connector.id,
+            event or current_event(),
+            stage,
+            time.perf_counter() - started,
+            error=error,
+        )
+
+
+def instrument_plugin(plugin):
+    """Time the partner/channel lookups and the handlers of a plugin instance"""
+    for name in dir(type(plugin)):
+        if name in INSTRUMENTED_STAGES or name.startswith("handle_"):
+            method = getattr(plugin, name, None)
+            if callable(method):
+                setattr(plugin, name, _timed(plugin, name, method))
+    return plugin
+
+
+def _timed(plugin, stage, method):
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        with stage_timer(plugin.connector, stage):
+            return method(*args, **kwargs)
+
+    return wrapper
+
+
+def flush(cr):
+    """Add the timings of this worker to the shared table"""
+    with _pending_lock:
+        pending = _pending.pop(cr.dbname, None)
+    if not pending:
+        return 0
+    # same row order in every worker, so concurrent flushes cannot deadlock
+    for key, (count, errors, seconds, buckets) in sorted(pending.items()):
+        cr.execute(
+            """
+            INSERT INTO discuss_hub_stage_metric AS m
+                (connector_id, event, stage, count, error_count, total_seconds,
+                buckets)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+            ON CONFLICT (connector_id, event, stage) DO UPDATE SET
+                count = m.count + EXCLUDED.count,
+                error_count = m.error_count + EXCLUDED.error_count,
+                total_seconds = m.total_seconds + EXCLUDED.total_seconds,
+                buckets = ARRAY(
+                    SELECT coalesce(a, 0) + coalesce(b, 0)
+                    FROM unnest(m.buckets, EXCLUDED.buckets)
+                        WITH ORDINALITY AS t(a, b, n)
+                    ORDER BY n
+                )
+            """,
+            (*key, count, errors, seconds, buckets),
+        )
+    return len(pending)
+
+
+def _flush_db(dbname):
+    with _pending_lock:
+        _flush_timers.pop(dbname, None)
+    try:
+        with sql_db.db_connect(dbname).cursor() as cr:
+            flush(cr)
+    except Exception as e:
+        _logger.warning(f"action:metrics_flush database {dbname} failed: {e}")
+
+
+def _label(value):
+    value = str(value).replace("\\", "\\\\").replace('"', '\\"')
+    return value.replace("\n", "\\n")
+
+
+def render_prometheus(env):
+    """Stage metrics of every worker in the Prometheus text format"""
+    flush(env.cr)
+    env.cr.execute(
+        """
+        SELECT connector_id, event, stage, count, error_count, total_seconds,
+            buckets
+        FROM discuss_hub_stage_metric
+        ORDER BY connector_id, event, stage
+        """
+    )
+    rows = env.cr.fetchall()
+    names = {
+        connector.id: connector.name
+        for connector in env["discuss_hub.connector"]
+        .sudo()
+        .with_context(active_test=False)
+        .browse({row[0] for row in rows if row[0]})
+        .exists()
+    }
+    histogram = "discuss_hub_stage_duration_seconds"
+    lines = [
+        f"# HELP {histogram} Time spent in each stage of the webhook pipeline.",
+        f"# TYPE {histogram} histogram",
+    ]
+    errors = [
+        "# HELP discuss_hub_stage_errors_total Stages that raised an exception.",
+        "# TYPE discuss_hub_stage_errors_total counter",
+    ]
+    for connector_id, event, stage, count, error_count, seconds, buckets in rows:
+        labels = (
+            f'connector="{_label(names.get(connector_id, connector_id))}",'
+            + f'event="{_label(event)}",stage="{_label(stage)}"'
+        )
+        cumulative = 0
+        for bound, bucket_count in zip(
+            STAGE_BUCKETS + ("+Inf",), buckets, strict=False
+        ):
+            cumulative += bucket_count
+            lines.append(f'{histogram}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f"{histogram}_sum{{{labels}}} {seconds}")
+        lines.append(f"{histogram}_count{{{labels}}} {count}")
+        errors.append(f"discuss_hub_stage_errors_total{{{labels}}} {error_count}")
+    return "\n".join(lines + errors + _render_partition_lag(env)) + "\n"
+
+
+def _render_partition_lag(env):
+    """Backlog of the inbound queue partitions, see inbound_queue.py"""
+    pending = "discuss_hub_ingest_partition_pending"
+    lag = "discuss_hub_ingest_partition_lag_seconds"
+    pending_lines = [
+        f"# HELP {pending} Queued inbound events of the partition.",
+        f"# TYPE {pending} gauge",
+    ]
+    lag_lines = [
+        f"# HELP {lag} Age of the oldest queued inbound event of the partition.",
+        f"# TYPE {lag} gauge",
+    ]
+    for row in env["discuss_hub.inbound_event"].sudo()._partition_lag():
+        labels = (
+            f'lane="{row["lane"]}",partition="{row["partition"]}",'
+            + f'worker="{_label(row["worker"] or "")}"'
+        )
+        pending_lines.append(f"{pending}{{{labels}}} {row['pending']}")
+        lag_lines.append(f"{lag}{{{labels}}} {row['lag_seconds']}")
+    return pending_lines + lag_lines
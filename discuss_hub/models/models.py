@@ -2,11 +2,18 @@ import importlib
 import logging
 import os
 import sys
+import threading
+import time
 import uuid
+from datetime import timedelta
 
+from markupsafe import Markup
+
+import odoo
 from odoo import api, fields, models
 
-from . import utils
+from . import metrics, payload_log, utils, wakeup
+from .outbox import OUTBOX_PRIORITY_BY_NAME
 
 _logger = logging.getLogger(__name__)
 
@@ -68,6 +75,21 @@ class DiscussHubConnector(models.Model):
     text_message_template = fields.Text(
         default="<p><b>[{{message.author_id.name}}]</b><br /><p>{{body}}</p></p>",
     )
+    outbound_media_mode = fields.Selection(
+        [
+            ("base64", "Inline (base64)"),
+            ("url", "Signed URL"),
+        ],
+        default="base64",
+        required=True,
+        help="How outgoing media is handed to the provider. With Signed URL the "
+        "provider downloads the file from Odoo, streamed from the filestore.",
+    )
+    outbound_media_url_ttl = fields.Integer(
+        default=900,
+        string="Signed URL Lifetime (seconds)",
+        help="How long signed media urls given to providers remain valid.",
+    )
     last_message_date = fields.Datetime(compute="_compute_last_message", store=False)
     channels_total = fields.Integer(
         string="Total Channels", compute="_compute_channels_total", store=False
@@ -91,6 +113,93 @@ class DiscussHubConnector(models.Model):
         required=False,
         store=False,
     )
+    # RATE LIMITING
+    rate_limit_enabled = fields.Boolean(
+        default=False,
+        help="Throttle outgoing messages and reactions with a token bucket. "
+        "Throttled sends are queued in the outbox, never dropped.",
+    )
+    rate_limit_per_second = fields.Float(
+        default=1.0,
+        string="Messages per Second",
+        help="Sustained rate of outgoing sends allowed by the provider.",
+    )
+    rate_limit_burst = fields.Integer(
+        default=5,
+        string="Burst",
+        help="Sends allowed at once before the per second rate applies.",
+    )
+    outbox_queued_count = fields.Integer(
+        string="Queued Sends", compute="_compute_outbox_metrics"
+    )
+    outbox_throttled_count = fields.Integer(
+        string="Throttled Sends (24h)",
+        compute="_compute_outbox_metrics",
+        help="Sends delayed by the rate limiter in the last 24 hours.",
+    )
+    outbox_oldest_queued_date = fields.Datetime(
+        string="Oldest Queued Send", compute="_compute_outbox_metrics"
+    )
+    # CIRCUIT BREAKER
+    circuit_breaker_threshold = fields.Integer(
+        default=0,
+        help="Consecutive provider failures that open the circuit: calls then "
+        "fail immediately and sends are queued until a recovery probe "
+        "succeeds. 0 disables the circuit breaker, 5 is a good start.",
+    )
+    circuit_breaker_cooldown = fields.Integer(
+        default=30,
+        string="Circuit Probe Delay (seconds)",
+        help="Time an open circuit waits before a recovery probe is tried.",
+    )
+    circuit_state = fields.Selection(
+        [
+            ("closed", "Closed"),
+            ("half_open", "Half Open"),
+            ("open", "Open"),
+        ],
+        compute="_compute_circuit_state",
+        help="Provider circuit: Open means the provider is failing and calls "
+        "are not attempted.",
+    )
+    circuit_changed_date = fields.Datetime(compute="_compute_circuit_state")
+    # IDLE CONVERSATIONS
+    auto_archive_idle_hours = fields.Integer(
+        string="Auto Archive After (hours idle)",
+        default=0,
+        help="Archive open channels without inbound nor outbound messages "
+        "for this many hours. Set 0 to disable.",
+    )
+    auto_archive_close_message = fields.Text(
+        help="Message sent before an idle channel is archived, leave empty "
+        "to archive silently.",
+    )
+    # REDELIVERIES
+    dedup_webhooks = fields.Boolean(
+        string="Skip Redelivered Webhooks",
+        default=True,
+        help="Acknowledge webhook events already processed (same provider "
+        "message id, or message id and status) without processing them again.",
+    )
+    webhook_duplicate_count = fields.Integer(
+        string="Redeliveries Skipped",
+        compute="_compute_webhook_duplicate_count",
+        help="Redeliveries checked against the database, those a worker "
+        "recently saw are skipped without a query and only counted in the "
+        "duplicate stage metric.",
+    )
+    # INBOUND QUEUE
+    queue_inbound = fields.Boolean(
+        string="Queue Inbound Events",
+        help="Acknowledge webhook events at once and process them in the "
+        "background, in order for each contact and in parallel across contacts.",
+    )
+    inbound_queued_count = fields.Integer(
+        string="Queued Events", compute="_compute_inbound_metrics"
+    )
+    inbound_oldest_queued_date = fields.Datetime(
+        string="Oldest Queued Event", compute="_compute_inbound_metrics"
+    )
     # EVOLUTION SPECIFIC PROPERTIES
     evolution_allow_broadcast_messages = fields.Boolean(
         default=True, string="Allow Status Broadcast Messages"
@@ -108,9 +217,87 @@ class DiscussHubConnector(models.Model):
     whatsapp_cloud_reengage_template = fields.Char(
         help="Template to use for re-engaging with users on after chat window",
     )
+    whatsapp_cloud_media_cache_days = fields.Integer(
+        default=29,
+        string="Media Cache (days)",
+        help="Reuse uploaded media ids for identical attachments during this many "
+        "days. Graph keeps media for 30 days. Set 0 to always upload.",
+    )
     # QR CODE BASE CONNECTORS
     qr_code_base64 = fields.Text(compute="_compute_status", store=False)
 
+    def _compute_webhook_duplicate_count(self):
+        counts = {
+            connector.id: hits
+            for connector, hits in self.env["discuss_hub.webhook_delivery"]
+            .sudo()
+            ._read_group(
+                [("connector_id", "in", self.ids)],
+                groupby=["connector_id"],
+                aggregates=["hit_count:sum"],
+            )
+        }
+        for connector in self:
+            connector.webhook_duplicate_count = counts.get(connector.id, 0)
+
+    def _compute_inbound_metrics(self):
+        stats = {
+            connector.id: (count, oldest)
+            for connector, count, oldest in self.env["discuss_hub.inbound_event"]
+            .sudo()
+            ._read_group(
+                [("connector_id", "in", self.ids), ("state", "=", "pending")],
+                groupby=["connector_id"],
+                aggregates=["__count", "create_date:min"],
+            )
+        }
+        for connector in self:
+            count, oldest = stats.get(connector.id, (0, None))
+            connector.inbound_queued_count = count
+            connector.inbound_oldest_queued_date = oldest
+
+    def init(self):
+        # provider circuit state shared by all workers, see plugins/transport.py
+        self.env.cr.execute(
+            """
+            CREATE TABLE IF NOT EXISTS discuss_hub_circuit (
+                connector_id integer NOT NULL,
+                host varchar NOT NULL,
+                state varchar NOT NULL,
+                changed_at timestamp NOT NULL,
+                PRIMARY KEY (connector_id, host)
+            )
+            """
+        )
+        # stage timings of all workers, see metrics.py
+        self.env.cr.execute(
+            """
+            CREATE TABLE IF NOT EXISTS discuss_hub_stage_metric (
+                connector_id integer NOT NULL,
+                event varchar NOT NULL,
+                stage varchar NOT NULL,
+                count bigint NOT NULL,
+                error_count bigint NOT NULL,
+                total_seconds double precision NOT NULL,
+                buckets bigint[] NOT NULL,
+                PRIMARY KEY (connector_id, event, stage)
+            )
+            """
+        )
+
+    def _register_hook(self):
+        super()._register_hook()
+        # long running LISTEN/drain threads only in a threaded server. Prefork
+        # workers are recycled and limited in CPU time, there the queue crons
+        # are triggered instead and run by the cron workers
+        if not (
+            odoo.evented
+            or odoo.tools.config["workers"]
+            or odoo.tools.config["test_enable"]
+            or odoo.tools.config["stop_after_init"]
+        ):
+            wakeup.start(self.env.cr.dbname)
+
     def action_send_msg(self):
         """This function is called when the user clicks the
         'Send WhatsApp Message' button on a partner's form view. It opens a
@@ -208,6 +395,42 @@ class DiscussHubConnector(models.Model):
                 ]
             )
 
+    def _compute_outbox_metrics(self):
+        outbox = self.env["discuss_hub.outbox"]
+        since = fields.Datetime.now() - timedelta(days=1)
+        for connector in self:
+            queued = outbox.search(
+                [("connector_id", "=", connector.id), ("state", "=", "queued")],
+                order="id asc",
+            )
+            connector.outbox_queued_count = len(queued)
+            connector.outbox_oldest_queued_date = (
+                queued[:1].create_date if queued else None
+            )
+            connector.outbox_throttled_count = outbox.search_count(
+                [("connector_id", "=", connector.id), ("create_date", ">=", since)]
+            )
+
+    def _compute_circuit_state(self):
+        states = {}
+        if self.ids:
+            self.env.cr.execute(
+                """
+                SELECT connector_id, state, changed_at FROM discuss_hub_circuit
+                WHERE connector_id IN %s
+                ORDER BY changed_at
+                """,
+                (tuple(self.ids),),
+            )
+            for connector_id, state, changed_at in self.env.cr.fetchall():
+                # an open host makes the connector open
+                if states.get(connector_id, ("closed",))[0] != "open":
+                    states[connector_id] = (state, changed_at)
+        for connector in self:
+            state, changed_at = states.get(connector.id, ("closed", None))
+            connector.circuit_state = state
+            connector.circuit_changed_date = changed_at
+
     @api.depends("api_key", "url", "name")
     def _compute_status(self):
         for connector in self:
@@ -236,10 +459,82 @@ class DiscussHubConnector(models.Model):
     #
     def process_payload(self, payload):
         """
-        Channel the incoming payload to the appropriate plugin handlers
+        Channel the incoming payload to the appropriate plugin handlers.
+        Records created meanwhile are flagged discuss_hub_inbound so the
+        outgo automations do not echo them back to the provider.
         """
-        plugin = self.get_plugin()
-        return plugin.process_payload(payload)
+        plugin = self.with_context(discuss_hub_inbound=True).get_plugin()
+        event = plugin.get_event_type(payload)
+        started = time.perf_counter()
+        response = None
+        try:
+            # providers redeliver on timeouts, acknowledge what was processed
+            key = self.dedup_webhooks and plugin.get_dedup_key(payload)
+            Delivery = self.env["discuss_hub.webhook_delivery"].sudo()
+            if key and not Delivery.claim(self, event, str(key)):
+                response = {
+                    "success": True,
+                    "action": "process_payload",
+                    "event": event,
+                    "duplicate": True,
+                    "message": "Already processed",
+                }
+                return response
+            with (
+                metrics.event_scope(event),
+                metrics.stage_timer(self, "process_payload"),
+            ):
+                response = metrics.instrument_plugin(plugin).process_payload(payload)
+            if key:
+                Delivery.remember(self, event, str(key))
+            return response
+        finally:
+            payload_log.log_event(
+                _logger,
+                "process_payload",
+                connector=self,
+                event=event,
+                payload=payload,
+                duration_ms=round((time.perf_counter() - started) * 1000, 1),
+                success=response.get("success")
+                if isinstance(response, dict)
+                else response is not None,
+            )
+
+    def process_payloads(self, payloads):
+        """
+        Process a batch of events in order, each one in its own savepoint so
+        a failing event is rolled back alone, and report the result of each
+        """
+        results = []
+        for index, payload in enumerate(payloads):
+            if not isinstance(payload, dict):
+                results.append(
+                    {"index": index, "success": False, "error": "Invalid JSON event"}
+                )
+                continue
+            try:
+                with self.env.cr.savepoint():
+                    response = self.process_payload(payload)
+            except Exception as e:
+                _logger.error(
+                    f"action:process_payloads connector {self.name} event {index} "
+                    + f"failed: {e}"
+                )
+                response = {"success": False, "error": str(e)}
+            if isinstance(response, dict):
+                result = dict(response)
+            else:
+                # challenges and plugin Responses have no place in a batch
+                status = getattr(response, "status_code", 200)
+                result = {"success": status < 400, "status": status}
+            result["index"] = index
+            results.append(result)
+        return {
+            "success": all(result.get("success") is not False for result in results),
+            "count": len(results),
+            "results": results,
+        }
 
     def restart_instance(self):
         """RESTART connector"""
@@ -255,7 +550,17 @@ class DiscussHubConnector(models.Model):
             plugin = self.get_plugin()
             plugin.logout_instance()
 
-    def outgo_message(self, channel, message):
+    def outgo_messages(self, channel, messages):
+        """
+        Send several messages of channel in order, e.g. the bubbles of a bot
+        reply, sharing one plugin instance and so one keep-alive HTTP session.
+        """
+        plugin = self.get_plugin() if self.enabled and messages else None
+        return [
+            self.outgo_message(channel, message, plugin=plugin) for message in messages
+        ]
+
+    def outgo_message(self, channel, message, plugin=None):
         """
         This method will receive the channel and message
         from the channel base automation and pass it over to the connector
@@ -268,8 +573,21 @@ class DiscussHubConnector(models.Model):
                 f"{message.id if message else 'None'}"
             )
             return
-        plugin = self.get_plugin()
-        return plugin.outgo_message(channel, message)
+        if message.discuss_hub_inbound:
+            # came from the provider (e.g. fromMe messages), do not echo it
+            _logger.debug(
+                f"action:outgo_message connector {self.name} skipping inbound "
+                + f"message {message.id}"
+            )
+            return
+        priority = self._outbox_priority(message)
+        if not self._rate_limit_allows(channel, priority):
+            return self.env["discuss_hub.outbox"].sudo().enqueue(
+                self, channel, message, priority
+            )
+        plugin = plugin or self.get_plugin()
+        with metrics.stage_timer(self, "outgo_message", event="outbound"):
+            return plugin.outgo_message(channel, message)
 
     def outgo_reaction(self, channel, message, reaction):
         """
@@ -288,8 +606,157 @@ class DiscussHubConnector(models.Model):
         if not channel or not message or not reaction:
             _logger.error("Missing channel, message or reaction in outgo_reaction")
             return
+        if reaction.discuss_hub_inbound:
+            # reaction received from the provider, do not send it back
+            return
+        priority = OUTBOX_PRIORITY_BY_NAME["reaction"]
+        if not self._rate_limit_allows(channel, priority):
+            return self.env["discuss_hub.outbox"].sudo().enqueue(
+                self, channel, message, priority, reaction=reaction
+            )
         plugin = self.get_plugin()
-        return plugin.outgo_reaction(channel, message, reaction)
+        with metrics.stage_timer(self, "outgo_reaction", event="outbound"):
+            return plugin.outgo_reaction(channel, message, reaction)
+
+    # Rate limiting
+
+    def _outbox_priority(self, message):
+        """
+        Priority class of an outgoing message. Bulk senders (campaigns) set
+        the discuss_hub_outbox_priority="bulk" context key.
+        """
+        name = self.env.context.get("discuss_hub_outbox_priority")
+        if not name:
+            name = "bot" if message.author_id.bot else "agent"
+        return OUTBOX_PRIORITY_BY_NAME.get(name, OUTBOX_PRIORITY_BY_NAME["agent"])
+
+    def _rate_limit_allows(self, channel, priority):
+        """Whether a send can go out now instead of being queued"""
+        self.ensure_one()
+        if not self.rate_limit_enabled and not self.circuit_breaker_threshold:
+            return True
+        if self.circuit_breaker_threshold and self.circuit_state == "open":
+            return False
+        outbox = self.env["discuss_hub.outbox"].sudo()
+        if outbox.has_pending(self, channel, priority):
+            return False
+        return self._rate_limit_acquire()
+
+    def _rate_limit_acquire(self):
+        """
+        Take one token from the connector bucket, returns False if throttled.
+        The bucket is shared by all workers and updated in its own transaction
+        so it is never locked for the duration of the caller transaction.
+        """
+        self.ensure_one()
+        if not self.rate_limit_enabled:
+            return True
+        rate = max(self.rate_limit_per_second, 0.001)
+        burst = max(self.rate_limit_burst, 1)
+        with self.env.registry.cursor() as cr:
+            cr.execute(
+                """
+                INSERT INTO discuss_hub_rate_bucket AS b
+                    (connector_id, tokens, updated_at)
+                VALUES (%(id)s, %(burst)s - 1, clock_timestamp())
+                ON CONFLICT (connector_id) DO UPDATE
+                SET tokens = LEAST(
+                        %(burst)s,
+                        b.tokens + EXTRACT(
+                            EPOCH FROM clock_timestamp() - b.updated_at
+                        ) * %(rate)s
+                    ) - 1,
+                    updated_at = clock_timestamp()
+                WHERE LEAST(
+                    %(burst)s,
+                    b.tokens + EXTRACT(
+                        EPOCH FROM clock_timestamp() - b.updated_at
+                    ) * %(rate)s
+                ) >= 1
+                RETURNING tokens
+                """,
+                {"id": self.id, "burst": burst, "rate": rate},
+            )
+            return bool(cr.fetchone())
+
+    def _rate_limit_delay(self):
+        """Seconds until the bucket refills one token"""
+        self.ensure_one()
+        return 1.0 / max(self.rate_limit_per_second, 0.001)
+
+    # Circuit breaker
+
+    def _notify_circuit_state(self, host, state):
+        """Tell the manager channels the provider circuit changed"""
+        emoji = {"open": "🔴", "half_open": "🟡", "closed": "🟢"}.get(state, "")
+        body = Markup("Instance:{}: provider {} <b>{}</b>:{}").format(
+            self.name, host, state.upper().replace("_", " "), emoji
+        )
+        for channel in self.manager_channel:
+            channel.message_post(
+                author_id=self.default_admin_partner_id.id,
+                body=body,
+                message_type="comment",
+                subtype_xmlid="mail.mt_comment",
+            )
+        if state == "closed":
+            # provider is back, send what was queued while it was down
+            wakeup.wake(self.env, "outbox", "discuss_hub.ir_cron_discuss_hub_outbox")
+
+    @api.model
+    def _cron_auto_archive_idle(self, limit=500):
+        """
+        Archive the idle channels of the connectors with an auto archive
+        policy, at most limit channels per connector and run
+        """
+        auto_commit = not getattr(threading.current_thread(), "testing", False)
+        Channel = self.env["discuss.channel"]
+        for connector in self.search([("auto_archive_idle_hours", ">", 0)]):
+            idle_since = fields.Datetime.now() - timedelta(
+                hours=connector.auto_archive_idle_hours
+            )
+            channels = Channel.search(
+                [
+                    ("discuss_hub_connector", "=", connector.id),
+                    ("discuss_hub_last_activity_date", "<", idle_since),
+                ],
+                order="discuss_hub_last_activity_date",
+                limit=limit,
+            )
+            if not channels:
+                continue
+            _logger.info(
+                f"action:auto_archive connector {connector.name}: "
+                + f"archiving {len(channels)} idle channels"
+            )
+            self.env["discuss_hub.bulk_operation"].launch(
+                "archive",
+                channels,
+                inline=True,
+                auto_commit=auto_commit,
+                close_message=connector.auto_archive_close_message,
+                send_close_message=bool(connector.auto_archive_close_message),
+            )
+            if len(channels) == limit:
+                # more to archive, continue in a next run
+                self.env.ref("discuss_hub.ir_cron_discuss_hub_auto_archive")._trigger()
+
+    @api.model
+    def _cron_circuit_probe(self):
+        """Probe the providers of open circuits after their cool down"""
+        self.env.cr.execute(
+            """
+            SELECT DISTINCT c.connector_id FROM discuss_hub_circuit c
+            JOIN discuss_hub_connector dc ON dc.id = c.connector_id
+            WHERE c.state <> 'closed'
+              AND c.changed_at < (now() at time zone 'UTC')
+                  - make_interval(secs => dc.circuit_breaker_cooldown)
+            """
+        )
+        connector_ids = [row[0] for row in self.env.cr.fetchall()]
+        for connector in self.browse(connector_ids).exists():
+            _logger.info(f"action:circuit_probe connector {connector.name}")
+            connector.get_plugin().probe_circuit()
 
     def sync_contacts(self):
         plugin = self.get_plugin()
@@ -317,6 +784,91 @@ class DiscussHubConnector(models.Model):
         return set(partners)
 
 
+class DiscussHubConnectorMedia(models.Model):
+    """
+    Cache of media already uploaded to the provider, keyed by the attachment
+    checksum, so identical files are not uploaded again while the provider
+    still holds them.
+    """
+
+    _name = "discuss_hub.connector.media"
+    _description = "Discuss Hub Connector Uploaded Media"
+
+    connector_id = fields.Many2one(
+        comodel_name="discuss_hub.connector",
+        required=True,
+        index=True,
+        ondelete="cascade",
+    )
+    checksum = fields.Char(required=True)
+    media_id = fields.Char(required=True)
+    expires_at = fields.Datetime(required=True, index=True)
+
+    _sql_constraints = [
+        (
+            "connector_checksum_uniq",
+            "unique(connector_id, checksum)",
+            "Media is already cached for this connector.",
+        ),
+    ]
+
+    @api.model
+    def get_media_id(self, connector, checksum):
+        """Return the cached media id for checksum, or None if missing/expired"""
+        if not checksum:
+            return None
+        cached = self.search(
+            [
+                ("connector_id", "=", connector.id),
+                ("checksum", "=", checksum),
+                ("expires_at", ">", fields.Datetime.now()),
+            ],
+            limit=1,
+        )
+        return cached.media_id or None
+
+    @api.model
+    def set_media_id(self, connector, checksum, media_id, days):
+        """Store (or refresh) the media id uploaded for checksum"""
+        if not checksum or not media_id or days <= 0:
+            return
+        expires_at = fields.Datetime.now() + timedelta(days=days)
+        self.env.cr.execute(
+            """
+            INSERT INTO discuss_hub_connector_media
+                (connector_id, checksum, media_id, expires_at,
+                 create_uid, create_date, write_uid, write_date)
+            VALUES (%s, %s, %s, %s, %s, now() at time zone 'UTC',
+                    %s, now() at time zone 'UTC')
+            ON CONFLICT (connector_id, checksum) DO UPDATE
+                SET media_id = EXCLUDED.media_id,
+                    expires_at = EXCLUDED.expires_at,
+                    write_uid = EXCLUDED.write_uid,
+                    write_date = EXCLUDED.write_date
+            """,
+            (
+                connector.id,
+                checksum,
+                media_id,
+                expires_at,
+                self.env.uid,
+                self.env.uid,
+            ),
+        )
+        self.invalidate_model()
+
+    @api.model
+    def drop_media_id(self, connector, checksum):
+        """Forget a cached media id (e.g. the provider rejected it)"""
+        self.search(
+            [("connector_id", "=", connector.id), ("checksum", "=", checksum)]
+        ).unlink()
+
+    @api.autovacuum
+    def _gc_expired_media(self):
+        self.search([("expires_at", "<=", fields.Datetime.now())]).unlink()
+
+
 class DiscussHubSocialNetworkeType(models.Model):
     _name = "discuss_hub.social_network_type"
     _description = "Social Network Types"
@@ -0,0 +1,245 @@
+import logging
+import threading
+from datetime import timedelta
+
+from odoo import api, fields, models
+
+from . import wakeup
+
+_logger = logging.getLogger(__name__)
+
+# lower value is sent first
+OUTBOX_PRIORITIES = [
+    ("0", "Agent Reply"),
+    ("1", "Bot Reply"),
+    ("2", "Reaction"),
+    ("3", "Bulk Campaign"),
+]
+OUTBOX_PRIORITY_BY_NAME = {
+    "agent": "0",
+    "bot": "1",
+    "reaction": "2",
+    "bulk": "3",
+}
+
+
+class DiscussHubOutbox(models.Model):
+    """
+    Outgoing messages and reactions held back by the connector rate limiter.
+    They are sent by priority (agent replies first, bulk campaigns last),
+    keeping the order of each channel, as soon as the token bucket of the
+    connector allows it.
+    """
+
+    _name = "discuss_hub.outbox"
+    _description = "Discuss Hub Outbox"
+    _order = "priority, id"
+
+    connector_id = fields.Many2one(
+        comodel_name="discuss_hub.connector",
+        required=True,
+        index=True,
+        ondelete="cascade",
+    )
+    channel_id = fields.Many2one(
+        comodel_name="discuss.channel",
+        required=True,
+        ondelete="cascade",
+    )
+    message_id = fields.Many2one(
+        comodel_name="mail.message",
+        required=True,
+        ondelete="cascade",
+    )
+    reaction_id = fields.Many2one(
+        comodel_name="mail.message.reaction",
+        ondelete="cascade",
+        help="Set when the queued item is a reaction to message_id.",
+    )
+    priority = fields.Selection(
+        selection=OUTBOX_PRIORITIES,
+        default="0",
+        required=True,
+    )
+    state = fields.Selection(
+        selection=[
+            ("queued", "Queued"),
+            ("sent", "Sent"),
+            ("failed", "Failed"),
+        ],
+        default="queued",
+        required=True,
+        index=True,
+    )
+    sent_date = fields.Datetime()
+    error = fields.Text()
+
+    def init(self):
+        # token buckets live outside the ORM, they are updated in their own
+        # short transaction so concurrent sends never wait on each other
+        self.env.cr.execute(
+            """
+            CREATE TABLE IF NOT EXISTS discuss_hub_rate_bucket (
+                connector_id integer PRIMARY KEY,
+                tokens double precision NOT NULL,
+                updated_at timestamp NOT NULL
+            )
+            """
+        )
+        self.env.cr.execute(
+            """
+            CREATE INDEX IF NOT EXISTS discuss_hub_outbox_queued_idx
+            ON discuss_hub_outbox (connector_id, priority, id)
+            WHERE state = 'queued'
+            """
+        )
+
+    @api.model
+    def enqueue(self, connector, channel, message, priority, reaction=None):
+        """Queue an outgoing message/reaction and wake up the outbox cron"""
+        item = self.create(
+            {
+                "connector_id": connector.id,
+                "channel_id": channel.id,
+                "message_id": message.id,
+                "reaction_id": reaction.id if reaction else False,
+                "priority": priority,
+            }
+        )
+        item._keep_channel_order()
+        _logger.info(
+            f"action:outbox_enqueue connector {connector.name} channel {channel.id} "
+            + f"message {message.id} priority {priority}: throttled"
+        )
+        # throttled: nothing can be sent before the bucket refills
+        self.env.ref("discuss_hub.ir_cron_discuss_hub_outbox")._trigger(
+            fields.Datetime.now() + timedelta(seconds=connector._rate_limit_delay())
+        )
+        return item
+
+    def _keep_channel_order(self):
+        """
+        Items are drained by priority, then id. Within a channel priorities
+        must not decrease with the id: the earlier items of the channel take
+        the priority of a more urgent later item, a retried item the one of
+        the later items it must precede.
+        """
+        for item in self:
+            channel_items = [
+                ("channel_id", "=", item.channel_id.id),
+                ("state", "=", "queued"),
+            ]
+            later = self.search(
+                channel_items
+                + [("id", ">", item.id), ("priority", "<", item.priority)],
+                order="priority",
+                limit=1,
+            )
+            if later:
+                item.priority = later.priority
+            self.search(
+                channel_items
+                + [("id", "<", item.id), ("priority", ">", item.priority)]
+            ).priority = item.priority
+
+    @api.model
+    def has_pending(self, connector, channel, priority):
+        """
+        True when a send must wait behind queued items: anything at the same or
+        a higher priority, or anything already queued for the same channel.
+        """
+        return bool(
+            self.search_count(
+                [
+                    ("connector_id", "=", connector.id),
+                    ("state", "=", "queued"),
+                    "|",
+                    ("priority", "<=", priority),
+                    ("channel_id", "=", channel.id),
+                ],
+                limit=1,
+            )
+        )
+
+    @api.model
+    def _cron_process_outbox(self, limit=500):
+        """Send queued items of every connector as tokens allow"""
+        auto_commit = not getattr(threading.current_thread(), "testing", False)
+        connectors = self.search([("state", "=", "queued")]).connector_id
+        # nothing to try while the provider circuit is open
+        connectors = connectors.filtered(lambda c: c.circuit_state != "open")
+        for connector in connectors:
+            self._process_connector_queue(connector, limit, auto_commit)
+
+    @api.model
+    def _process_connector_queue(self, connector, limit=500, auto_commit=False):
+        # only one drainer per connector, other workers skip it. A session
+        # lock is used as the loop commits after each send
+        lock_key = ("discuss_hub.outbox", connector.id)
+        self.env.cr.execute("SELECT pg_try_advisory_lock(hashtext(%s), %s)", lock_key)
+        if not self.env.cr.fetchone()[0]:
+            return
+        try:
+            items = self.search(
+                [("connector_id", "=", connector.id), ("state", "=", "queued")],
+                limit=limit,
+            )
+            blocked_channels = set()
+            for item in items:
+                # keep the order of each channel: once one item of a channel
+                # waits, the following ones of that channel wait too
+                if item.channel_id.id in blocked_channels:
+                    continue
+                # a circuit opened by the previous sends: the rest stays
+                # queued until a recovery probe succeeds
+                connector.invalidate_recordset(["circuit_state"])
+                if connector.circuit_state == "open":
+                    break
+                if not connector._rate_limit_acquire():
+                    self.env.ref("discuss_hub.ir_cron_discuss_hub_outbox")._trigger(
+                        fields.Datetime.now()
+                        + timedelta(seconds=connector._rate_limit_delay())
+                    )
+                    break
+                item._send()
+                if item.state != "sent":
+                    blocked_channels.add(item.channel_id.id)
+                if auto_commit:
+                    self.env.cr.commit()
+        finally:
+            self.env.cr.execute("SELECT pg_advisory_unlock(hashtext(%s), %s)", lock_key)
+
+    def _send(self):
+        self.ensure_one()
+        plugin = self.connector_id.get_plugin()
+        try:
+            if self.reaction_id:
+                result = plugin.outgo_reaction(
+                    self.channel_id, self.message_id, self.reaction_id
+                )
+            else:
+                result = plugin.outgo_message(self.channel_id, self.message_id)
+        except Exception as e:
+            _logger.error(f"action:outbox_send {self} failed: {e}")
+            self.write({"state": "failed", "error": str(e)})
+            return
+        # plugins return nothing when sent, False when the provider refused
+        if result is False:
+            _logger.error(f"action:outbox_send {self} failed: refused by provider")
+            self.write({"state": "failed", "error": "Refused by the provider"})
+            return
+        self.write({"state": "sent", "sent_date": fields.Datetime.now()})
+
+    def action_retry(self):
+        self.write({"state": "queued", "error": False})
+        self.sorted("id")._keep_channel_order()
+        wakeup.wake(self.env, "outbox", "discuss_hub.ir_cron_discuss_hub_outbox")
+
+    @api.autovacuum
+    def _gc_sent_outbox(self):
+        self.search(
+            [
+                ("state", "=", "sent"),
+                ("sent_date", "<", fields.Datetime.now() - timedelta(days=7)),
+            ]
+        ).unlink()
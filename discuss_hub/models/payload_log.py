@@ -0,0 +1,196 @@
+import hashlib
+import json
+import logging
+import re
+import threading
+
+# longest string kept as is in a logged payload
+MAX_FIELD_LENGTH = 256
+# items kept from each list/dict, and nesting levels kept
+MAX_ITEMS = 20
+MAX_DEPTH = 10
+# longest JSON line written for one event
+MAX_LINE_LENGTH = 4096
+# bytes of a blob hashed to identify it, enough to tell files apart
+HASH_PREFIX_BYTES = 65536
+# keys whose values never reach the logs
+SECRET_KEYS = {
+    "apikey",
+    "api_key",
+    "authorization",
+    "password",
+    "token",
+    "access_token",
+    "verify_token",
+    "hub.verify_token",
+    "jpegthumbnail",
+}
+# repetitive events only logged once every SAMPLE_RATE, per connector
+SAMPLED_EVENTS = {
+    "messages.update",
+    "contacts.upsert",
+    "contacts.update",
+    "chats.update",
+    "chats.upsert",
+    "presence.update",
+    "statuses",
+}
+SAMPLE_RATE = 20
+
+_BASE64 = re.compile(r"^(?:data:[\w/+.-]+;base64,)?[A-Za-z0-9+/=\r\n_-]+$")
+# per worker counters of the sampled events: {(connector, event): seen}
+_sampled = {}
+_sampled_lock = threading.Lock()
+
+
+def _blob(value):
+    digest = hashlib.sha256(value[:HASH_PREFIX_BYTES].encode()).hexdigest()[:16]
+    return f"<blob len={len(value)} sha256={digest}>"
+
+
+def redact(value, depth=0):
+    """
+    Copy of value safe to log: secrets masked, base64 blobs replaced by
+    their length and hash, long strings, lists and nesting cut.
+    """
+    if isinstance(value, str):
+        if len(value) <= MAX_FIELD_LENGTH:
+            return value
+        if _BASE64.match(value[:MAX_FIELD_LENGTH]):
+            return _blob(value)
+        return f"{value[:MAX_FIELD_LENGTH]}...<+{len(value) - MAX_FIELD_LENGTH}>"
+    if isinstance(value, bytes):
+        return f"<bytes len={len(value)}>"
+    if depth >= MAX_DEPTH and isinstance(value, dict | list | tuple):
+        return f"<{type(value).__name__} len={len(value)}>"
+    if isinstance(value, dict):
+        redacted = {}
+        for index, (key, item) in enumerate(value.items()):
+            if index == MAX_ITEMS:
+                redacted["..."] = f"<+{len(value) - MAX_ITEMS} keys>"
+                break
+            if str(key).lower() in SECRET_KEYS:
+                redacted[key] = "***"
+            else:
+                redacted[key] = redact(item, depth + 1)
+        return redacted
+    if isinstance(value, list | tuple):
+        redacted = [redact(item, depth + 1) for item in value[:MAX_ITEMS]]
+        if len(value) > MAX_ITEMS:
+            redacted.append(f"<+{len(value) - MAX_ITEMS} items>")
+        return redacted
+    if value is None or isinstance(value, bool | int | float):
+        return value
+    return redact(str(value), depth)
+
+
+def dumps(value, max_length=MAX_LINE_LENGTH):
+    """Compact, redacted and bounded JSON of value"""
+    line = json.dumps(
+        redact(value), ensure_ascii=False, separators=(",", ":"), default=str
+    )
+    if len(line) > max_length:
+        line = f"{line[:max_length]}...<+{len(line) - max_length}>"
+    return line
+
+
+def raw_body(data):
+    """Length and hash of a request body that could not be parsed"""
+    if isinstance(data, bytes):
+        data = data.decode(errors="replace")
+    return redact(data) if len(data) <= MAX_FIELD_LENGTH else _blob(data)
+
+
+def _dig(payload, *path):
+    for key in path:
+        if isinstance(payload, list):
+            payload = payload[0] if payload else None
+        if not isinstance(payload, dict):
+            return None
+        payload = payload.get(key)
+    return payload
+
+
+def _first_id(payload, *paths):
+    for path in paths:
+        value = _dig(payload, *path)
+        if isinstance(value, str | int) and value:
+            return value
+    return None
+
+
+def payload_ids(payload):
+    """Provider message and contact ids of a payload, for the log line"""
+    if not isinstance(payload, dict):
+        return {}
+    # WhatsApp Cloud nests the event in entry/changes/value
+    value = _dig(payload, "entry", "changes", "value")
+    message_id = _first_id(
+        payload,
+        ("data", "key", "id"),
+        ("data", "keyId"),
+        ("data", "id"),
+        ("message_id",),
+        ("id",),
+    ) or _first_id(value, ("messages", "id"), ("statuses", "id"))
+    contact = _first_id(
+        payload,
+        ("data", "key", "remoteJid"),
+        ("data", "remoteJid"),
+        ("message", "from"),
+        ("contact_identifier",),
+    ) or _first_id(value, ("contacts", "wa_id"), ("statuses", "recipient_id"))
+    ids = {}
+    if message_id:
+        ids["message_id"] = message_id
+    if contact:
+        ids["contact"] = contact
+    return ids
+
+
+def _sample(connector, event):
+    """Whether to log this event, and how many events the line stands for"""
+    if event not in SAMPLED_EVENTS:
+        return True, 1
+    key = (connector, event)
+    with _sampled_lock:
+        seen = _sampled.get(key, 0) + 1
+        _sampled[key] = seen % SAMPLE_RATE
+    if seen == 1:
+        return True, SAMPLE_RATE
+    return False, 0
+
+
+def log_event(
+    logger,
+    action,
+    connector=None,
+    event=None,
+    payload=None,
+    level=logging.INFO,
+    **fields,
+):
+    """
+    Write one compact JSON line for a processed event: action, connector,
+    event type, provider ids, the given fields (timings, result...) and the
+    redacted payload. Repetitive events are sampled.
+    """
+    if not logger.isEnabledFor(level):
+        return
+    connector_name = getattr(connector, "name", connector)
+    keep, sampled = _sample(connector_name, event)
+    if not keep:
+        return
+    line = {"action": action, "connector": connector_name, "event": event}
+    line.update(payload_ids(payload))
+    line.update(fields)
+    if sampled > 1:
+        line["sampled"] = sampled
+    if payload is not None:
+        line["payload"] = redact(payload)
+    text = json.dumps(line, ensure_ascii=False, separators=(",", ":"), default=str)
+    if len(text) > MAX_LINE_LENGTH and payload is not None:
+        # keep the line valid JSON, the ids above are what matters most
+        line["payload"] = f"<payload len={len(text)}>"
+        text = json.dumps(line, ensure_ascii=False, separators=(",", ":"), default=str)
+    logger.log(level, text)
@@ -3,6 +3,8 @@ import os
 
 from odoo import Command
 
+from odoo.addons.discuss_hub.models import inbound_queue, payload_log
+
 _logger = logging.getLogger(__name__)
 
 DEFAULT_UPDATE_PROFILE_PICS = ["image_1920", "image_128"]
@@ -24,12 +26,72 @@ class Plugin:
         self.connector = connector
         _logger.debug(f"Loaded plugin {self.name} for connector: {self.connector}")
 
+    def get_base_url(self):
+        """
+        Base URL the provider uses to reach this Odoo instance.
+        DISCUSS_HUB_INTERNAL_HOST, when set, takes precedence over web.base.url
+        """
+        base_url = os.getenv("DISCUSS_HUB_INTERNAL_HOST")
+        if not base_url:
+            base_url = (
+                self.connector.env["ir.config_parameter"]
+                .sudo()
+                .get_param("web.base.url")
+            )
+        return base_url
+
+    def get_attachment_url(self, attachment):
+        """Short-lived signed URL serving the attachment from the filestore"""
+        return attachment.sudo().discuss_hub_media_url(
+            ttl=self.connector.outbound_media_url_ttl
+        )
+
+    def probe_circuit(self):
+        """
+        Recovery probe for an open provider circuit.
+        Plugins using the CircuitBreakerSession should call a cheap status
+        endpoint of the provider through session.probe()
+        """
+        session = getattr(self, "session", None)
+        if session is None or not hasattr(session, "probe") or not self.connector.url:
+            return False
+        return session.probe("GET", self.connector.url)
+
     def process_payload(self):
         # raise not implemented error
         raise NotImplementedError(
             f"Plugin {self.name} does not implemented process_payload()"
         )
 
+    def get_event_type(self, payload):
+        """Event type of an incoming payload, used to label the metrics"""
+        if not isinstance(payload, dict):
+            return "unknown"
+        return str(payload.get("event") or payload.get("type") or "unknown")[:64]
+
+    def get_dedup_key(self, payload):
+        """
+        Provider key identifying an event across redeliveries (message id,
+        message id and status for receipts...), None to never deduplicate it
+        """
+        return None
+
+    def get_partition_key(self, payload):
+        """
+        Contact an incoming payload belongs to: queued events of a contact
+        are processed in order, see inbound_queue.py
+        """
+        return payload_log.payload_ids(payload).get("contact")
+
+    def get_lane(self, payload):
+        """
+        Priority lane of a queued payload: live messages, then reactions,
+        edits and deletes, then receipts, then contacts, history and admin
+        """
+        return inbound_queue.LANE_BY_EVENT.get(
+            self.get_event_type(payload), inbound_queue.DEFAULT_LANE
+        )
+
     def get_message_id(self, payload):
         # raise not implemented error
         raise NotImplementedError(
@@ -203,7 +265,7 @@ class Plugin:
             )
             partner = partner_contact
             _logger.info(
-                f"action:created partner for payload {payload}"
+                f"action:created partner for payload {payload_log.dumps(payload)} "
                 + f"created partner {partner_contact} for connector {self.connector} "
                 + f"and contact identifier :{contact_identifier}"
                 + f" with parent {parent_partner}"
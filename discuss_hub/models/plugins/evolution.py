@@ -1,5 +1,4 @@
 import base64
-import json
 import logging
 import os
 import time
@@ -9,7 +8,10 @@ import requests
 from jinja2 import Template
 from markupsafe import Markup
 
+from odoo.addons.discuss_hub.models import payload_log
+
 from .base import Plugin as PluginBase
+from .transport import CircuitBreakerSession
 
 _logger = logging.getLogger(__name__)
 
@@ -37,19 +39,8 @@ class Plugin(PluginBase):
             if query.status_code == 404:
                 status = "not_found"
                 # try to create
-                # define the base_url if not provided
-                if not os.getenv("DISCUSS_HUB_INTERNAL_HOST"):
-                    base_url = (
-                        self.connector.env["ir.config_parameter"]
-                        .sudo()
-                        .get_param("web.base.url")
-                    )
-                else:
-                    # if DISCUSS_HUB_INTERNAL_HOST is set, use it
-                    # this way, it will use the provided URL to add as the webhook
-                    base_url = os.getenv("DISCUSS_HUB_INTERNAL_HOST")
                 connector_url = urljoin(
-                    base_url,
+                    self.get_base_url(),
                     f"discuss_hub/connector/{self.connector.uuid}",
                 )
                 create_instance_url = f"{self.evolution_url}/instance/create"
@@ -110,7 +101,7 @@ class Plugin(PluginBase):
                     logging.warning(
                         "EVOLUTION: Failed to create instance after not found "
                         + f" response: {create_query.status_code} - {create_query.text}"
-                        + f" Payload: {json.dumps(payload)}"
+                        + f" Payload: {payload_log.dumps(payload)}"
                     )
 
             elif query.status_code == 401:
@@ -199,13 +190,18 @@ class Plugin(PluginBase):
 
     def get_requests_session(self):
         """Get a requests session with the connector's API key"""
-        session = requests.Session()
+        session = CircuitBreakerSession(self.connector)
         apikey = os.getenv("DISCUSS_HUB_EVOLUTION_APIKEY")
         if self.connector.api_key:
             apikey = self.connector.api_key
         session.headers.update({"apikey": apikey})
         return session
 
+    def probe_circuit(self):
+        """Probe Evolution through instance/connect"""
+        url = f"{self.evolution_url}/instance/connect/{self.connector.name}"
+        return self.session.probe("GET", url)
+
     def get_evolution_url(self):
         """Get the evolution URL"""
         if self.connector.url:
@@ -315,7 +311,8 @@ class Plugin(PluginBase):
             response = self.session.post(url, json=payload, timeout=10)
             _logger.info(
                 f"action:outgo_reaction channel:{channel} reaction:{reaction}"
-                + f"payload:{payload} response:{response.status_code}"
+                + f"payload:{payload_log.dumps(payload)} "
+                + f"response:{response.status_code}"
             )
         except requests.RequestException as e:
             _logger.error(f"Error sending reaction: {str(e)}")
@@ -444,7 +441,7 @@ class Plugin(PluginBase):
             else:
                 _logger.error(
                     f"Failed to send text message: {response.status_code} - "
-                    + f"{response.text}; Payload: {payload}"
+                    + f"{response.text}; Payload: {payload_log.dumps(payload)}"
                 )
                 return False
         except requests.RequestException as e:
@@ -465,11 +462,16 @@ class Plugin(PluginBase):
                 mediatype = "document"
                 filename = attachment.name
 
+            if self.connector.outbound_media_mode == "url":
+                # evolution downloads the file itself, no base64 in memory
+                media = self.get_attachment_url(attachment)
+            else:
+                media = attachment.datas.decode("utf-8")
             payload = {
                 "number": channel.discuss_hub_outgoing_destination,
                 "mediatype": mediatype,
                 "mimetype": attachment.mimetype,
-                "media": attachment.datas.decode("utf-8"),
+                "media": media,
                 "fileName": filename,
             }
 
@@ -544,6 +546,31 @@ class Plugin(PluginBase):
             "contacts": processed_count,
         }
 
+    def get_dedup_key(self, payload):
+        event = payload.get("event")
+        data = payload.get("data") or {}
+        if not isinstance(data, dict):
+            return None
+        if event == "messages.upsert":
+            return data.get("key", {}).get("id")
+        if event == "messages.update" and data.get("keyId"):
+            return f"{data['keyId']}:{data.get('status')}"
+        if event == "messages.delete":
+            return data.get("id")
+        return None
+
+    def get_lane(self, payload):
+        # reactions and edits/revokes come as messages.upsert too
+        data = payload.get("data")
+        message = (data.get("message") or {}) if isinstance(data, dict) else {}
+        if payload.get("event") == "messages.upsert" and (
+            message.get("reactionMessage")
+            or message.get("protocolMessage")
+            or message.get("editedMessage")
+        ):
+            return "1"
+        return super().get_lane(payload)
+
     def get_message_id(self, payload):
         """Get message ID from payload"""
         message_id = payload.get("data", {}).get("keyId")
@@ -1132,7 +1159,10 @@ class Plugin(PluginBase):
             # get the message content
             message_records = self.get_message_by_id(payload)
             if message_records:
-                _logger.info(f"Message for editing found {payload} {message_records}")
+                _logger.info(
+                    f"Message for editing found {payload_log.dumps(payload)} "
+                    + f"{payload_log.dumps(message_records)}"
+                )
                 # emulate a new payload here, and call _process_messages_upsert
                 emulated_payload = {
                     "event": "messages.upsert",
@@ -1149,7 +1179,7 @@ class Plugin(PluginBase):
                 }
                 _logger.info(
                     "Emulated payload generated for editing message:"
-                    + f" {json.dumps(emulated_payload)}"
+                    + f" {payload_log.dumps(emulated_payload)}"
                 )
                 response = self.process_payload(emulated_payload)
                 response["edited_message"] = True
@@ -115,6 +115,10 @@ class Plugin(PluginBase):
 
         return response
 
+    def get_event_type(self, payload):
+        # Label of the payload in the stage metrics
+        return payload.get("message_type") or "unknown"
+
     def get_message_id(self, payload=None):
         # Extract message ID from payload
         return payload.get("message_id")
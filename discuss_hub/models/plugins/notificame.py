@@ -50,9 +50,13 @@ class Plugin(PluginBase):
         # no support for profile picture
         return False
 
+    def get_dedup_key(self, payload):
+        if payload.get("type") == "MESSAGE":
+            return payload.get("id")
+        return None
+
     def process_payload(self, payload):
-        # Handle incoming webhooks
-        _logger.info(f"Processing payload: {payload}")
+        # Handle incoming webhooks, logged by the connector
         message_id = payload.get("id")
         # get partner
         partner = self.get_or_create_partner(payload, update_profile_picture=False)
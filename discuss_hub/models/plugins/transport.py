@@ -0,0 +1,189 @@
+import logging
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+
+from odoo import SUPERUSER_ID, api
+
+from odoo.addons.discuss_hub.models import metrics
+
+_logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# seconds between reads of the state shared by the other workers
+SHARED_STATE_REFRESH = 2
+
+
+class CircuitOpenError(requests.ConnectionError):
+    """Raised instead of calling a provider whose circuit is open.
+    It is a requests.ConnectionError so the plugins handle it like any other
+    connection failure, only without waiting for the timeout."""
+
+
+class CircuitBreaker:
+    """
+    Consecutive failure counter of one connector/host in this worker.
+    After `threshold` failures the circuit opens and calls fail immediately.
+    The open/closed state is shared with the other workers through the
+    discuss_hub_circuit table, and only the worker that actually changes the
+    shared state notifies the connector manager channels.
+    """
+
+    _registry = {}
+    _registry_lock = threading.Lock()
+
+    def __init__(self, dbname, connector_id, host):
+        self.dbname = dbname
+        self.connector_id = connector_id
+        self.host = host
+        self.state = CLOSED
+        self.failures = 0
+        self.synced_at = 0
+        self.lock = threading.Lock()
+
+    @classmethod
+    def get(cls, connector, url):
+        key = (connector.env.cr.dbname, connector.id, urlparse(url).netloc)
+        with cls._registry_lock:
+            if key not in cls._registry:
+                cls._registry[key] = cls(*key)
+            return cls._registry[key]
+
+    def allow(self, connector):
+        """Whether a call can go through, refreshing the shared state"""
+        if time.monotonic() - self.synced_at > SHARED_STATE_REFRESH:
+            self.synced_at = time.monotonic()
+            shared_state = self.read_shared_state(connector)
+            if shared_state:
+                self.state = shared_state
+                if shared_state == CLOSED:
+                    self.failures = 0
+        return self.state != OPEN
+
+    def record_success(self, connector):
+        with self.lock:
+            self.failures = 0
+            if self.state == CLOSED:
+                return
+            self.state = CLOSED
+        self.publish(connector, CLOSED)
+
+    def record_failure(self, connector, threshold):
+        with self.lock:
+            self.failures += 1
+            if self.state == OPEN or self.failures < threshold:
+                return
+            self.state = OPEN
+        self.publish(connector, OPEN)
+
+    def read_shared_state(self, connector):
+        try:
+            with connector.env.registry.cursor() as cr:
+                cr.execute(
+                    """
+                    SELECT state FROM discuss_hub_circuit
+                    WHERE connector_id = %s AND host = %s
+                    """,
+                    (self.connector_id, self.host),
+                )
+                row = cr.fetchone()
+        except Exception as e:
+            _logger.warning(f"action:circuit_breaker could not read state: {e}")
+            return None
+        return row[0] if row else None
+
+    def publish(self, connector, state):
+        """Store the new state, notifying only if this call changed it"""
+        self.synced_at = time.monotonic()
+        try:
+            with connector.env.registry.cursor() as cr:
+                cr.execute(
+                    """
+                    INSERT INTO discuss_hub_circuit AS c
+                        (connector_id, host, state, changed_at)
+                    VALUES (%s, %s, %s, now() at time zone 'UTC')
+                    ON CONFLICT (connector_id, host) DO UPDATE
+                    SET state = EXCLUDED.state, changed_at = EXCLUDED.changed_at
+                    WHERE c.state <> EXCLUDED.state
+                    RETURNING connector_id
+                    """,
+                    (self.connector_id, self.host, state),
+                )
+                if not cr.fetchone():
+                    return False
+                _logger.warning(
+                    f"action:circuit_breaker connector {self.connector_id} "
+                    + f"host {self.host}: {state}"
+                )
+                env = api.Environment(cr, SUPERUSER_ID, {})
+                env["discuss_hub.connector"].browse(
+                    self.connector_id
+                ).exists()._notify_circuit_state(self.host, state)
+        except Exception as e:
+            _logger.warning(f"action:circuit_breaker could not publish state: {e}")
+            return False
+        return True
+
+
+class CircuitBreakerSession(requests.Session):
+    """requests.Session failing fast while the provider circuit is open"""
+
+    def __init__(self, connector):
+        super().__init__()
+        self.connector = connector
+
+    def request(self, method, url, *args, **kwargs):
+        with metrics.stage_timer(
+            self.connector, "provider_http", event=metrics.current_event() or "outbound"
+        ):
+            return self._request(method, url, *args, **kwargs)
+
+    def _request(self, method, url, *args, **kwargs):
+        threshold = self.connector.circuit_breaker_threshold
+        if not threshold:
+            return super().request(method, url, *args, **kwargs)
+        breaker = CircuitBreaker.get(self.connector, url)
+        if not breaker.allow(self.connector):
+            raise CircuitOpenError(
+                f"Circuit open for connector {self.connector.name} host "
+                + f"{breaker.host}, not calling {url}"
+            )
+        try:
+            response = super().request(method, url, *args, **kwargs)
+        except requests.RequestException:
+            breaker.record_failure(self.connector, threshold)
+            raise
+        if response.status_code >= 500:
+            breaker.record_failure(self.connector, threshold)
+        else:
+            breaker.record_success(self.connector)
+        return response
+
+    def probe(self, method, url, **kwargs):
+        """
+        Recovery probe: half-open the circuit in this worker, call the
+        provider bypassing the breaker and close the circuit if it answers.
+        Only the closing is shared and notified: the circuit is still open
+        for the other workers, a failed probe leaves it as it was.
+        """
+        breaker = CircuitBreaker.get(self.connector, url)
+        breaker.state = HALF_OPEN
+        kwargs.setdefault("timeout", 10)
+        try:
+            response = super().request(method, url, **kwargs)
+            healthy = response.status_code < 500
+        except requests.RequestException as e:
+            _logger.info(f"action:circuit_probe {url} failed: {e}")
+            healthy = False
+        if healthy:
+            breaker.failures = 0
+            breaker.state = CLOSED
+            breaker.publish(self.connector, CLOSED)
+        else:
+            breaker.state = OPEN
+        return healthy
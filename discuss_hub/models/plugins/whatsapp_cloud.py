@@ -1,4 +1,3 @@
-import base64
 import io
 import logging
 
@@ -6,7 +5,10 @@ import requests
 from markupsafe import Markup
 from werkzeug.wrappers import Response
 
+from odoo.addons.discuss_hub.models import payload_log
+
 from .base import Plugin as PluginBase
+from .transport import CircuitBreakerSession
 
 _logger = logging.getLogger(__name__)
 
@@ -24,7 +26,7 @@ class Plugin(PluginBase):
 
     def get_requests_session(self):
         """Get a requests session with the connector's API key"""
-        session = requests.Session()
+        session = CircuitBreakerSession(self.connector)
         session.headers.update({"Authorization": f"Bearer {self.connector.api_key}"})
         return session
 
@@ -35,9 +37,12 @@ class Plugin(PluginBase):
         This method can be overridden by the plugin
         to handle specific administrative tasks.
         """
-        _logger.info(
-            "action:process_administrative_payload event:administrative "
-            + f"payload: {payload}"
+        payload_log.log_event(
+            _logger,
+            "process_administrative_payload",
+            connector=self.connector,
+            event="administrative",
+            payload=payload,
         )
         if not self.connector.manager_channel:
             return {
@@ -48,7 +53,10 @@ class Plugin(PluginBase):
 
         for channel in self.connector.manager_channel:
             attachments = None
-            body = f"Instance:{self.connector.name}: {payload}"
+            # bounded and redacted, and escaped as it comes from the provider
+            body = Markup("Instance:{}: <code>{}</code>").format(
+                self.connector.name, payload_log.dumps(payload, max_length=2000)
+            )
 
             if body:
                 channel.message_post(
@@ -214,6 +222,38 @@ class Plugin(PluginBase):
 
         return response
 
+    def get_event_type(self, payload):
+        if payload.get("hub.mode"):
+            return "subscribe"
+        for entry in payload.get("entry") or []:
+            for change in entry.get("changes", []):
+                value = change.get("value") or {}
+                if value.get("messages"):
+                    return "messages"
+                if value.get("statuses"):
+                    return "statuses"
+                return str(change.get("field") or "unknown")[:64]
+        return "unknown"
+
+    def get_dedup_key(self, payload):
+        for entry in payload.get("entry") or []:
+            for change in entry.get("changes", []):
+                value = change.get("value") or {}
+                if value.get("messages"):
+                    return value["messages"][0].get("id")
+                if value.get("statuses"):
+                    status = value["statuses"][0]
+                    return f"{status.get('id')}:{status.get('status')}"
+        return None
+
+    def get_lane(self, payload):
+        for entry in payload.get("entry") or []:
+            for change in entry.get("changes", []):
+                messages = (change.get("value") or {}).get("messages") or []
+                if messages and messages[0].get("type") == "reaction":
+                    return "1"
+        return super().get_lane(payload)
+
     def get_message_id(self, payload=None):
         # Extract message ID from payload
         message_id = False
@@ -402,66 +442,115 @@ class Plugin(PluginBase):
             else:
                 _logger.error(
                     f"Failed to send text message: {response.status_code} - "
-                    + f"{response.text}; Payload: {payload}"
+                    + f"{response.text}; Payload: {payload_log.dumps(payload)}"
                 )
                 return False
         except requests.RequestException as e:
             _logger.error(f"Error sending text message: {str(e)}")
             return False
 
+    def upload_media(self, attachment):
+        """
+        Upload an attachment to the /media endpoint and return its media id.
+        Media already uploaded for this connector (same checksum) is reused
+        while it is still kept by Graph, skipping the upload.
+        """
+        media_cache = self.connector.env["discuss_hub.connector.media"].sudo()
+        media_id = media_cache.get_media_id(self.connector, attachment.checksum)
+        if media_id:
+            _logger.info(
+                f"action:upload_attachment attachment:{attachment} "
+                + f"reusing cached media_id: {media_id}"
+            )
+            return media_id
+
+        base_url = self.connector.url
+        if not base_url.endswith("/"):
+            base_url += "/"
+        url_media = f"{base_url}media/"
+
+        # raw reads the bytes from the filestore, no base64 round trip
+        file_like_object = io.BytesIO(attachment.raw)
+        mediatype = attachment.index_content
+        filename = "audio.ogg" if mediatype == "audio" else attachment.name
+        files = {"file": (filename, file_like_object, attachment.mimetype)}
+        data = {"messaging_product": "whatsapp"}
+        send_media_response = None
+        try:
+            send_media_response = self.session.post(
+                url_media,
+                data=data,
+                files=files,
+                timeout=10,
+            )
+            media_id = send_media_response.json().get("id")
+        except (requests.RequestException, ValueError) as e:
+            _logger.error(
+                f"Error sending media: {str(e)} "
+                + f"for attachment {attachment.id} in connector {self.connector} "
+                + f"response: {
+                    send_media_response.text if send_media_response else 'N/A'
+                }"
+            )
+            return None
+        media_cache.set_media_id(
+            self.connector,
+            attachment.checksum,
+            media_id,
+            self.connector.whatsapp_cloud_media_cache_days,
+        )
+        return media_id
+
     def send_attachments(self, channel, message):
         base_url = self.connector.url
 
         if not base_url.endswith("/"):
             base_url += "/"
-        url_media = f"{base_url}media/"
+        messages_url = f"{base_url}messages/"
+        media_cache = self.connector.env["discuss_hub.connector.media"].sudo()
 
         for attachment in message.attachment_ids:
-            decoded_bytes = base64.b64decode(attachment.datas)
-            file_like_object = io.BytesIO(decoded_bytes)
-            mediatype = attachment.index_content
-            filename = "audio.ogg" if mediatype == "audio" else attachment.name
-            files = {"file": (filename, file_like_object, attachment.mimetype)}
-            data = {"messaging_product": "whatsapp"}
-            send_media_response = None
-            send_text_response = None
-            try:
-                send_media_response = self.session.post(
-                    url_media,
-                    data=data,
-                    files=files,
-                    timeout=10,
+            if self.connector.outbound_media_mode == "url":
+                # Graph fetches the file from the signed url, nothing uploaded
+                media = {"link": self.get_attachment_url(attachment)}
+                cached = False
+                media_id = None
+            else:
+                cached = bool(
+                    media_cache.get_media_id(self.connector, attachment.checksum)
                 )
-                media_id = send_media_response.json().get("id")
+                media_id = self.upload_media(attachment)
+                if not media_id:
+                    return False
+                media = {"id": media_id}
                 _logger.info(
                     f"action:upload_attachment channel:{channel} "
                     + f"attachment:{attachment} got media_id: {media_id} "
                     + f"message_id: {message.id} "
                 )
-            except requests.RequestException as e:
-                _logger.error(
-                    f"Error sending media: {str(e)} "
-                    + f"for attachment {attachment.id} in connector {self.connector} "
-                    + f"response: {
-                        send_media_response.text if send_media_response else 'N/A'
-                    }"
-                )
-                return False
+            send_attachment_response = None
             try:
                 send_message_payload = {
                     "messaging_product": "whatsapp",
                     "recipient_type": "individual",
                     "to": channel.discuss_hub_outgoing_destination,
                     "type": "image",
-                    "image": {
-                        "id": media_id,
-                        # "caption": attachment.name
-                    },
+                    "image": media,
                 }
-                messages_url = f"{base_url}messages/"
                 send_attachment_response = self.session.post(
                     messages_url, json=send_message_payload, timeout=10
                 )
+                if send_attachment_response.status_code != 200 and cached:
+                    # the cached media may have been purged by Graph,
+                    # forget it and upload the file again once
+                    media_cache.drop_media_id(self.connector, attachment.checksum)
+                    media_id = self.upload_media(attachment)
+                    if not media_id:
+                        return False
+                    send_message_payload["image"]["id"] = media_id
+                    send_attachment_response = self.session.post(
+                        messages_url, json=send_message_payload, timeout=10
+                    )
                 if send_attachment_response.status_code != 200:
                     _logger.error(
                         f"Failed to send attachment: {
@@ -479,9 +568,10 @@ class Plugin(PluginBase):
                     f"Error sending attachment: {str(e)} "
                     + f"for attachment {message.id} in connector {self.connector} "
                     + f"responses: {
-                        send_media_response.text if send_media_response else 'N/A'
+                        send_attachment_response.text
+                        if send_attachment_response
+                        else 'N/A'
                     }, "
-                    + f"{send_text_response.text if send_text_response else 'N/A'} "
                     + f"media_id: {media_id}"
                 )
                 return False
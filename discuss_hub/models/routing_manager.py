@@ -1,11 +1,20 @@
 import logging
 import random
+import threading
+from datetime import timedelta
 
-from odoo import _, api, fields, models
-from odoo.exceptions import ValidationError
+from odoo import Command, _, api, fields, models
+from odoo.exceptions import UserError, ValidationError
+
+from . import wakeup
+from .bus_presence import get_presence_snapshot
 
 _logger = logging.getLogger(__name__)
 
+# larger forward/archive selections are run in background by a cron
+BULK_INLINE_LIMIT = 100
+BULK_BATCH_SIZE = 200
+
 
 class DiscussHubRoutingTeam(models.Model):
     _name = "discuss_hub.routing_team"
@@ -27,7 +36,7 @@ class DiscussHubRoutingTeam(models.Model):
     )
     routing_strategy = fields.Selection(
         selection=[
-            # ("least_busy", "Least Busy"),
+            ("least_busy", "Least Busy"),
             ("round_robin", "Round Robin"),
             ("random", "random"),
         ],
@@ -48,19 +57,23 @@ class DiscussHubRoutingTeam(models.Model):
     def available_users(self):
         """Returns a list of users that are part of the team and online"""
         self.ensure_one()
-        users = self.team_member_ids.mapped("user_id")
-        # get only active users
-        users = self.env["res.users"].search(
-            [
-                ("id", "in", users.ids),
-                ("active", "=", True),
-            ]
+        # active member users in one query, no per user ORM access
+        self.env["discuss_hub.routing_team_member"].flush_model()
+        self.env.cr.execute(
+            """
+            SELECT DISTINCT m.user_id
+            FROM discuss_hub_routing_team_member m
+            JOIN res_users u ON u.id = m.user_id
+            WHERE m.team_id = %s AND u.active
+            """,
+            (self.id,),
         )
+        user_ids = [row[0] for row in self.env.cr.fetchall()]
         if self.online_users_only:
-            users = users.filtered(lambda u: u.partner_id.im_status == "online")
-        _logger.info(
-            f"Available users in team {self.name}: {[user.name for user in users]}"
-        )
+            presence = get_presence_snapshot(self.env)
+            user_ids = [uid for uid in user_ids if presence.get(uid) == "online"]
+        users = self.env["res.users"].browse(sorted(user_ids))
+        _logger.info(f"Available users in team {self.name}: {users.ids}")
         return users
 
     def reset_team_member_counts(self):
@@ -83,25 +96,50 @@ class DiscussHubRoutingTeam(models.Model):
             return None
 
     def _get_round_robin_user(self):
-        # get the team members ordered by their order field
-        # and ordered by their count field
-        """Returns the next user in the team based on round robin strategy"""
+        """
+        Returns the next user in the team based on round robin strategy.
+        The eligible member with the lowest count (then order) is picked and
+        counted in a single statement, so concurrent assignments do not pick
+        the same member.
+        """
         self.ensure_one()
         users = self.available_users()
         if not users:
             return None
-        # get team members based on available users nd ordered
-        next_team_member = self.env["discuss_hub.routing_team_member"].search(
-            [("team_id", "=", self.id), ("user_id", "in", users.ids)],
-            order="count asc, order asc",
-            limit=1,
-        )
-        # increase the count of the team member
-        if not next_team_member:
+        self.env["discuss_hub.routing_team_member"].flush_model()
+        # in the caller transaction: a second cursor would wait on the member
+        # rows this transaction may already hold
+        user_id = self._assign_round_robin(self.env.cr, users)
+        self.env["discuss_hub.routing_team_member"].invalidate_model(["count"])
+        if not user_id:
             return None
-        # increment the team member count
-        next_team_member.write({"count": next_team_member.count + 1})
-        return next_team_member.user_id
+        return self.env["res.users"].browse(user_id)
+
+    def _assign_round_robin(self, cr, users):
+        """Increment the count of the next eligible member, return its user id"""
+        query = """
+            UPDATE discuss_hub_routing_team_member m
+            SET count = COALESCE(m.count, 0) + 1
+            FROM (
+                SELECT id FROM discuss_hub_routing_team_member
+                WHERE team_id = %s AND user_id = ANY(%s)
+                ORDER BY COALESCE(count, 0), COALESCE("order", 0), id
+                LIMIT 1
+                FOR UPDATE {skip_locked}
+            ) next_member
+            WHERE m.id = next_member.id
+            RETURNING m.user_id
+        """
+        # members locked by a running assignment are skipped, and waited
+        # for only when all the eligible ones are locked
+        for skip_locked in ("SKIP LOCKED", ""):
+            cr.execute(
+                query.format(skip_locked=skip_locked), (self.id, list(users.ids))
+            )
+            row = cr.fetchone()
+            if row:
+                return row[0]
+        return None
 
     def _get_random_user(self):
         """Returns a random user from the team"""
@@ -113,33 +151,15 @@ class DiscussHubRoutingTeam(models.Model):
         return random_user
 
     def _get_least_busy_user(self, connector=None):
-        """Returns the user in the team with the fewest active chats."""
+        """
+        Returns the user in the team with the fewest open conversations,
+        across all connectors, read from the maintained agent load counters.
+        """
         self.ensure_one()
         users = self.available_users()
         if not users:
             return None
-        if connector:
-            channel_filter = ("channel_id.connector_id", "=", connector.id)
-        else:
-            # if no channel is provided, consider all channels (global)
-            channel_filter = ("channel_id.discuss_hub_connector", "!=", False)
-        grouped_data = self.env["discuss.channel.member"].read_group(
-            domain=[
-                ("partner_id.user_ids", "in", users.ids),
-                ("channel_id.discuss_hub_connector", "!=", False),
-                ("channel_id.active", "=", True),
-                # consider only from same channel
-                channel_filter,
-            ],
-            fields=["partner_id", "create_date:max"],
-            groupby=["partner_id"],
-            orderby="create_date desc",
-            limit=1,
-        )
-        if grouped_data:
-            return grouped_data[0].get("partner_id")
-        else:
-            return None
+        return self.env["discuss_hub.agent_load"].get_least_busy_user(users) or None
 
 
 class DiscussHubRoutingTeamMember(models.Model):
@@ -206,55 +226,26 @@ class DiscussHubRoutingManager(models.TransientModel):
 
         self.ensure_one()  # Only one wizard record should be active
 
-        selected_agent = self.agent.partner_id
-        selected_team = self.team
-        selected_note = self.note
-        selected_actor = None
         user = self.env.user
         if from_partner and from_partner.user_ids:
             user = from_partner.user_ids[0]
-        for channel in self.channel_ids:
-            if selected_agent:
-                selected_actor = selected_agent
-                channel.with_user(user).add_members([selected_actor.id])
-            if selected_team:
-                selected_member = selected_team.get_next_team_member(
-                    connector=channel.discuss_hub_connector
-                )
-                if selected_member:
-                    selected_actor = selected_member.partner_id
-
-                    # add the member as user
-                    channel.with_user(user).add_members([selected_actor.id])
-            # add note
-            if selected_note:
-                # run with sudo
-                channel.sudo().message_post(
-                    author_id=from_partner.id if from_partner else None,
-                    body=selected_note,
-                    message_type="notification",
-                    partner_ids=[selected_actor.id],
-                )
-            # close the UI
-            channel_member = self.env["discuss.channel.member"].search(
-                [
-                    ("partner_id", "=", self.env.user.partner_id.id),
-                    ("channel_id", "=", channel.id),
-                ],
-                limit=1,
-            )
-            if channel_member:
-                channel_member._channel_fold("closed", 10000000)
-            # leave the channel
-            channel.with_user(user).action_unfollow()
-
-        return {"type": "ir.actions.act_window_close"}
+        operation = self.env["discuss_hub.bulk_operation"].launch(
+            "forward",
+            self.channel_ids,
+            user=user,
+            agent_id=self.agent.id,
+            team_id=self.team.id,
+            note=self.note,
+            from_partner_id=from_partner.id if from_partner else False,
+        )
+        return operation.get_wizard_action()
 
     @api.model
     def get_teams_and_users_status(self):
         """Returns CRM teams with users and their online status"""
         teams_data = []
         teams = self.env["crm.team"].search([])
+        presence = get_presence_snapshot(self.env)
         for team in teams:
             users_info = []
             for user in team.member_ids:
@@ -262,7 +253,7 @@ class DiscussHubRoutingManager(models.TransientModel):
                     {
                         "user_id": user.id,
                         "name": user.name,
-                        "online": user.partner_id.im_status == "online",
+                        "online": presence.get(user.id) == "online",
                     }
                 )
             teams_data.append(
@@ -277,26 +268,13 @@ class DiscussHubRoutingManager(models.TransientModel):
         if not team:
             return None
 
-        min_user = None
-        min_chats = float("inf")
-
-        for user in team.member_ids:
-            active_channels = self.env["mail.channel.partner"].search_count(
-                [
-                    ("partner_id", "=", user.partner_id.id),
-                    ("channel_id.channel_type", "=", "chat"),
-                    ("is_pinned", "=", True),
-                ]
-            )
-            if active_channels < min_chats:
-                min_user = user
-                min_chats = active_channels
-
+        AgentLoad = self.env["discuss_hub.agent_load"].sudo()
+        min_user = AgentLoad.get_least_busy_user(team.member_ids)
         if min_user:
             return {
                 "user_id": min_user.id,
                 "name": min_user.name,
-                "active_chats": min_chats,
+                "active_chats": AgentLoad.get_open_counts(min_user)[min_user.id],
             }
         return None
 
@@ -321,27 +299,265 @@ class DiscussHubArchiveManager(models.TransientModel):
 
     def action_archive(self):
         self.ensure_one()  # Only one wizard record should be active
-        for channel in self.channel_ids:
-            channel_member = self.env["discuss.channel.member"].search(
-                [
-                    ("partner_id", "=", self.env.user.partner_id.id),
-                    ("channel_id", "=", channel.id),
-                ],
-                limit=1,
+        operation = self.env["discuss_hub.bulk_operation"].launch(
+            "archive",
+            self.channel_ids,
+            close_message=self.close_message,
+            send_close_message=self.send_close_message,
+        )
+        return operation.get_wizard_action()
+
+
+class DiscussHubBulkOperation(models.Model):
+    """
+    Forward or archive of a channel selection. Small selections are run
+    right away, larger ones by the bulk operations cron in batches of
+    BULK_BATCH_SIZE channels, reporting their progress.
+    """
+
+    _name = "discuss_hub.bulk_operation"
+    _description = "Discuss Hub Bulk Operation"
+    _order = "id desc"
+
+    operation = fields.Selection(
+        selection=[
+            ("forward", "Forward"),
+            ("archive", "Archive"),
+        ],
+        required=True,
+    )
+    state = fields.Selection(
+        selection=[
+            ("pending", "Pending"),
+            ("running", "Running"),
+            ("done", "Done"),
+            ("failed", "Failed"),
+        ],
+        default="pending",
+        required=True,
+        index=True,
+    )
+    user_id = fields.Many2one(
+        comodel_name="res.users",
+        required=True,
+        default=lambda self: self.env.user,
+        help="User the operation runs as.",
+    )
+    channel_ids = fields.Many2many(
+        comodel_name="discuss.channel",
+        relation="discuss_hub_bulk_operation_channel_rel",
+        string="Channels",
+        context={"active_test": False},
+    )
+    total_count = fields.Integer()
+    processed_count = fields.Integer()
+    progress = fields.Float(compute="_compute_progress")
+    error = fields.Text()
+    # forward
+    agent_id = fields.Many2one(comodel_name="res.users")
+    team_id = fields.Many2one(comodel_name="discuss_hub.routing_team")
+    note = fields.Text()
+    from_partner_id = fields.Many2one(comodel_name="res.partner")
+    # archive
+    close_message = fields.Text()
+    send_close_message = fields.Boolean()
+
+    @api.depends("total_count", "processed_count")
+    def _compute_progress(self):
+        for operation in self:
+            operation.progress = (
+                100.0 * operation.processed_count / operation.total_count
+                if operation.total_count
+                else 100.0
+            )
+
+    @api.model
+    def launch(
+        self, operation, channels, user=None, inline=None, auto_commit=False, **values
+    ):
+        """
+        Run the operation on channels, in background for large selections
+        unless inline is given
+        """
+        bulk_operation = self.sudo().create(
+            {
+                "operation": operation,
+                "user_id": (user or self.env.user).id,
+                "channel_ids": [Command.set(channels.ids)],
+                "total_count": len(channels),
+                **values,
+            }
+        )
+        if inline is None:
+            inline = len(channels) <= BULK_INLINE_LIMIT
+        if inline:
+            bulk_operation._run(auto_commit=auto_commit)
+        else:
+            _logger.info(
+                f"action:bulk_{operation} {len(channels)} channels queued "
+                + f"as {bulk_operation}"
+            )
+            wakeup.wake(
+                self.env,
+                "bulk_operations",
+                "discuss_hub.ir_cron_discuss_hub_bulk_operations",
+            )
+        return bulk_operation
+
+    def get_wizard_action(self):
+        self.ensure_one()
+        if self.state == "done":
+            return {"type": "ir.actions.act_window_close"}
+        if self.state == "failed":
+            raise UserError(self.error)
+        return {
+            "type": "ir.actions.client",
+            "tag": "display_notification",
+            "params": {
+                "title": _("Running in background"),
+                "message": _(
+                    "%(count)s channels will be processed in background, "
+                    "you will be notified of the progress.",
+                    count=self.total_count,
+                ),
+                "type": "info",
+                "next": {"type": "ir.actions.act_window_close"},
+            },
+        }
+
+    @api.model
+    def _cron_process_bulk_operations(self):
+        auto_commit = not getattr(threading.current_thread(), "testing", False)
+        for operation in self.search([("state", "in", ["pending", "running"])]):
+            # the cron and the queue consumer may both drain: one runner per
+            # operation. A session lock is used as _run commits each batch
+            lock_key = ("discuss_hub.bulk_operation", operation.id)
+            self.env.cr.execute(
+                "SELECT pg_try_advisory_lock(hashtext(%s), %s)", lock_key
             )
+            if not self.env.cr.fetchone()[0]:
+                continue
+            try:
+                operation._run(auto_commit=auto_commit)
+            except Exception:
+                # the unlock cannot run in the aborted transaction
+                self.env.cr.rollback()
+                raise
+            finally:
+                self.env.cr.execute(
+                    "SELECT pg_advisory_unlock(hashtext(%s), %s)", lock_key
+                )
+
+    def _run(self, auto_commit=False):
+        self.ensure_one()
+        self.state = "running"
+        channels = self.channel_ids.sorted("id")
+        while True:
+            batch = channels[
+                self.processed_count : self.processed_count + BULK_BATCH_SIZE
+            ]
+            if not batch:
+                break
+            try:
+                with self.env.cr.savepoint():
+                    if self.operation == "archive":
+                        self._archive_channels(batch)
+                    else:
+                        self._forward_channels(batch)
+            except Exception as e:
+                _logger.error(f"action:bulk_{self.operation} {self} failed: {e}")
+                self.write({"state": "failed", "error": str(e)})
+                self._notify_progress()
+                return
+            self.processed_count += len(batch)
+            if self.processed_count < self.total_count:
+                self._notify_progress()
+            if auto_commit:
+                self.env.cr.commit()
+        self.state = "done"
+        if self.total_count > BULK_INLINE_LIMIT:
+            self._notify_progress()
+
+    def _notify_progress(self):
+        """One notification per batch to the user running the operation"""
+        operation_name = dict(self._fields["operation"].selection)[self.operation]
+        if self.state == "failed":
+            message = _("%(operation)s failed: %(error)s")
+        elif self.state == "done":
+            message = _("%(operation)s of %(total)s channels done.")
+        else:
+            message = _("%(operation)s: %(done)s of %(total)s channels done.")
+        self.env["bus.bus"]._sendone(
+            self.user_id.partner_id,
+            "simple_notification",
+            {
+                "type": "danger" if self.state == "failed" else "info",
+                "message": message
+                % {
+                    "operation": operation_name,
+                    "error": self.error,
+                    "done": self.processed_count,
+                    "total": self.total_count,
+                },
+            },
+        )
 
-            if self.send_close_message and self.close_message:
+    def _leave_channels(self, channels, partner):
+        """
+        Remove partner from channels like action_unfollow: its follower and
+        member are removed, the leave is posted and broadcast to the members
+        """
+        for channel in channels:
+            channel._action_unfollow(partner)
+
+    def _archive_channels(self, channels):
+        user = self.user_id
+        channels = channels.with_user(user).filtered("active")
+        if self.send_close_message and self.close_message:
+            for channel in channels:
                 channel.message_post(
-                    author_id=self.env.user.partner_id.id,
+                    author_id=user.partner_id.id,
                     body=self.close_message,
                     message_type="comment",
                     subtype_xmlid="mail.mt_comment",
                 )
-            channel_member._channel_fold("closed", 10000000)
-            # TODO: add internal note as option
-            # TODO: add tags
-            # TODO: close to all members
-            channel.action_unfollow()
-            channel.action_archive()
-
-        return {"type": "ir.actions.act_window_close"}
+        # TODO: add internal note as option
+        # TODO: add tags
+        # TODO: close to all members
+        self._leave_channels(channels, user.partner_id)
+        channels.sudo().action_archive()
+
+    def _forward_channels(self, channels):
+        user = self.user_id
+        for channel in channels.with_user(user):
+            selected_actor = self.agent_id.partner_id
+            if selected_actor:
+                channel.add_members([selected_actor.id])
+            if self.team_id:
+                selected_member = self.team_id.get_next_team_member(
+                    connector=channel.discuss_hub_connector
+                )
+                if selected_member:
+                    selected_actor = selected_member.partner_id
+                    # add the member as user
+                    channel.add_members([selected_actor.id])
+            # add note
+            if self.note:
+                # run with sudo
+                channel.sudo().message_post(
+                    author_id=self.from_partner_id.id or None,
+                    body=self.note,
+                    message_type="notification",
+                    partner_ids=selected_actor.ids,
+                )
+        # leave the channels
+        self._leave_channels(channels, user.partner_id)
+
+    @api.autovacuum
+    def _gc_done_operations(self):
+        self.search(
+            [
+                ("state", "=", "done"),
+                ("write_date", "<", fields.Datetime.now() - timedelta(days=7)),
+            ]
+        ).unlink()
@@ -0,0 +1,180 @@
+import logging
+import select
+import threading
+import time
+import zlib
+
+from odoo import SUPERUSER_ID, api, sql_db
+from odoo.modules.registry import Registry
+from odoo.tools import config
+
+_logger = logging.getLogger(__name__)
+
+# NOTIFY channel, the payload is the name of the queue with new work
+WAKEUP_CHANNEL = "discuss_hub_wakeup"
+# queue name: (model, method draining it)
+QUEUES = {
+    "inbound": ("discuss_hub.inbound_event", "_cron_process_inbound"),
+    "outbox": ("discuss_hub.outbox", "_cron_process_outbox"),
+    "bot_jobs": ("discuss_hub.bot_manager.job", "_cron_process_jobs"),
+    "bulk_operations": ("discuss_hub.bulk_operation", "_cron_process_bulk_operations"),
+}
+# consumers drain their queue at least this often, in case a wakeup is lost
+QUEUE_POLL_INTERVAL = 60
+# seconds between attempts to become the listener of a database
+LISTENER_RETRY_INTERVAL = 30
+# seconds the presence of a listener is trusted before checking it again
+LISTENER_CHECK_TTL = 10
+# session advisory lock held by the one listener of each database
+LISTENER_LOCK = (zlib.crc32(WAKEUP_CHANNEL.encode()) & 0x7FFFFFFF, 49)
+
+# share of the time limits of the cron workers a queue cron run may use
+CRON_RUN_LIMIT_SHARE = 0.5
+
+# {dbname: listener thread} started in this process
+_listeners = {}
+_listeners_lock = threading.Lock()
+# {dbname: (checked_at, active)}
+_listener_seen = {}
+
+
+def listener_active(cr):
+    """Whether a process of the cluster listens for the wakeups of this db"""
+    checked_at, active = _listener_seen.get(cr.dbname, (0, False))
+    if time.monotonic() - checked_at < LISTENER_CHECK_TTL:
+        return active
+    cr.execute(
+        """
+        SELECT EXISTS (
+            SELECT 1 FROM pg_locks l
+            JOIN pg_database d ON d.oid = l.database
+            WHERE d.datname = current_database()
+              AND l.locktype = 'advisory' AND l.granted
+              AND l.classid = %s AND l.objid = %s AND l.objsubid = 2
+        )
+        """,
+        LISTENER_LOCK,
+    )
+    active = cr.fetchone()[0]
+    _listener_seen[cr.dbname] = (time.monotonic(), active)
+    return active
+
+
+def cron_run_seconds(cap):
+    """
+    Seconds a queue cron run may take new work: at most cap, and well within
+    the real and CPU time limits of the prefork cron workers, so a busy run
+    ends before the worker is killed in the middle of an item
+    """
+    limits = [cap]
+    real = config["limit_time_real_cron"]
+    if real is None or real < 0:
+        real = config["limit_time_real"]
+    for limit in (real, config["limit_time_cpu"]):
+        if limit and limit > 0:
+            limits.append(limit * CRON_RUN_LIMIT_SHARE)
+    return min(limits)
+
+
+def wake(env, queue, cron_xmlid):
+    """
+    Signal new work on queue once the transaction commits. Without a
+    listener in the cluster, the cron draining the queue is triggered.
+    """
+    env.cr.execute("SELECT pg_notify(%s, %s)", (WAKEUP_CHANNEL, queue))
+    if not listener_active(env.cr):
+        env.ref(cron_xmlid)._trigger()
+
+
+def drain(env, queue):
+    """Process what is waiting in queue"""
+    model, method = QUEUES[queue]
+    getattr(env[model], method)()
+
+
+class _Consumer(threading.Thread):
+    """Drains one queue of one database whenever it is woken up"""
+
+    def __init__(self, dbname, queue):
+        super().__init__(name=f"discuss_hub_{queue}:{dbname}", daemon=True)
+        self.dbname = dbname
+        self.queue = queue
+        self.wakeup = threading.Event()
+
+    def run(self):
+        while True:
+            self.wakeup.wait(QUEUE_POLL_INTERVAL)
+            # cleared first: work notified while draining runs another loop
+            self.wakeup.clear()
+            try:
+                with Registry(self.dbname).cursor() as cr:
+                    drain(api.Environment(cr, SUPERUSER_ID, {}), self.queue)
+            except Exception as e:
+                _logger.warning(
+                    f"action:queue_drain database {self.dbname} queue {self.queue} "
+                    + f"failed: {e}"
+                )
+
+
+class _Listener(threading.Thread):
+    """
+    LISTEN for the wakeups of a database and wake up its consumers. Only one
+    process of the cluster listens, the others retry in case it goes away.
+    """
+
+    def __init__(self, dbname):
+        super().__init__(name=f"discuss_hub_wakeup:{dbname}", daemon=True)
+        self.dbname = dbname
+        self.consumers = {}
+
+    def run(self):
+        while True:
+            try:
+                self._listen()
+            except Exception as e:
+                _logger.warning(
+                    f"action:queue_listener database {self.dbname} failed: {e}"
+                )
+            time.sleep(LISTENER_RETRY_INTERVAL)
+
+    def _listen(self):
+        with sql_db.db_connect(self.dbname).cursor() as cr:
+            cr.execute("SELECT pg_try_advisory_lock(%s, %s)", LISTENER_LOCK)
+            if not cr.fetchone()[0]:
+                return
+            try:
+                cr.execute(f"LISTEN {WAKEUP_CHANNEL}")
+                cr.commit()
+                _logger.info(f"action:queue_listener database {self.dbname} listening")
+                if not self.consumers:
+                    for queue in QUEUES:
+                        consumer = _Consumer(self.dbname, queue)
+                        consumer.start()
+                        self.consumers[queue] = consumer
+                # drain what was queued before listening
+                for consumer in self.consumers.values():
+                    consumer.wakeup.set()
+                conn = cr._cnx
+                while True:
+                    if not select.select([conn], [], [], QUEUE_POLL_INTERVAL)[0]:
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        queue = conn.notifies.pop().payload
+                        if queue in self.consumers:
+                            self.consumers[queue].wakeup.set()
+            finally:
+                # the connection goes back to the pool
+                cr.rollback()
+                cr.execute("UNLISTEN *")
+                cr.execute("SELECT pg_advisory_unlock_all()")
+                cr.commit()
+
+
+def start(dbname):
+    """Start listening for the wakeups of dbname in this process, once"""
+    with _listeners_lock:
+        if dbname in _listeners:
+            return
+        listener = _listeners[dbname] = _Listener(dbname)
+    listener.start()
@@ -0,0 +1,147 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from functools import partial
+
+from odoo import api, fields, models
+
+from . import metrics
+
+_logger = logging.getLogger(__name__)
+
+# deliveries remembered by each worker once committed, to answer redeliveries
+# without a query, they are counted in the duplicate stage metric only
+RECENT_DELIVERIES_SIZE = 10000
+RECENT_DELIVERIES_TTL = 600
+# days a processed delivery is kept in the database
+DELIVERY_RETENTION_DAYS = 3
+
+# {(dbname, connector_id, event, key): seen_at}, oldest first
+_recent = OrderedDict()
+_recent_lock = threading.Lock()
+
+
+def _recently_seen(key):
+    with _recent_lock:
+        seen_at = _recent.get(key)
+        if seen_at is None:
+            return False
+        if time.monotonic() - seen_at > RECENT_DELIVERIES_TTL:
+            del _recent[key]
+            return False
+        return True
+
+
+def _remember(key):
+    with _recent_lock:
+        _recent[key] = time.monotonic()
+        _recent.move_to_end(key)
+        while len(_recent) > RECENT_DELIVERIES_SIZE:
+            _recent.popitem(last=False)
+
+
+class DiscussHubWebhookDelivery(models.Model):
+    """
+    Webhook events already processed, by connector, event type and provider
+    key (message id, or message id and status for receipts). Providers
+    redeliver on timeouts, the redeliveries are acknowledged without being
+    processed again and counted in hit_count.
+    """
+
+    _name = "discuss_hub.webhook_delivery"
+    _description = "Discuss Hub Webhook Delivery"
+    _order = "id desc"
+
+    connector_id = fields.Many2one(
+        comodel_name="discuss_hub.connector",
+        required=True,
+        ondelete="cascade",
+    )
+    event = fields.Char(required=True)
+    key = fields.Char(required=True)
+    hit_count = fields.Integer(
+        string="Duplicates",
+        help="Redeliveries of this event acknowledged without processing.",
+    )
+
+    _sql_constraints = [
+        (
+            "delivery_uniq",
+            "unique(connector_id, event, key)",
+            "This webhook event was already processed.",
+        ),
+    ]
+
+    def init(self):
+        self.env.cr.execute(
+            """
+            CREATE INDEX IF NOT EXISTS discuss_hub_webhook_delivery_create_date_idx
+            ON discuss_hub_webhook_delivery (create_date)
+            """
+        )
+
+    @api.model
+    def claim(self, connector, event, key):
+        """
+        Record the delivery of an event, in the transaction processing it so
+        a failed attempt can be redelivered. False if it was already
+        processed and must be skipped: its hit_count is increased, unless
+        this worker answered it from memory without a query.
+        A concurrent delivery of the same event waits for this one to finish.
+        """
+        cache_key = (self.env.cr.dbname, connector.id, event, key)
+        # remembered only once committed, its row exists
+        if not _recently_seen(cache_key):
+            self.env.cr.execute(
+                """
+                INSERT INTO discuss_hub_webhook_delivery AS d
+                    (connector_id, event, key, hit_count, create_uid, create_date,
+                     write_uid, write_date)
+                VALUES (%(connector_id)s, %(event)s, %(key)s, 0,
+                        %(uid)s, now() at time zone 'UTC',
+                        %(uid)s, now() at time zone 'UTC')
+                ON CONFLICT (connector_id, event, key) DO UPDATE
+                SET hit_count = d.hit_count + 1,
+                    write_date = now() at time zone 'UTC'
+                RETURNING hit_count
+                """,
+                {
+                    "connector_id": connector.id,
+                    "event": event,
+                    "key": key,
+                    "uid": self.env.uid,
+                },
+            )
+            if not self.env.cr.fetchone()[0]:
+                return True
+            self.invalidate_model(["hit_count", "write_date"])
+            self.remember(connector, event, key)
+        metrics.record(self.env.cr.dbname, connector.id, event, "duplicate", 0)
+        _logger.info(
+            f"action:webhook_duplicate connector {connector.name} event {event} "
+            + f"key {key}: already processed"
+        )
+        return False
+
+    @api.model
+    def remember(self, connector, event, key):
+        """
+        Let this worker answer the next redeliveries from memory, once the
+        transaction recording the delivery commits
+        """
+        self.env.cr.postcommit.add(
+            partial(_remember, (self.env.cr.dbname, connector.id, event, key))
+        )
+
+    @api.autovacuum
+    def _gc_old_deliveries(self):
+        # one row per inbound event, too many to unlink through the ORM
+        self.env.cr.execute(
+            """
+            DELETE FROM discuss_hub_webhook_delivery
+            WHERE create_date < %s
+            """,
+            (fields.Datetime.now() - timedelta(days=DELIVERY_RETENTION_DAYS),),
+        )
@@ -1 +1,18 @@
 from . import test_controller, test_utils, test_base, test_example, test_routing_manager
+from . import test_whatsapp_cloud
+from . import test_outbox
+from . import test_circuit_breaker
+from . import test_echo_suppression
+from . import test_bot_jobs
+from . import test_bot_media_cache
+from . import test_bot_sessions
+from . import test_bot_attachments
+from . import test_bot_response_cache
+from . import test_auto_archive
+from . import test_metrics
+from . import test_query_budget
+from . import test_payload_log
+from . import test_webhook_dedup
+from . import test_batch_webhooks
+from . import test_inbound_queue
+from . import test_wakeup
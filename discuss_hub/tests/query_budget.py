@@ -0,0 +1,159 @@
+"""
+Query budget support for the webhook handler tests.
+
+QueryRecorder records every statement run while replaying a payload, and
+QueryBudgetCase fails when a count exceeds its budget in query_budgets.json
+by more than QUERY_BUDGET_MARGIN, or when a handler has no budget.
+
+Environment variables:
+- DISCUSS_HUB_QUERY_BUDGET_UPDATE=1 rewrites query_budgets.json with the
+  measured counts instead of checking them, to accept a deliberate change.
+- DISCUSS_HUB_QUERY_REPORT=<path> writes the JSON report of the statements
+  issued by each handler.
+"""
+
+import json
+import logging
+import math
+import os
+import re
+from collections import Counter
+from unittest.mock import patch
+
+from odoo.sql_db import Cursor
+from odoo.tests.common import TransactionCase
+
+_logger = logging.getLogger(__name__)
+
+BUDGETS_PATH = os.path.join(os.path.dirname(__file__), "query_budgets.json")
+SHAPE_MAX_LENGTH = 240
+# share of a budget allowed on top of it, so a few statements more in the
+# core (a new compute, an extra check) do not fail the handler budgets
+QUERY_BUDGET_MARGIN = 0.1
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_VALUES_LIST = re.compile(r"\((?:\s*(?:%s|\?)\s*,)+\s*(?:%s|\?)\s*\)")
+_SPACES = re.compile(r"\s+")
+
+
+def statement_shape(query):
+    """Query with literals and value lists masked, to group similar ones"""
+    query = getattr(query, "code", query)
+    if isinstance(query, bytes):
+        query = query.decode(errors="replace")
+    shape = _STRING.sub("?", str(query))
+    shape = _NUMBER.sub("?", shape)
+    shape = _VALUES_LIST.sub("(...)", shape)
+    shape = _SPACES.sub(" ", shape).strip()
+    if len(shape) > SHAPE_MAX_LENGTH:
+        shape = shape[:SHAPE_MAX_LENGTH] + "..."
+    return shape
+
+
+class QueryRecorder:
+    """Record the statements executed, on any cursor, inside the block"""
+
+    def __init__(self, cr):
+        self.cr = cr
+        self.statements = []
+
+    def __enter__(self):
+        original = Cursor.execute
+        recorder = self
+
+        def execute(cr, query, params=None, log_exceptions=True):
+            shape = statement_shape(query)
+            if cr is not recorder.cr:
+                shape = f"[other cursor] {shape}"
+            recorder.statements.append(shape)
+            return original(cr, query, params, log_exceptions)
+
+        self._patch = patch.object(Cursor, "execute", execute)
+        self._patch.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._patch.stop()
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    def shapes(self):
+        return dict(Counter(self.statements).most_common())
+
+
+def load_budgets():
+    with open(BUDGETS_PATH) as f:
+        return json.load(f)
+
+
+class QueryBudgetCase(TransactionCase):
+    """Replay payloads through process_payload within a query budget"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.budgets = load_budgets()
+        cls.measured = {}
+        cls.update_budgets = os.getenv("DISCUSS_HUB_QUERY_BUDGET_UPDATE") == "1"
+
+    @classmethod
+    def tearDownClass(cls):
+        if cls.update_budgets and cls.measured:
+            budgets = load_budgets()
+            budgets.update(
+                {name: result["count"] for name, result in cls.measured.items()}
+            )
+            with open(BUDGETS_PATH, "w") as f:
+                json.dump(dict(sorted(budgets.items())), f, indent=4)
+                f.write("\n")
+        report_path = os.getenv("DISCUSS_HUB_QUERY_REPORT")
+        if report_path and cls.measured:
+            report = {}
+            if os.path.exists(report_path):
+                with open(report_path) as f:
+                    report = json.load(f)
+            report.update(cls.measured)
+            with open(report_path, "w") as f:
+                json.dump(dict(sorted(report.items())), f, indent=2)
+        super().tearDownClass()
+
+    def replay(self, name, connector, payload):
+        """
+        Process payload like a webhook request would, with a cold record
+        cache and the pending writes flushed, and check its query budget
+        """
+        self.env.flush_all()
+        self.env.invalidate_all()
+        with QueryRecorder(self.env.cr) as recorder:
+            response = connector.process_payload(payload)
+            self.env.flush_all()
+        self.measured[name] = {
+            "count": recorder.count,
+            "budget": self.budgets.get(name),
+            "statements": recorder.shapes(),
+        }
+        _logger.info(
+            f"action:query_budget {name}: {recorder.count} queries "
+            + f"(budget {self.budgets.get(name)})"
+        )
+        if self.update_budgets:
+            return response
+        budget = self.budgets.get(name)
+        self.assertIsInstance(
+            budget,
+            int,
+            f"No query budget for {name}, run with DISCUSS_HUB_QUERY_BUDGET_UPDATE=1",
+        )
+        self.assertLessEqual(
+            recorder.count,
+            budget + math.ceil(budget * QUERY_BUDGET_MARGIN),
+            f"{name} issued {recorder.count} queries, over its budget of "
+            + f"{budget}:\n"
+            + "\n".join(
+                f"{count:4} {shape}" for shape, count in recorder.shapes().items()
+            ),
+        )
+        return response
@@ -0,0 +1,110 @@
+from datetime import timedelta
+from unittest.mock import patch
+
+from odoo import fields
+from odoo.tests import tagged
+from odoo.tests.common import TransactionCase
+
+CONNECTOR = "odoo.addons.discuss_hub.models.models.DiscussHubConnector"
+
+
+@tagged("discuss_hub", "auto_archive")
+class TestAutoArchive(TransactionCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.connector = cls.env["discuss_hub.connector"].create(
+            {
+                "name": "test_auto_archive",
+                "type": "example",
+                "enabled": True,
+                "uuid": "11111111-1111-1111-1111-111111111118",
+                "url": "http://example.com",
+                "api_key": "1234567890",
+                "auto_archive_idle_hours": 24,
+                "auto_archive_close_message": "Closing this idle conversation",
+            }
+        )
+        cls.channels = cls.env["discuss.channel"].create(
+            [
+                {
+                    "name": f"Test Idle Channel {i}",
+                    "discuss_hub_connector": cls.connector.id,
+                    "channel_type": "group",
+                }
+                for i in range(2)
+            ]
+        )
+
+    def _post(self, channel, **context):
+        return (
+            self.env["mail.message"]
+            .with_context(**context)
+            .create(
+                {
+                    "model": "discuss.channel",
+                    "res_id": channel.id,
+                    "body": "hello",
+                    "message_type": "comment",
+                }
+            )
+        )
+
+    def _age(self, channel, hours):
+        channel.write(
+            {
+                "discuss_hub_last_activity_date": fields.Datetime.now()
+                - timedelta(hours=hours)
+            }
+        )
+
+    def test_activity_dates(self):
+        channel = self.channels[0]
+        self._post(channel, discuss_hub_inbound=True)
+        self.assertTrue(channel.discuss_hub_last_inbound_date)
+        self.assertFalse(channel.discuss_hub_last_outbound_date)
+        self._post(channel)
+        self.assertTrue(channel.discuss_hub_last_outbound_date)
+        self.assertEqual(
+            channel.discuss_hub_last_activity_date,
+            channel.discuss_hub_last_outbound_date,
+        )
+
+    def test_backfill_channels_without_activity(self):
+        channel = self.channels[0]
+        self.assertTrue(channel.discuss_hub_last_activity_date)
+        message = self._post(channel)
+        # as left by the install of the column on existing channels
+        self.env.cr.execute(
+            "UPDATE discuss_channel SET discuss_hub_last_activity_date = NULL"
+            " WHERE id = %s",
+            (channel.id,),
+        )
+        channel.invalidate_recordset(["discuss_hub_last_activity_date"])
+        self.env["discuss.channel"].init()
+        self.assertEqual(channel.discuss_hub_last_activity_date, message.create_date)
+
+    def test_cron_archives_idle_channels(self):
+        idle, recent = self.channels
+        self._age(idle, 30)
+        self._age(recent, 2)
+        with patch(f"{CONNECTOR}.outgo_message"):
+            self.env["discuss_hub.connector"]._cron_auto_archive_idle()
+        self.assertFalse(idle.active)
+        self.assertTrue(recent.active)
+        self.assertIn("Closing this idle conversation", idle.message_ids[0].body)
+
+    def test_disabled_policy(self):
+        self.connector.auto_archive_idle_hours = 0
+        self._age(self.channels[0], 1000)
+        self.env["discuss_hub.connector"]._cron_auto_archive_idle()
+        self.assertTrue(self.channels[0].active)
+
+    def test_unarchive_resets_activity(self):
+        channel = self.channels[0]
+        self._age(channel, 30)
+        channel.action_archive()
+        channel.action_unarchive()
+        with patch(f"{CONNECTOR}.outgo_message"):
+            self.env["discuss_hub.connector"]._cron_auto_archive_idle()
+        self.assertTrue(channel.active)
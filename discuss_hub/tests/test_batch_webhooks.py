@@ -0,0 +1,109 @@
+import json
+from unittest.mock import patch
+
+import requests
+
+from odoo.tests import tagged
+from odoo.tests.common import HttpCase
+
+
+@tagged("discuss_hub", "batch_webhooks")
+class TestBatchWebhooks(HttpCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.connector = cls.env["discuss_hub.connector"].create(
+            {
+                "name": "test_batch_webhooks",
+                "type": "example",
+                "enabled": True,
+                "uuid": "11111111-1111-1111-1111-111111111125",
+                "url": "http://example.com",
+                "api_key": "1234567890",
+            }
+        )
+
+    def setUp(self):
+        super().setUp()
+        patcher = patch("requests.get", side_effect=requests.ConnectionError)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _event(self, message_id):
+        return {
+            "message_id": message_id,
+            "message_type": "text",
+            "message": f"batched {message_id}",
+            "contact_name": "Batch Contact",
+            "contact_identifier": "5511977770000",
+        }
+
+    def _post(self, data, content_type):
+        return self.url_open(
+            f"/discuss_hub/connector/{self.connector.uuid}",
+            data=data,
+            headers={"Content-Type": content_type},
+        )
+
+    def _posted(self, message_id):
+        return self.env["mail.message"].search_count(
+            [("discuss_hub_message_id", "=", message_id)]
+        )
+
+    def test_json_array(self):
+        """A JSON array is processed in order with one result per event"""
+        events = [self._event("BATCH1"), "not an event", self._event("BATCH2")]
+        response = self._post(json.dumps(events), "application/json")
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data["count"], 3)
+        self.assertFalse(data["success"])
+        self.assertEqual([r["index"] for r in data["results"]], [0, 1, 2])
+        self.assertEqual(
+            [r["success"] for r in data["results"]],
+            [True, False, True],
+        )
+        self.assertEqual(data["results"][1]["error"], "Invalid JSON event")
+        self.assertEqual(self._posted("BATCH1"), 1)
+        self.assertEqual(self._posted("BATCH2"), 1)
+
+    def test_ndjson(self):
+        """NDJSON lines are events, an invalid line only fails itself"""
+        body = "\n".join(
+            [
+                json.dumps(self._event("BATCH3")),
+                "{broken",
+                json.dumps(self._event("BATCH4")),
+            ]
+        )
+        response = self._post(body, "application/x-ndjson")
+        data = response.json()
+        self.assertEqual(
+            [r["success"] for r in data["results"]],
+            [True, False, True],
+        )
+        self.assertEqual(self._posted("BATCH4"), 1)
+
+    def test_failing_event_is_rolled_back_alone(self):
+        """An event raising is rolled back, the others are kept"""
+        Plugin = type(self.connector.get_plugin())
+        original = Plugin.process_payload
+
+        def process_payload(plugin, payload):
+            response = original(plugin, payload)
+            if payload["message_id"] == "BATCH6":
+                raise ValueError("boom")
+            return response
+
+        with patch.object(Plugin, "process_payload", process_payload):
+            data = self.connector.process_payloads(
+                [self._event("BATCH5"), self._event("BATCH6"), self._event("BATCH7")]
+            )
+        self.assertEqual(
+            [r["success"] for r in data["results"]],
+            [True, False, True],
+        )
+        self.assertEqual(data["results"][1]["error"], "boom")
+        self.assertEqual(self._posted("BATCH5"), 1)
+        self.assertEqual(self._posted("BATCH6"), 0)
+        self.assertEqual(self._posted("BATCH7"), 1)
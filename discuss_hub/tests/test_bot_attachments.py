@@ -0,0 +1,67 @@
+import base64
+from unittest.mock import patch
+
+from odoo.tests import tagged
+from odoo.tests.common import TransactionCase
+
+POST = "odoo.addons.discuss_hub.models.bot_manager.requests.post"
+
+
+@tagged("discuss_hub", "bot_attachments")
+class TestBotAttachments(TransactionCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.bot = cls.env["discuss_hub.bot_manager"].create(
+            {"bot_url": "http://bot.example.com", "bot_api_key": "secret"}
+        )
+        cls.channel = cls.env["discuss.channel"].create(
+            {"name": "Test Bot Attachment Channel", "channel_type": "group"}
+        )
+        cls.attachment = cls.env["ir.attachment"].create(
+            {
+                "name": "voice.ogg",
+                "raw": b"voice note",
+                "mimetype": "audio/ogg",
+                "res_model": "discuss.channel",
+                "res_id": cls.channel.id,
+            }
+        )
+        cls.message = cls.env["mail.message"].create(
+            {
+                "model": "discuss.channel",
+                "res_id": cls.channel.id,
+                "body": "listen",
+                "attachment_ids": [(4, cls.attachment.id)],
+            }
+        )
+
+    def test_base64_mode(self):
+        variables = self.bot.get_attachment_variables(self.message)
+        self.assertEqual(variables["attachment_id"], self.attachment.id)
+        self.assertEqual(
+            base64.b64decode(variables["message_audio_base64"]), b"voice note"
+        )
+
+    def test_url_mode(self):
+        """Bots get a signed url and metadata instead of the bytes"""
+        self.bot.attachment_mode = "url"
+        variables = self.bot.get_attachment_variables(self.message)
+        self.assertIsNone(variables["message_audio_base64"])
+        self.assertEqual(variables["attachment_name"], "voice.ogg")
+        self.assertEqual(variables["attachment_mimetype"], "audio/ogg")
+        self.assertEqual(variables["attachment_size"], len(b"voice note"))
+        self.assertIn(
+            f"/discuss_hub/media/{self.attachment.id}/", variables["attachment_url"]
+        )
+
+    def test_generic_bot_payload(self):
+        self.bot.attachment_mode = "url"
+        with patch(POST) as post:
+            post.return_value.status_code = 200
+            post.return_value.content = b"[]"
+            post.return_value.json.return_value = []
+            self.bot.outgo(self.channel, self.env.user.partner_id, self.message)
+        payload = post.call_args.kwargs["json"]
+        self.assertTrue(payload["attachment_url"].startswith("http"))
+        self.assertIsNone(payload["message_audio_base64"])
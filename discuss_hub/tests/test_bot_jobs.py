@@ -0,0 +1,121 @@
+from unittest.mock import patch
+
+from odoo.tests import tagged
+from odoo.tests.common import TransactionCase
+from odoo.tools import config
+
+from odoo.addons.discuss_hub.models import wakeup
+
+BOT_MANAGER = "odoo.addons.discuss_hub.models.bot_manager.DiscussHubBotManager"
+CONNECTOR = "odoo.addons.discuss_hub.models.models.DiscussHubConnector"
+
+
+@tagged("discuss_hub", "bot_jobs")
+class TestBotJobs(TransactionCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.connector = cls.env["discuss_hub.connector"].create(
+            {
+                "name": "test_bot_jobs",
+                "type": "example",
+                "enabled": True,
+                "uuid": "11111111-1111-1111-1111-111111111117",
+                "url": "http://example.com",
+                "api_key": "1234567890",
+            }
+        )
+        cls.bot = cls.env["discuss_hub.bot_manager"].create(
+            {
+                "bot_url": "http://bot.example.com",
+                "bot_api_key": "secret",
+                "max_concurrency": 1,
+            }
+        )
+        cls.bot_partner = cls.env["res.partner"].create(
+            {"name": "Test Bot", "bot": cls.bot.id}
+        )
+        cls.channels = cls.env["discuss.channel"].create(
+            [
+                {
+                    "name": f"Test Bot Channel {i}",
+                    "discuss_hub_connector": cls.connector.id,
+                    "discuss_hub_outgoing_destination": f"551199999999{i}",
+                    "channel_type": "group",
+                }
+                for i in range(2)
+            ]
+        )
+        for channel in cls.channels:
+            cls.env["mail.message"].create(
+                {
+                    "model": "discuss.channel",
+                    "res_id": channel.id,
+                    "body": "hello bot",
+                }
+            )
+
+    def test_dispatch_queues_a_job(self):
+        """The bot is not called inside the incoming message transaction"""
+        channel = self.channels[0]
+        with patch(f"{BOT_MANAGER}.outgo") as outgo:
+            job = self.bot.dispatch(channel, self.bot_partner)
+        outgo.assert_not_called()
+        self.assertEqual(job.state, "pending")
+        self.assertEqual(job.message_id, channel.message_ids[0])
+        self.assertEqual(self.bot.job_pending_count, 1)
+
+    def test_dispatch_inline(self):
+        """async_dispatch disabled keeps answering inline"""
+        self.bot.async_dispatch = False
+        channel = self.channels[0]
+        with patch(f"{BOT_MANAGER}.outgo") as outgo:
+            self.bot.dispatch(channel, self.bot_partner)
+        outgo.assert_called_once_with(
+            channel, self.bot_partner, message=channel.message_ids[0]
+        )
+        self.assertFalse(self.env["discuss_hub.bot_manager.job"].search_count([]))
+
+    def test_claim_respects_concurrency(self):
+        """No more running jobs per bot than max_concurrency"""
+        Job = self.env["discuss_hub.bot_manager.job"]
+        jobs = Job.browse()
+        for channel in self.channels:
+            jobs |= self.bot.dispatch(channel, self.bot_partner)
+        self.assertEqual(Job._claim_next_job(), jobs[0])
+        self.assertFalse(Job._claim_next_job())
+        self.bot.max_concurrency = 2
+        self.assertEqual(Job._claim_next_job(), jobs[1])
+
+    def test_cron_runs_jobs(self):
+        """Jobs are run in order and failures answer with on_error_message"""
+        jobs = self.env["discuss_hub.bot_manager.job"].browse()
+        for channel in self.channels:
+            jobs |= self.bot.dispatch(channel, self.bot_partner)
+        with (
+            patch(
+                f"{BOT_MANAGER}.outgo", side_effect=[True, ValueError("boom")]
+            ) as outgo,
+            patch(f"{CONNECTOR}.outgo_message") as outgo_message,
+        ):
+            self.env["discuss_hub.bot_manager.job"]._cron_process_jobs()
+        self.assertEqual(outgo.call_count, 2)
+        self.assertEqual(jobs.mapped("state"), ["done", "failed"])
+        self.assertEqual(jobs[1].error, "boom")
+        error_message = self.channels[1].message_ids[0]
+        self.assertEqual(error_message.author_id, self.bot_partner)
+        outgo_message.assert_called_once_with(self.channels[1], error_message)
+
+    def test_request_timeout_within_cron_limits(self):
+        """Bot calls end within the time limits of the cron workers"""
+        limits = {
+            "limit_time_real": 120,
+            "limit_time_real_cron": -1,
+            "limit_time_cpu": 60,
+        }
+        with patch.dict(config.options, limits):
+            self.assertEqual(self.bot.bot_url_timeout, 360)
+            self.assertEqual(self.bot._request_timeout(), 15)
+            self.assertEqual(wakeup.cron_run_seconds(240), 30)
+        with patch.dict(config.options, dict(limits, limit_time_cpu=0)):
+            self.assertEqual(wakeup.cron_run_seconds(240), 60)
@@ -0,0 +1,159 @@
+from unittest.mock import MagicMock, patch
+
+from psycopg2 import IntegrityError
+
+from odoo.tests import tagged
+from odoo.tests.common import TransactionCase
+
+GET = "odoo.addons.discuss_hub.models.bot_manager.requests.get"
+CONNECTOR_OUTGO_MESSAGES = (
+    "odoo.addons.discuss_hub.models.models.DiscussHubConnector.outgo_messages"
+)
+
+
+def media_response(status_code=200, content=b"welcome video", headers=None):
+    return MagicMock(
+        status_code=status_code,
+        ok=status_code < 400,
+        content=content,
+        headers={"Content-Type": "video/mp4", "ETag": '"v1"', **(headers or {})},
+    )
+
+
+@tagged("discuss_hub", "bot_media_cache")
+class TestBotMediaCache(TransactionCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.Cache = cls.env["discuss_hub.bot_media_cache"]
+        cls.channel = cls.env["discuss.channel"].create(
+            {"name": "Test Bot Media Channel", "channel_type": "group"}
+        )
+
+    def test_revalidates_with_etag(self):
+        """A known url is revalidated and reused on 304"""
+        url = "http://typebot.example.com/welcome.mp4"
+        with patch(GET, return_value=media_response()):
+            entry = self.Cache.fetch(url)
+        self.assertEqual(entry.attachment_id.raw, b"welcome video")
+        with patch(GET, return_value=media_response(304, b"")) as get:
+            self.assertEqual(self.Cache.fetch(url), entry)
+        self.assertEqual(get.call_args.kwargs["headers"], {"If-None-Match": '"v1"'})
+        # counted once the job commits, from a cursor that sees the test
+        self.assertEqual(entry.hit_count, 0)
+        self.registry.enter_test_mode(self.cr)
+        self.addCleanup(self.registry.leave_test_mode)
+        self.env.cr.postcommit.run()
+        entry.invalidate_recordset()
+        self.assertEqual(entry.hit_count, 1)
+
+    def test_max_age_skips_download(self):
+        url = "http://typebot.example.com/fresh.mp4"
+        response = media_response(headers={"Cache-Control": "public, max-age=600"})
+        with patch(GET, return_value=response):
+            entry = self.Cache.fetch(url)
+        with patch(GET) as get:
+            self.assertEqual(self.Cache.fetch(url), entry)
+        get.assert_not_called()
+
+    def test_same_content_shares_attachment(self):
+        """Identical content under other urls shares the cached attachment"""
+        with patch(GET, return_value=media_response()):
+            first = self.Cache.fetch("http://typebot.example.com/a.mp4")
+            second = self.Cache.fetch("http://typebot.example.com/b.mp4")
+        self.assertNotEqual(first, second)
+        self.assertEqual(first.attachment_id, second.attachment_id)
+
+    def test_attach_to_channel(self):
+        with patch(GET, return_value=media_response()):
+            entry = self.Cache.fetch("http://typebot.example.com/c.mp4")
+        attachment = entry.attach_to(self.channel, name="video.mp4")
+        self.assertEqual(attachment.res_model, "discuss.channel")
+        self.assertEqual(attachment.res_id, self.channel.id)
+        self.assertEqual(attachment.checksum, entry.attachment_id.checksum)
+        self.assertEqual(attachment.raw, b"welcome video")
+
+    def test_evicts_least_recently_used(self):
+        self.env["ir.config_parameter"].sudo().set_param(
+            "discuss_hub.bot_media_cache_size_mb", 1
+        )
+        big = b"x" * (700 * 1024)
+        with patch(GET, return_value=media_response(content=big)):
+            old = self.Cache.fetch("http://typebot.example.com/old.mp4")
+        attachment = old.attachment_id
+        with patch(GET, return_value=media_response(content=big + b"y")):
+            new = self.Cache.fetch("http://typebot.example.com/new.mp4")
+        self.assertFalse(old.exists())
+        self.assertFalse(attachment.exists())
+        self.assertTrue(new.exists())
+
+    def test_evict_keeps_every_fetched_entry(self):
+        self.env["ir.config_parameter"].sudo().set_param(
+            "discuss_hub.bot_media_cache_size_mb", 1
+        )
+        big = b"x" * (700 * 1024)
+        with patch(GET, return_value=media_response(content=big)):
+            old = self.Cache.fetch("http://typebot.example.com/old.mp4")
+        with patch(
+            GET,
+            side_effect=[
+                media_response(content=big + b"a"),
+                media_response(content=big + b"b"),
+            ],
+        ):
+            entries = self.Cache.fetch_many(
+                [
+                    "http://typebot.example.com/a.mp4",
+                    "http://typebot.example.com/b.mp4",
+                ]
+            )
+        # both entries of the batch are over the cap but still in use
+        self.assertTrue(all(entry.exists() for entry in entries.values()))
+        self.assertFalse(old.exists())
+
+    def test_cached_meanwhile_by_another_worker(self):
+        """The download is still used when another worker cached the url"""
+        Cache = type(self.Cache)
+        with (
+            patch(GET, return_value=media_response()),
+            patch.object(Cache, "create", side_effect=IntegrityError("url_uniq")),
+        ):
+            entry = self.Cache.fetch("http://typebot.example.com/race.mp4")
+        downloaded = entry.attachment_id
+        attachment = entry.attach_to(self.channel, name="race.mp4")
+        self.env.cr.precommit.run()
+        self.assertFalse(downloaded.exists())
+        self.assertEqual(attachment.raw, b"welcome video")
+
+    def test_download_failure(self):
+        with patch(GET, return_value=media_response(404)):
+            self.assertFalse(self.Cache.fetch("http://typebot.example.com/x.mp4"))
+
+    def test_bubbles_posted_then_sent_in_order(self):
+        """Media are downloaded before posting and bubbles are sent in order"""
+        bot = self.env["discuss_hub.bot_manager"].create(
+            {
+                "bot_type": "typebot",
+                "bot_url": "http://typebot.example.com/api/v1/typebots/odoo/",
+                "bot_api_key": "secret",
+            }
+        )
+        bubbles = [
+            {"type": "text", "content": {"markdown": "Welcome!"}},
+            {"type": "video", "content": {"url": "http://typebot.example.com/w.mp4"}},
+            {"type": "text", "content": {"markdown": "Any question?"}},
+        ]
+        with (
+            patch(GET, return_value=media_response()) as get,
+            patch(CONNECTOR_OUTGO_MESSAGES) as outgo_messages,
+        ):
+            posted = bot.typebot_post_bubbles(
+                self.channel, self.env.user.partner_id, "session", bubbles
+            )
+        get.assert_called_once()
+        self.assertEqual(len(posted), 3)
+        self.assertEqual(posted[1].attachment_ids.name, "video.mp4")
+        outgo_messages.assert_called_once_with(self.channel, posted)
+        self.assertEqual(
+            [p.id for p in outgo_messages.call_args.args[1]], sorted(posted.ids)
+        )
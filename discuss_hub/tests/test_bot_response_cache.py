@@ -0,0 +1,76 @@
+from unittest.mock import patch
+
+from odoo.tests import tagged
+from odoo.tests.common import TransactionCase
+
+POST = "odoo.addons.discuss_hub.models.bot_manager.requests.post"
+OUTGO_MESSAGES = (
+    "odoo.addons.discuss_hub.models.models.DiscussHubConnector.outgo_messages"
+)
+
+
+@tagged("discuss_hub", "bot_response_cache")
+class TestBotResponseCache(TransactionCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.bot = cls.env["discuss_hub.bot_manager"].create(
+            {
+                "bot_url": "http://bot.example.com",
+                "bot_api_key": "secret",
+                "response_cache_enabled": True,
+                "response_cache_size": 2,
+            }
+        )
+        cls.channel = cls.env["discuss.channel"].create(
+            {"name": "Test Bot Cache Channel", "channel_type": "group"}
+        )
+
+    def _ask(self, body):
+        message = self.env["mail.message"].create(
+            {"model": "discuss.channel", "res_id": self.channel.id, "body": body}
+        )
+        with patch(POST) as post, patch(OUTGO_MESSAGES):
+            post.return_value.status_code = 200
+            post.return_value.content = b"[]"
+            post.return_value.json.return_value = [{"text": f"answer to {body}"}]
+            self.bot.generic_handle(message, self.channel, self.env.user.partner_id)
+        return post
+
+    def test_normalize_prompt(self):
+        self.assertEqual(
+            self.bot._normalize_prompt("<p>Qual o  HORÁRIO?</p>"), "qual o horario"
+        )
+
+    def test_repeated_prompt_is_answered_from_cache(self):
+        self.assertEqual(self._ask("Horário?").call_count, 1)
+        self.assertEqual(self._ask("horario").call_count, 0)
+        self.assertIn("answer to Horário?", self.channel.message_ids[0].body)
+        # counters are updated once the job transaction commits, from a
+        # cursor of their own that sees the test transaction
+        self.assertEqual(self.bot.response_cache_hits, 0)
+        self.registry.enter_test_mode(self.cr)
+        self.addCleanup(self.registry.leave_test_mode)
+        self.env.cr.postcommit.run()
+        self.env.invalidate_all()
+        cached = self.env["discuss_hub.bot_manager.response_cache"].search([])
+        self.assertEqual(cached.hit_count, 1)
+        self.assertEqual(self.bot.response_cache_hits, 1)
+        self.assertEqual(self.bot.response_cache_misses, 1)
+        self.assertEqual(self.bot.response_cache_hit_rate, 50.0)
+
+    def test_lru_size_limit_and_purge(self):
+        Cache = self.env["discuss_hub.bot_manager.response_cache"]
+        for prompt in ("horario", "endereco", "preco"):
+            self._ask(prompt)
+        self.assertEqual(
+            sorted(Cache.search([]).mapped("prompt")), ["endereco", "preco"]
+        )
+        self.bot.action_purge_response_cache()
+        self.assertFalse(Cache.search_count([]))
+        self.assertEqual(self.bot.response_cache_hits, 0)
+
+    def test_disabled_cache(self):
+        self.bot.response_cache_enabled = False
+        self._ask("preco")
+        self.assertEqual(self._ask("preco").call_count, 1)
@@ -0,0 +1,89 @@
+from datetime import timedelta
+
+from odoo import fields
+from odoo.tests import tagged
+from odoo.tests.common import TransactionCase
+
+
+@tagged("discuss_hub", "bot_sessions")
+class TestBotSessions(TransactionCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.bot = cls.env["discuss_hub.bot_manager"].create(
+            {
+                "bot_type": "typebot",
+                "bot_url": "http://typebot.example.com/api/v1/typebots/odoo/",
+                "bot_api_key": "secret",
+                "session_ttl_hours": 2,
+            }
+        )
+        cls.channel = cls.env["discuss.channel"].create(
+            {"name": "Test Bot Session Channel", "channel_type": "group"}
+        )
+
+    def setUp(self):
+        super().setUp()
+        self.bot._session_cache_drop(self.channel)
+
+    def test_session_is_cached(self):
+        """A running conversation only checks its session is still active"""
+        self.bot.typebot_register_new_session(self.channel, "session-1")
+        self.env.cr.postcommit.run()
+        with self.assertQueryCount(1):
+            self.assertEqual(self.bot.typebot_get_session_id(self.channel), "session-1")
+
+    def test_cached_session_restarted_by_another_worker(self):
+        first = self.bot.typebot_register_new_session(self.channel, "session-1")
+        self.env.cr.postcommit.run()
+        # another worker expires the session and starts a new one, its process
+        # cache is not shared with this one
+        self.env.cr.execute(
+            "UPDATE discuss_hub_bot_manager_session SET expired = true WHERE id = %s",
+            (first.id,),
+        )
+        self.env["discuss_hub.bot_manager.session"].create(
+            {
+                "bot_manager_id": self.bot.id,
+                "channel_id": self.channel.id,
+                "session_id": "session-2",
+            }
+        )
+        self.assertEqual(self.bot.typebot_get_session_id(self.channel), "session-2")
+
+    def test_new_session_replaces_cached_one(self):
+        first = self.bot.typebot_register_new_session(self.channel, "session-1")
+        self.bot.typebot_register_new_session(self.channel, "session-2")
+        self.assertTrue(first.expired)
+        self.assertEqual(self.bot.typebot_get_session_id(self.channel), "session-2")
+
+    def test_session_cached_only_once_committed(self):
+        self.bot.typebot_register_new_session(self.channel, "session-1")
+        self.env.cr.postcommit.clear()
+        self.env["discuss_hub.bot_manager.session"].search(
+            [("channel_id", "=", self.channel.id)]
+        ).unlink()
+        self.assertIsNone(self.bot.typebot_get_session_id(self.channel))
+
+    def test_cache_miss_reads_session(self):
+        self.env["discuss_hub.bot_manager.session"].create(
+            {
+                "bot_manager_id": self.bot.id,
+                "channel_id": self.channel.id,
+                "session_id": "session-db",
+            }
+        )
+        self.bot._session_cache_drop(self.channel)
+        self.assertEqual(self.bot.typebot_get_session_id(self.channel), "session-db")
+
+    def test_cron_expires_idle_sessions(self):
+        Session = self.env["discuss_hub.bot_manager.session"]
+        idle = self.bot.typebot_register_new_session(self.channel, "session-idle")
+        idle.last_used_date = fields.Datetime.now() - timedelta(hours=3)
+        other_channel = self.channel.copy()
+        active = self.bot.typebot_register_new_session(other_channel, "session-ok")
+        self.env.cr.postcommit.run()
+        Session._cron_expire_sessions()
+        self.assertTrue(idle.expired)
+        self.assertFalse(active.expired)
+        self.assertIsNone(self.bot.typebot_get_session_id(self.channel))
@@ -0,0 +1,110 @@
+from unittest.mock import MagicMock, patch
+
+import requests
+
+from odoo.tests import tagged
+from odoo.tests.common import TransactionCase
+
+from ..models.plugins.transport import (
+    CircuitBreaker,
+    CircuitBreakerSession,
+    CircuitOpenError,
+)
+
+SESSION_REQUEST = "requests.Session.request"
+
+
+@tagged("discuss_hub", "circuit_breaker")
+class TestCircuitBreaker(TransactionCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.connector = cls.env["discuss_hub.connector"].create(
+            {
+                "name": "test_circuit_breaker",
+                "type": "base",
+                "enabled": True,
+                "uuid": "11111111-1111-1111-1111-111111111115",
+                "url": "http://evolution:8080",
+                "api_key": "1234567890",
+                "circuit_breaker_threshold": 2,
+            }
+        )
+
+    def setUp(self):
+        super().setUp()
+        CircuitBreaker._registry.clear()
+        # keep the shared state out of the test transaction
+        self.publish = self.startPatcher(
+            patch.object(CircuitBreaker, "publish", return_value=True)
+        )
+        self.startPatcher(
+            patch.object(CircuitBreaker, "read_shared_state", return_value=None)
+        )
+
+    def test_circuit_opens_and_fails_fast(self):
+        """After threshold failures calls fail without reaching the provider"""
+        session = CircuitBreakerSession(self.connector)
+        url = "http://evolution:8080/message/sendText/test"
+        with patch(SESSION_REQUEST, side_effect=requests.ConnectionError) as call:
+            for _i in range(2):
+                with self.assertRaises(requests.ConnectionError):
+                    session.post(url, timeout=1)
+            with self.assertRaises(CircuitOpenError):
+                session.post(url, timeout=1)
+        self.assertEqual(call.call_count, 2, "Open circuit must not call provider")
+        self.publish.assert_called_once_with(self.connector, "open")
+
+    def test_server_errors_count_as_failures(self):
+        """5xx answers open the circuit, 4xx answers do not"""
+        session = CircuitBreakerSession(self.connector)
+        url = "http://evolution:8080/chat/findMessages/test"
+        with patch(SESSION_REQUEST, return_value=MagicMock(status_code=404)):
+            for _i in range(3):
+                session.post(url, timeout=1)
+        with patch(SESSION_REQUEST, return_value=MagicMock(status_code=503)):
+            for _i in range(2):
+                session.post(url, timeout=1)
+            with self.assertRaises(CircuitOpenError):
+                session.post(url, timeout=1)
+
+    def test_probe_closes_circuit(self):
+        """A successful probe closes the circuit, half-open is not shared"""
+        session = CircuitBreakerSession(self.connector)
+        url = "http://evolution:8080/instance/connect/test"
+        with patch(SESSION_REQUEST, side_effect=requests.ConnectionError):
+            for _i in range(2):
+                with self.assertRaises(requests.ConnectionError):
+                    session.get(url, timeout=1)
+        with patch(SESSION_REQUEST, return_value=MagicMock(status_code=200)):
+            self.assertTrue(session.probe("GET", url))
+            response = session.get(url, timeout=1)
+        self.assertEqual(response.status_code, 200)
+        states = [call.args[1] for call in self.publish.call_args_list]
+        self.assertEqual(states, ["open", "closed"])
+
+    def test_failed_probe_is_not_notified(self):
+        """Probing a provider still down keeps the circuit open silently"""
+        session = CircuitBreakerSession(self.connector)
+        url = "http://evolution:8080/instance/connect/test"
+        with patch(SESSION_REQUEST, side_effect=requests.ConnectionError):
+            for _i in range(2):
+                with self.assertRaises(requests.ConnectionError):
+                    session.get(url, timeout=1)
+            for _i in range(3):
+                self.assertFalse(session.probe("GET", url))
+            with self.assertRaises(CircuitOpenError):
+                session.get(url, timeout=1)
+        states = [call.args[1] for call in self.publish.call_args_list]
+        self.assertEqual(states, ["open"])
+
+    def test_disabled_breaker(self):
+        """With threshold 0 failures never open the circuit"""
+        self.connector.circuit_breaker_threshold = 0
+        session = CircuitBreakerSession(self.connector)
+        url = "http://evolution:8080/message/sendText/test"
+        with patch(SESSION_REQUEST, side_effect=requests.ConnectionError) as call:
+            for _i in range(4):
+                with self.assertRaises(requests.ConnectionError):
+                    session.post(url, timeout=1)
+        self.assertEqual(call.call_count, 4)
@@ -58,3 +58,27 @@ class TestControllerActiveInactive(HttpCase):
         )
         # assert response is 400
         self.assertEqual(response.status_code, 400)
+
+    def test_controller_signed_media(self):
+        """
+        Test the signed media route streams the attachment and rejects
+        tampered or expired links
+        """
+        attachment = self.env["ir.attachment"].create(
+            {
+                "name": "video.mp4",
+                "raw": b"streamed media content",
+                "mimetype": "video/mp4",
+            }
+        )
+        path = attachment.discuss_hub_media_path(ttl=60)
+        response = self.url_open(path)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b"streamed media content")
+        # tampered token
+        response = self.url_open(path.replace(path.split("/")[5], "0" * 64))
+        self.assertEqual(response.status_code, 403)
+        # expired link
+        expired_path = attachment.discuss_hub_media_path(ttl=-1)
+        response = self.url_open(expired_path)
+        self.assertEqual(response.status_code, 403)
@@ -0,0 +1,91 @@
+from unittest.mock import MagicMock, patch
+
+from odoo.tests import tagged
+from odoo.tests.common import TransactionCase
+
+CONNECTOR = "odoo.addons.discuss_hub.models.models.DiscussHubConnector"
+
+
+@tagged("discuss_hub", "echo_suppression")
+class TestEchoSuppression(TransactionCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.connector = cls.env["discuss_hub.connector"].create(
+            {
+                "name": "test_echo_suppression",
+                "type": "example",
+                "enabled": True,
+                "uuid": "11111111-1111-1111-1111-111111111116",
+                "url": "http://example.com",
+                "api_key": "1234567890",
+                "circuit_breaker_threshold": 0,
+            }
+        )
+        cls.channel = cls.env["discuss.channel"].create(
+            {
+                "name": "Test Echo Channel",
+                "discuss_hub_connector": cls.connector.id,
+                "discuss_hub_outgoing_destination": "5511999999999",
+                "channel_type": "group",
+            }
+        )
+
+    def _message(self, **context):
+        return (
+            self.env["mail.message"]
+            .with_context(**context)
+            .create(
+                {
+                    "model": "discuss.channel",
+                    "res_id": self.channel.id,
+                    "body": "hello",
+                    "discuss_hub_message_id": "ABC123",
+                }
+            )
+        )
+
+    def test_process_payload_flags_inbound_messages(self):
+        """Messages created from a webhook are flagged as inbound"""
+        payload = {
+            "message_id": "echo-1",
+            "message_type": "text",
+            "message": "Hello World",
+            "contact_name": "John Doe",
+            "contact_identifier": "1234567891",
+        }
+        with patch("requests.get", return_value=MagicMock(status_code=404)):
+            response = self.connector.process_payload(payload)
+        message = self.env["mail.message"].browse(response["new_message_id"])
+        self.assertTrue(message.discuss_hub_inbound)
+
+    def test_inbound_message_is_not_sent_back(self):
+        """outgo_message skips inbound messages and sends the others"""
+        plugin = MagicMock()
+        with patch(f"{CONNECTOR}.get_plugin", return_value=plugin):
+            self.connector.outgo_message(
+                self.channel, self._message(discuss_hub_inbound=True)
+            )
+            plugin.outgo_message.assert_not_called()
+            outgoing = self._message()
+            self.connector.outgo_message(self.channel, outgoing)
+            plugin.outgo_message.assert_called_once_with(self.channel, outgoing)
+
+    def test_inbound_reaction_is_not_sent_back(self):
+        """outgo_reaction skips reactions received from the provider"""
+        message = self._message()
+        reaction = (
+            self.env["mail.message.reaction"]
+            .with_context(discuss_hub_inbound=True)
+            .create(
+                {
+                    "message_id": message.id,
+                    "partner_id": self.env.user.partner_id.id,
+                    "content": "👍",
+                }
+            )
+        )
+        plugin = MagicMock()
+        with patch(f"{CONNECTOR}.get_plugin", return_value=plugin):
+            self.connector.outgo_reaction(self.channel, message, reaction)
+        plugin.outgo_reaction.assert_not_called()
@@ -0,0 +1,298 @@
+import json
+import time
+from unittest.mock import patch
+
+import requests
+from psycopg2.errors import SerializationFailure
+
+from odoo.tests import tagged
+from odoo.tests.common import HttpCase, TransactionCase
+
+from odoo.addons.discuss_hub.models import inbound_queue
+
+
+def _event(message_id, contact="5511955550000"):
+    return {
+        "message_id": message_id,
+        "message_type": "text",
+        "message": f"queued {message_id}",
+        "contact_name": "Queued Contact",
+        "contact_identifier": contact,
+    }
+
+
+@tagged("discuss_hub", "inbound_queue")
+class TestInboundQueue(TransactionCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.connector = cls.env["discuss_hub.connector"].create(
+            {
+                "name": "test_inbound_queue",
+                "type": "example",
+                "enabled": True,
+                "uuid": "11111111-1111-1111-1111-111111111126",
+                "url": "http://example.com",
+                "api_key": "1234567890",
+                "queue_inbound": True,
+            }
+        )
+        cls.Event = cls.env["discuss_hub.inbound_event"]
+
+    def setUp(self):
+        super().setUp()
+        patcher = patch("requests.get", side_effect=requests.ConnectionError)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _queued(self):
+        return self.Event.search([("connector_id", "=", self.connector.id)])
+
+    def _posted(self, message_id):
+        return self.env["mail.message"].search(
+            [("discuss_hub_message_id", "=", message_id)]
+        )
+
+    def test_enqueue_partitions_by_contact(self):
+        """Events of a contact share a partition, invalid events are reported"""
+        response = self.Event.enqueue(
+            self.connector,
+            [
+                _event("Q1"),
+                "not an event",
+                _event("Q2"),
+                _event("Q3", contact="5511955551111"),
+            ],
+        )
+        self.assertEqual(response, {"success": False, "queued": 3, "invalid": [1]})
+        first, second, other = self._queued()
+        self.assertEqual(first.partition_key, "5511955550000")
+        self.assertEqual(first.partition, second.partition)
+        self.assertEqual(other.partition_key, "5511955551111")
+        self.assertEqual(
+            first.partition,
+            inbound_queue.partition_of(self.connector.id, "5511955550000"),
+        )
+        self.assertEqual(self.connector.inbound_queued_count, 3)
+
+    def test_partition_processed_in_order(self):
+        """Only the head of a partition is taken, events keep their order"""
+        self.Event.enqueue(self.connector, [_event("Q4"), _event("Q5")])
+        first, second = self._queued()
+        self.assertTrue(self.Event._run_next_event([first.partition]))
+        self.assertEqual(first.state, "done")
+        self.assertEqual(second.state, "pending")
+        self.Event._cron_process_inbound()
+        self.assertEqual(second.state, "done")
+        self.assertLess(self._posted("Q4").id, self._posted("Q5").id)
+
+    def test_other_partitions_are_left_alone(self):
+        self.Event.enqueue(self.connector, [_event("Q6")])
+        event = self._queued()
+        others = [
+            p for p in range(inbound_queue.INGEST_PARTITIONS) if p != event.partition
+        ]
+        self.assertFalse(self.Event._run_next_event(others))
+        self.assertEqual(event.state, "pending")
+
+    def test_failing_event_does_not_block_partition(self):
+        """A failing event is rolled back and marked failed, the next ones run"""
+        self.Event.enqueue(self.connector, [_event("Q7"), _event("Q8"), _event("Q9")])
+        Plugin = type(self.connector.get_plugin())
+        original = Plugin.process_payload
+
+        def process_payload(plugin, payload):
+            response = original(plugin, payload)
+            if payload["message_id"] == "Q8":
+                raise ValueError("boom")
+            return response
+
+        with patch.object(Plugin, "process_payload", process_payload):
+            self.Event._cron_process_inbound()
+        self.assertEqual(self._queued().mapped("state"), ["done", "failed", "done"])
+        self.assertFalse(self._posted("Q8"))
+        self.assertTrue(self._posted("Q9"))
+
+    def test_concurrent_update_is_retried(self):
+        """An event failing on a concurrent update stays pending a few times"""
+        self.Event.enqueue(self.connector, [_event("Q12")])
+        event = self._queued()
+        Plugin = type(self.connector.get_plugin())
+        with patch.object(
+            Plugin,
+            "process_payload",
+            side_effect=SerializationFailure("could not serialize access"),
+        ):
+            self.assertTrue(self.Event._run_next_event([event.partition]))
+            self.assertEqual(event.state, "pending")
+            self.assertEqual(event.attempt_count, 1)
+            self.Event._cron_process_inbound()
+        self.assertEqual(event.state, "failed")
+        self.assertEqual(event.attempt_count, inbound_queue.INBOUND_MAX_ATTEMPTS - 1)
+
+    def test_worker_survives_a_failing_iteration(self):
+        """A failing iteration is logged and the worker goes on"""
+        # the worker cursors see the test transaction
+        self.registry.enter_test_mode(self.cr)
+        self.addCleanup(self.registry.leave_test_mode)
+        self.Event.enqueue(self.connector, [_event("Q10")])
+        Event = type(self.Event)
+        original = Event._run_next_event
+        calls = []
+
+        def run_next_event(model, partitions=None, lanes=None):
+            calls.append(partitions)
+            if len(calls) == 1:
+                raise ValueError("connection lost")
+            return original(model, partitions, lanes)
+
+        with (
+            patch.object(Event, "_run_next_event", run_next_event),
+            patch.object(inbound_queue, "WORKER_IDLE_WAIT", 0),
+            self.assertLogs(inbound_queue.__name__, "ERROR"),
+        ):
+            left = self.Event._worker_loop(
+                self.env.cr.dbname, "test-worker", "0", time.monotonic() + 60
+            )
+        self.assertFalse(left)
+        self.env.invalidate_all()
+        self.assertEqual(self._queued().state, "done")
+
+    def test_worker_stops_at_its_deadline(self):
+        """Past its run time a worker stops and reports the events left"""
+        # the worker cursors see the test transaction
+        self.registry.enter_test_mode(self.cr)
+        self.addCleanup(self.registry.leave_test_mode)
+        self.Event.enqueue(self.connector, [_event("Q11")])
+        left = self.Event._worker_loop(
+            self.env.cr.dbname, "test-worker", "0", time.monotonic()
+        )
+        self.assertTrue(left)
+        self.assertEqual(self._queued().state, "pending")
+
+    def test_rebalance_moves_only_the_partitions_of_a_leaving_worker(self):
+        workers = ["w1", "w2", "w3"]
+        owned = {w: set(inbound_queue.owned_partitions(w, workers)) for w in workers}
+        self.assertEqual(
+            set().union(*owned.values()), set(range(inbound_queue.INGEST_PARTITIONS))
+        )
+        self.assertFalse(owned["w1"] & owned["w2"])
+        remaining = ["w1", "w2"]
+        for worker in remaining:
+            self.assertLessEqual(
+                owned[worker], set(inbound_queue.owned_partitions(worker, remaining))
+            )
+        self.assertEqual(inbound_queue.owned_partitions("gone", remaining), [])
+
+    def test_partition_lag(self):
+        """Pending events are reported by partition with their worker"""
+        partitions = self.Event._heartbeat("test-worker")
+        self.Event.enqueue(self.connector, [_event("Q10"), _event("Q11")])
+        partition = self._queued()[:1].partition
+        lag = {
+            row["partition"]: row
+            for row in self.Event._partition_lag()
+            if row["lane"] == "0"
+        }
+        self.assertEqual(lag[partition]["pending"], 2)
+        self.assertGreaterEqual(lag[partition]["lag_seconds"], 0)
+        if partition in partitions:
+            self.assertEqual(lag[partition]["worker"], "test-worker")
+
+    def _read(self, message_id, contact="5511955550000"):
+        return {
+            "message_id": message_id,
+            "message_type": "read",
+            "contact_identifier": contact,
+        }
+
+    def test_lanes(self):
+        """Events are classified in lanes from their event type"""
+        self.Event.enqueue(self.connector, [_event("L1"), self._read("L1")])
+        self.assertEqual(self._queued().mapped("lane"), ["0", "2"])
+        evolution = self.env["discuss_hub.connector"].create(
+            {
+                "name": "test_inbound_queue_evolution",
+                "type": "evolution",
+                "uuid": "11111111-1111-1111-1111-111111111129",
+                "url": "http://evolution.example.com",
+                "api_key": "1234567890",
+            }
+        )
+        plugin = evolution.get_plugin()
+
+        def upsert(message):
+            return {"event": "messages.upsert", "data": {"message": message}}
+
+        self.assertEqual(plugin.get_lane(upsert({"conversation": "hi"})), "0")
+        self.assertEqual(
+            plugin.get_lane(upsert({"reactionMessage": {"text": "👍"}})), "1"
+        )
+        self.assertEqual(plugin.get_lane({"event": "messages.delete"}), "1")
+        self.assertEqual(plugin.get_lane({"event": "messages.update"}), "2")
+        self.assertEqual(plugin.get_lane({"event": "contacts.upsert", "data": []}), "3")
+        self.assertEqual(plugin.get_lane({"event": "qrcode.updated"}), "3")
+
+    def test_live_messages_first(self):
+        """A live message passes the queued receipts, even of its contact"""
+        self.Event.enqueue(
+            self.connector,
+            [self._read("L2", contact="5511955552222"), self._read("L3"), _event("L4")],
+        )
+        receipt, own_receipt, message = self._queued()
+        self.assertTrue(self.Event._run_next_event())
+        self.assertEqual(message.state, "done")
+        self.assertEqual(receipt.state, "pending")
+        self.assertEqual(own_receipt.state, "pending")
+
+    def test_receipt_waits_for_its_message(self):
+        """A lower lane event never passes an earlier event of its contact"""
+        self.Event.enqueue(self.connector, [_event("L5"), self._read("L5")])
+        message, receipt = self._queued()
+        self.assertFalse(self.Event._run_next_event(lanes=["2"]))
+        self.assertTrue(self.Event._run_next_event(lanes=["0"]))
+        self.assertEqual(message.state, "done")
+        self.assertTrue(self.Event._run_next_event(lanes=["2"]))
+        self.assertNotEqual(receipt.state, "pending")
+
+    def test_lane_workers(self):
+        """Each lane gets reserved workers, the rest is spread by share"""
+        self.assertEqual(inbound_queue.lane_workers(4), ["0", "1", "2", "3"])
+        self.assertEqual(
+            inbound_queue.lane_workers(8), ["0", "0", "0", "0", "1", "1", "2", "3"]
+        )
+        self.assertEqual(inbound_queue.lane_workers(2), ["0", "1"])
+        self.assertEqual(inbound_queue.lane_workers(3, "100,0,0,0"), ["0"] * 3)
+
+
+@tagged("discuss_hub", "inbound_queue")
+class TestInboundQueueController(HttpCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.connector = cls.env["discuss_hub.connector"].create(
+            {
+                "name": "test_inbound_queue_controller",
+                "type": "example",
+                "enabled": True,
+                "uuid": "11111111-1111-1111-1111-111111111127",
+                "url": "http://example.com",
+                "api_key": "1234567890",
+                "queue_inbound": True,
+            }
+        )
+
+    def test_webhook_is_queued(self):
+        """Queued connectors acknowledge events with a 202 without processing"""
+        response = self.url_open(
+            f"/discuss_hub/connector/{self.connector.uuid}",
+            data=json.dumps(_event("Q12")),
+            headers={"Content-Type": "application/json"},
+        )
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()["queued"], 1)
+        event = self.env["discuss_hub.inbound_event"].search(
+            [("connector_id", "=", self.connector.id)]
+        )
+        self.assertEqual(event.state, "pending")
+        self.assertEqual(event.payload["message_id"], "Q12")
@@ -0,0 +1,107 @@
+from unittest.mock import patch
+
+import requests
+
+from odoo.tests import tagged
+from odoo.tests.common import HttpCase, TransactionCase
+
+from odoo.addons.discuss_hub.models import metrics
+
+
+@tagged("discuss_hub", "metrics")
+class TestStageMetrics(TransactionCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.connector = cls.env["discuss_hub.connector"].create(
+            {
+                "name": "test_metrics",
+                "type": "example",
+                "enabled": True,
+                "uuid": "11111111-1111-1111-1111-111111111119",
+                "url": "http://example.com",
+                "api_key": "1234567890",
+            }
+        )
+
+    def setUp(self):
+        super().setUp()
+        metrics._pending.pop(self.env.cr.dbname, None)
+
+    def _pending(self):
+        return metrics._pending.get(self.env.cr.dbname, {})
+
+    def test_process_payload_stages(self):
+        """Every stage of the inbound pipeline is timed per connector and event"""
+        payload = {
+            "message_id": "METRICS1",
+            "message_type": "text",
+            "message": "Hello metrics",
+            "contact_name": "Metrics Contact",
+            "contact_identifier": "5511900000001",
+        }
+        with patch("requests.get", side_effect=requests.ConnectionError):
+            self.connector.process_payload(payload)
+        stages = {
+            stage
+            for connector_id, event, stage in self._pending()
+            if connector_id == self.connector.id and event == "text"
+        }
+        self.assertEqual(
+            stages,
+            {"process_payload", "get_or_create_partner", "get_or_create_channel"},
+        )
+        count, errors, seconds, buckets = self._pending()[
+            (self.connector.id, "text", "process_payload")
+        ]
+        self.assertEqual((count, errors), (1, 0))
+        self.assertEqual(sum(buckets), 1)
+        self.assertIsNone(metrics.current_event())
+
+    def test_errors_and_flush(self):
+        """Failures are counted and flushes add up in the shared table"""
+        for _i in range(2):
+            with self.assertRaises(ValueError), metrics.event_scope("messages.upsert"):
+                with metrics.stage_timer(self.connector, "handle_text_message"):
+                    raise ValueError("boom")
+            self.assertEqual(metrics.flush(self.env.cr), 1)
+        self.assertFalse(self._pending())
+        self.env.cr.execute(
+            """
+            SELECT count, error_count, buckets FROM discuss_hub_stage_metric
+            WHERE connector_id = %s AND event = 'messages.upsert'
+                AND stage = 'handle_text_message'
+            """,
+            (self.connector.id,),
+        )
+        count, errors, buckets = self.env.cr.fetchone()
+        self.assertEqual((count, errors, sum(buckets)), (2, 2, 2))
+        text = metrics.render_prometheus(self.env)
+        labels = (
+            'connector="test_metrics",event="messages.upsert",'
+            + 'stage="handle_text_message"'
+        )
+        self.assertIn(
+            f'discuss_hub_stage_duration_seconds_bucket{{{labels},le="+Inf"}} 2', text
+        )
+        self.assertIn(f"discuss_hub_stage_duration_seconds_count{{{labels}}} 2", text)
+        self.assertIn(f"discuss_hub_stage_errors_total{{{labels}}} 2", text)
+
+
+@tagged("discuss_hub", "metrics")
+class TestMetricsController(HttpCase):
+    def test_metrics_route_token(self):
+        """The metrics route is off without a token and checks it otherwise"""
+        self.assertEqual(self.url_open("/discuss_hub/metrics").status_code, 404)
+        self.env["ir.config_parameter"].sudo().set_param(
+            "discuss_hub.metrics_token", "scrape-me"
+        )
+        response = self.url_open("/discuss_hub/metrics?token=wrong")
+        self.assertEqual(response.status_code, 403)
+        response = self.url_open(
+            "/discuss_hub/metrics", headers={"Authorization": "Bearer scrape-me"}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(
+            "# TYPE discuss_hub_stage_duration_seconds histogram", response.text
+        )
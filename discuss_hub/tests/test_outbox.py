@@ -0,0 +1,174 @@
+from unittest.mock import MagicMock, patch
+
+from odoo.tests import tagged
+from odoo.tests.common import TransactionCase
+
+CONNECTOR = "odoo.addons.discuss_hub.models.models.DiscussHubConnector"
+
+
+@tagged("discuss_hub", "outbox")
+class TestOutbox(TransactionCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.connector = cls.env["discuss_hub.connector"].create(
+            {
+                "name": "test_outbox",
+                "type": "base",
+                "enabled": True,
+                "uuid": "11111111-1111-1111-1111-111111111114",
+                "url": "http://evolution:8080",
+                "api_key": "1234567890",
+                "rate_limit_enabled": True,
+                "rate_limit_per_second": 1,
+                "rate_limit_burst": 1,
+            }
+        )
+        cls.channel = cls.env["discuss.channel"].create(
+            {
+                "name": "Test Outbox Channel",
+                "discuss_hub_connector": cls.connector.id,
+                "discuss_hub_outgoing_destination": "5511999999999",
+                "channel_type": "group",
+            }
+        )
+        cls.other_channel = cls.env["discuss.channel"].create(
+            {
+                "name": "Other Outbox Channel",
+                "discuss_hub_connector": cls.connector.id,
+                "discuss_hub_outgoing_destination": "5511888888888",
+                "channel_type": "group",
+            }
+        )
+
+    def _message(self, channel, body):
+        return self.env["mail.message"].create(
+            {"model": "discuss.channel", "res_id": channel.id, "body": body}
+        )
+
+    def test_throttled_send_is_queued(self):
+        """A send without tokens is queued instead of dropped"""
+        plugin = MagicMock()
+        message = self._message(self.channel, "hello")
+        with (
+            patch(f"{CONNECTOR}.get_plugin", return_value=plugin),
+            patch(f"{CONNECTOR}._rate_limit_acquire", return_value=False),
+        ):
+            item = self.connector.outgo_message(self.channel, message)
+        plugin.outgo_message.assert_not_called()
+        self.assertEqual(item.state, "queued")
+        self.assertEqual(item.priority, "0")
+        self.assertEqual(self.connector.outbox_queued_count, 1)
+
+    def test_sends_wait_behind_queued_channel_items(self):
+        """Later sends of a channel with queued items keep their order"""
+        plugin = MagicMock()
+        first = self._message(self.channel, "first")
+        second = self._message(self.channel, "second")
+        with patch(f"{CONNECTOR}.get_plugin", return_value=plugin):
+            with patch(f"{CONNECTOR}._rate_limit_acquire", return_value=False):
+                self.connector.outgo_message(self.channel, first)
+            with patch(f"{CONNECTOR}._rate_limit_acquire", return_value=True):
+                self.connector.outgo_message(self.channel, second)
+        plugin.outgo_message.assert_not_called()
+        self.assertEqual(self.connector.outbox_queued_count, 2)
+
+    def test_outbox_drains_by_priority(self):
+        """Agent replies are sent before queued bulk campaign messages"""
+        outbox = self.env["discuss_hub.outbox"]
+        bulk = outbox.enqueue(
+            self.connector,
+            self.other_channel,
+            self._message(self.other_channel, "campaign"),
+            "3",
+        )
+        agent = outbox.enqueue(
+            self.connector, self.channel, self._message(self.channel, "reply"), "0"
+        )
+        plugin = MagicMock()
+        with (
+            patch(f"{CONNECTOR}.get_plugin", return_value=plugin),
+            patch(f"{CONNECTOR}._rate_limit_acquire", side_effect=[True, False]),
+        ):
+            outbox._process_connector_queue(self.connector)
+        self.assertEqual(agent.state, "sent")
+        self.assertEqual(bulk.state, "queued")
+        plugin.outgo_message.assert_called_once_with(self.channel, agent.message_id)
+
+    def test_channel_order_across_priorities(self):
+        """An urgent item queued behind a bulk one of its channel keeps its place"""
+        outbox = self.env["discuss_hub.outbox"]
+        bulk = outbox.enqueue(
+            self.connector, self.channel, self._message(self.channel, "campaign"), "3"
+        )
+        agent = outbox.enqueue(
+            self.connector, self.channel, self._message(self.channel, "reply"), "0"
+        )
+        self.assertEqual(bulk.priority, "0")
+        plugin = MagicMock()
+        with (
+            patch(f"{CONNECTOR}.get_plugin", return_value=plugin),
+            patch(f"{CONNECTOR}._rate_limit_acquire", return_value=True),
+        ):
+            outbox._process_connector_queue(self.connector)
+        self.assertEqual((bulk | agent).mapped("state"), ["sent", "sent"])
+        self.assertEqual(
+            [call.args[1] for call in plugin.outgo_message.call_args_list],
+            [bulk.message_id, agent.message_id],
+        )
+
+    def test_refused_send_blocks_its_channel(self):
+        """A send refused by the provider fails and holds its channel back"""
+        outbox = self.env["discuss_hub.outbox"]
+        refused = outbox.enqueue(
+            self.connector, self.channel, self._message(self.channel, "first"), "0"
+        )
+        following = outbox.enqueue(
+            self.connector, self.channel, self._message(self.channel, "second"), "0"
+        )
+        plugin = MagicMock()
+        plugin.outgo_message.return_value = False
+        with (
+            patch(f"{CONNECTOR}.get_plugin", return_value=plugin),
+            patch(f"{CONNECTOR}._rate_limit_acquire", return_value=True),
+        ):
+            outbox._process_connector_queue(self.connector)
+        self.assertEqual(refused.state, "failed")
+        self.assertEqual(refused.error, "Refused by the provider")
+        self.assertEqual(following.state, "queued")
+        plugin.outgo_message.assert_called_once_with(self.channel, refused.message_id)
+
+    def test_open_circuit_stops_the_drain(self):
+        """Items left once the circuit opens stay queued, they are not failed"""
+        outbox = self.env["discuss_hub.outbox"]
+        failing = outbox.enqueue(
+            self.connector, self.channel, self._message(self.channel, "first"), "0"
+        )
+        other = outbox.enqueue(
+            self.connector,
+            self.other_channel,
+            self._message(self.other_channel, "second"),
+            "0",
+        )
+
+        def outgo_message(channel, message):
+            # the failure opens the circuit of the connector
+            self.env.cr.execute(
+                """
+                INSERT INTO discuss_hub_circuit (connector_id, host, state, changed_at)
+                VALUES (%s, 'evolution', 'open', now() at time zone 'UTC')
+                """,
+                (self.connector.id,),
+            )
+            return False
+
+        plugin = MagicMock()
+        plugin.outgo_message.side_effect = outgo_message
+        with (
+            patch(f"{CONNECTOR}.get_plugin", return_value=plugin),
+            patch(f"{CONNECTOR}._rate_limit_acquire", return_value=True),
+        ):
+            outbox._process_connector_queue(self.connector)
+        self.assertEqual(failing.state, "failed")
+        self.assertEqual(other.state, "queued")
+        plugin.outgo_message.assert_called_once()
@@ -0,0 +1,89 @@
+import base64
+import json
+import logging
+from unittest.mock import patch
+
+import requests
+
+from odoo.tests import tagged
+from odoo.tests.common import TransactionCase
+
+from odoo.addons.discuss_hub.models import payload_log
+
+
+@tagged("discuss_hub", "payload_log")
+class TestPayloadLog(TransactionCase):
+    def test_redact(self):
+        """Blobs become length and hash, secrets and long values are cut"""
+        media = base64.b64encode(b"\x00" * 300000).decode()
+        redacted = payload_log.redact(
+            {
+                "apikey": "secret",
+                "data": {
+                    "message": {"base64": media, "conversation": "hello"},
+                    "text": "word " * 100,
+                    "items": list(range(30)),
+                },
+            }
+        )
+        self.assertEqual(redacted["apikey"], "***")
+        blob = redacted["data"]["message"]["base64"]
+        self.assertTrue(blob.startswith(f"<blob len={len(media)} sha256="))
+        self.assertEqual(redacted["data"]["message"]["conversation"], "hello")
+        self.assertEqual(len(redacted["data"]["text"]), 256 + len("...<+244>"))
+        self.assertEqual(redacted["data"]["items"][-1], "<+10 items>")
+        self.assertLess(len(payload_log.dumps({"media": media})), 100)
+
+    def test_sampling(self):
+        """Repetitive events are logged once every SAMPLE_RATE"""
+        with self.assertLogs("odoo.addons.discuss_hub", level="INFO") as logs:
+            for _i in range(payload_log.SAMPLE_RATE + 1):
+                payload_log.log_event(
+                    logging.getLogger("odoo.addons.discuss_hub"),
+                    "process_payload",
+                    connector="test_sampling",
+                    event="messages.update",
+                    payload={"data": {"keyId": "ABC"}},
+                )
+        self.assertEqual(len(logs.records), 2)
+        line = json.loads(logs.records[0].getMessage())
+        self.assertEqual(line["sampled"], payload_log.SAMPLE_RATE)
+        self.assertEqual(line["message_id"], "ABC")
+
+    def test_process_payload_line(self):
+        """process_payload writes one bounded JSON line per event"""
+        connector = self.env["discuss_hub.connector"].create(
+            {
+                "name": "test_payload_log",
+                "type": "example",
+                "enabled": True,
+                "uuid": "11111111-1111-1111-1111-111111111123",
+                "url": "http://example.com",
+                "api_key": "1234567890",
+            }
+        )
+        payload = {
+            "message_id": "LOG1",
+            "message_type": "text",
+            "message": "x" * 100000,
+            "contact_identifier": "5511955550000",
+        }
+        with (
+            patch("requests.get", side_effect=requests.ConnectionError),
+            self.assertLogs("odoo.addons.discuss_hub.models.models") as logs,
+        ):
+            connector.process_payload(payload)
+        lines = [
+            json.loads(record.getMessage())
+            for record in logs.records
+            if record.getMessage().startswith('{"action":"process_payload"')
+        ]
+        self.assertEqual(len(lines), 1)
+        line = lines[0]
+        self.assertEqual(line["connector"], "test_payload_log")
+        self.assertEqual(line["event"], "text")
+        self.assertEqual(line["message_id"], "LOG1")
+        self.assertEqual(line["contact"], "5511955550000")
+        self.assertTrue(line["success"])
+        self.assertIn("duration_ms", line)
+        self.assertLess(len(json.dumps(line)), payload_log.MAX_LINE_LENGTH)
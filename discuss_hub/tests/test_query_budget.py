@@ -0,0 +1,278 @@
+from unittest.mock import patch
+
+import requests
+
+from odoo.tests import tagged
+
+from .query_budget import QueryBudgetCase, statement_shape
+
+# 1x1 transparent png
+PNG_BASE64 = (
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNkYPhfDwAChwGA"
+    "60e6kgAAAABJRU5ErkJggg=="
+)
+
+
+def _provider_unreachable(*args, **kwargs):
+    """No provider in the tests: profile pictures and lookups get a 404"""
+    response = requests.Response()
+    response.status_code = 404
+    response._content = b"{}"
+    return response
+
+
+@tagged("discuss_hub", "query_budget")
+class TestQueryBudget(QueryBudgetCase):
+    """One representative payload per webhook event type"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.evolution = cls.env["discuss_hub.connector"].create(
+            {
+                "name": "test_query_budget_evolution",
+                "type": "evolution",
+                "enabled": True,
+                "uuid": "11111111-1111-1111-1111-111111111120",
+                "url": "http://evolution.example.com",
+                "api_key": "1234567890",
+                "import_contacts": True,
+                "show_read_receipts": True,
+            }
+        )
+        cls.whatsapp_cloud = cls.env["discuss_hub.connector"].create(
+            {
+                "name": "test_query_budget_whatsapp_cloud",
+                "type": "whatsapp_cloud",
+                "enabled": True,
+                "uuid": "11111111-1111-1111-1111-111111111121",
+                "url": "http://graph.example.com/v1/123",
+                "api_key": "1234567890",
+            }
+        )
+        cls.notificame = cls.env["discuss_hub.connector"].create(
+            {
+                "name": "test_query_budget_notificame",
+                "type": "notificame",
+                "enabled": True,
+                "uuid": "11111111-1111-1111-1111-111111111122",
+                "url": "http://notificame.example.com",
+                "api_key": "1234567890",
+            }
+        )
+
+    def setUp(self):
+        super().setUp()
+        patcher = patch.object(
+            requests.Session, "request", side_effect=_provider_unreachable
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    # Evolution
+
+    def _evolution_upsert(self, message_id, message, remote_jid="5511911110000"):
+        return {
+            "event": "messages.upsert",
+            "instance": self.evolution.name,
+            "data": {
+                "key": {
+                    "remoteJid": f"{remote_jid}@s.whatsapp.net",
+                    "fromMe": False,
+                    "id": message_id,
+                },
+                "pushName": "Budget Contact",
+                "message": message,
+            },
+        }
+
+    def _evolution_conversation(self, message_id="BUDGET0"):
+        """Known contact with an open channel, the steady state"""
+        self.evolution.process_payload(
+            self._evolution_upsert(message_id, {"conversation": "first message"})
+        )
+
+    def test_evolution_text(self):
+        self._evolution_conversation()
+        response = self.replay(
+            "evolution_text",
+            self.evolution,
+            self._evolution_upsert("BUDGET1", {"conversation": "hello budget"}),
+        )
+        self.assertTrue(response["success"])
+
+    def test_evolution_image(self):
+        self._evolution_conversation()
+        response = self.replay(
+            "evolution_image",
+            self.evolution,
+            self._evolution_upsert(
+                "BUDGET2",
+                {
+                    "imageMessage": {"caption": "a pixel", "mimetype": "image/png"},
+                    "base64": PNG_BASE64,
+                },
+            ),
+        )
+        self.assertTrue(response["success"])
+
+    def test_evolution_reaction(self):
+        self._evolution_conversation()
+        self.replay(
+            "evolution_reaction",
+            self.evolution,
+            self._evolution_upsert(
+                "BUDGET3",
+                {
+                    "reactionMessage": {
+                        "key": {"id": "BUDGET0"},
+                        "text": "👍",
+                    }
+                },
+            ),
+        )
+
+    def test_evolution_read_receipt(self):
+        self._evolution_conversation()
+        response = self.replay(
+            "evolution_read_receipt",
+            self.evolution,
+            {
+                "event": "messages.update",
+                "instance": self.evolution.name,
+                "data": {
+                    "keyId": "BUDGET0",
+                    "remoteJid": "5511911110000@s.whatsapp.net",
+                    "status": "READ",
+                },
+            },
+        )
+        self.assertTrue(response["success"])
+
+    def test_evolution_delete(self):
+        self._evolution_conversation()
+        response = self.replay(
+            "evolution_delete",
+            self.evolution,
+            {
+                "event": "messages.delete",
+                "instance": self.evolution.name,
+                "data": {
+                    "id": "BUDGET0",
+                    "remoteJid": "5511911110000@s.whatsapp.net",
+                },
+            },
+        )
+        self.assertTrue(response["success"])
+
+    def test_evolution_contacts_upsert(self):
+        self.replay(
+            "evolution_contacts_upsert",
+            self.evolution,
+            {
+                "event": "contacts.upsert",
+                "instance": self.evolution.name,
+                "data": [
+                    {
+                        "remoteJid": f"551192222000{i}@s.whatsapp.net",
+                        "pushName": f"Budget Contact {i}",
+                    }
+                    for i in range(3)
+                ],
+            },
+        )
+
+    # WhatsApp Cloud
+
+    def _whatsapp_cloud_change(self, value):
+        return {
+            "object": "whatsapp_business_account",
+            "entry": [
+                {"id": "123", "changes": [{"field": "messages", "value": value}]}
+            ],
+        }
+
+    def _whatsapp_cloud_message(self, message_id, body):
+        return self._whatsapp_cloud_change(
+            {
+                "messaging_product": "whatsapp",
+                "contacts": [
+                    {"profile": {"name": "Budget Contact"}, "wa_id": "5511933330000"}
+                ],
+                "messages": [
+                    {
+                        "from": "5511933330000",
+                        "id": message_id,
+                        "type": "text",
+                        "text": {"body": body},
+                    }
+                ],
+            }
+        )
+
+    def test_whatsapp_cloud_message(self):
+        self.whatsapp_cloud.process_payload(
+            self._whatsapp_cloud_message("wamid.BUDGET0", "first message")
+        )
+        response = self.replay(
+            "whatsapp_cloud_message",
+            self.whatsapp_cloud,
+            self._whatsapp_cloud_message("wamid.BUDGET1", "hello budget"),
+        )
+        self.assertTrue(response["success"])
+
+    def test_whatsapp_cloud_status(self):
+        self.whatsapp_cloud.process_payload(
+            self._whatsapp_cloud_message("wamid.BUDGET0", "first message")
+        )
+        self.replay(
+            "whatsapp_cloud_status",
+            self.whatsapp_cloud,
+            self._whatsapp_cloud_change(
+                {
+                    "messaging_product": "whatsapp",
+                    "statuses": [
+                        {
+                            "id": "wamid.BUDGET0",
+                            "status": "read",
+                            "recipient_id": "5511933330000",
+                        }
+                    ],
+                }
+            ),
+        )
+
+    # Notificame
+
+    def _notificame_message(self, message_id, text):
+        return {
+            "id": message_id,
+            "type": "MESSAGE",
+            "message": {
+                "from": "5511944440000",
+                "channel": "whatsapp",
+                "visitor": {"name": "Budget Contact"},
+                "contents": [{"type": "text", "text": text}],
+            },
+        }
+
+    def test_notificame_message(self):
+        self.notificame.process_payload(
+            self._notificame_message("NM-BUDGET0", "first message")
+        )
+        response = self.replay(
+            "notificame_message",
+            self.notificame,
+            self._notificame_message("NM-BUDGET1", "hello budget"),
+        )
+        self.assertTrue(response["success"])
+
+    def test_statement_shapes(self):
+        """Literals and value lists are masked in the report"""
+        self.assertEqual(
+            statement_shape(
+                "SELECT id FROM res_partner\n  WHERE name = 'x' AND id IN (%s, %s, %s)"
+                " LIMIT 1"
+            ),
+            "SELECT id FROM res_partner WHERE name = ? AND id IN (...) LIMIT ?",
+        )
@@ -1,6 +1,14 @@
+from unittest.mock import patch
+
+from odoo import sql_db
 from odoo.tests import tagged
 from odoo.tests.common import HttpCase
 
+from odoo.addons.discuss_hub.models.bus_presence import (
+    get_presence_snapshot,
+    update_presence_snapshot,
+)
+
 
 @tagged("discuss_hub", "routing_manager")
 class TestBasePlugin(HttpCase):
@@ -91,3 +99,193 @@ class TestBasePlugin(HttpCase):
         assert (
             fourth_run.partner_id.id == first_partner.id
         ), f"Expected {first_partner.id}, got {fourth_run.id}"
+
+    def test_routing_manager_round_robin_skips_locked_members(self):
+        """
+        A running assignment does not block the next one. The cursors of a
+        test share one connection, so two real transactions are used, on
+        fixtures committed for the test and removed afterwards.
+        """
+        db = sql_db.db_connect(self.env.cr.dbname)
+        users = self.env.ref("base.user_admin") | self.env.ref("base.user_root")
+        with db.cursor() as cr:
+            cr.execute(
+                """
+                INSERT INTO discuss_hub_routing_team (name, routing_strategy, active)
+                VALUES ('Test Locked Team', 'round_robin', true)
+                RETURNING id
+                """
+            )
+            team_id = cr.fetchone()[0]
+            cr.execute(
+                """
+                INSERT INTO discuss_hub_routing_team_member
+                    (team_id, user_id, "order", count)
+                SELECT %s, id, id, 0 FROM res_users WHERE id = ANY(%s)
+                """,
+                (team_id, users.ids),
+            )
+        self.addCleanup(self._delete_committed_team, db, team_id)
+        team = self.env["discuss_hub.routing_team"].browse(team_id)
+        first, second = db.cursor(), db.cursor()
+        try:
+            first_user = team._assign_round_robin(first, users)
+            # fails instead of waiting for the member locked by first
+            second.execute("SET LOCAL lock_timeout = '2s'")
+            second_user = team._assign_round_robin(second, users)
+        finally:
+            for cr in (first, second):
+                cr.rollback()
+                cr.close()
+        self.assertEqual({first_user, second_user}, set(users.ids))
+
+    def _delete_committed_team(self, db, team_id):
+        with db.cursor() as cr:
+            cr.execute(
+                "DELETE FROM discuss_hub_routing_team_member WHERE team_id = %s",
+                (team_id,),
+            )
+            cr.execute("DELETE FROM discuss_hub_routing_team WHERE id = %s", (team_id,))
+
+    def test_routing_manager_least_busy_strategy(self):
+        """
+        Least busy routing follows the open conversations counters
+        """
+        team = self.env["discuss_hub.routing_team"].create(
+            {
+                "name": "Test Least Busy Team",
+                "routing_strategy": "least_busy",
+                "online_users_only": False,
+            }
+        )
+        users = self.env["res.users"].create(
+            [{"name": f"Busy User {i}", "login": f"busy_user{i}"} for i in range(1, 3)]
+        )
+        self.env["discuss_hub.routing_team_member"].create(
+            [{"team_id": team.id, "user_id": user.id} for user in users]
+        )
+        AgentLoad = self.env["discuss_hub.agent_load"]
+        channels = self.env["discuss.channel"].create(
+            [
+                {
+                    "name": f"Least Busy Channel {i}",
+                    "channel_type": "group",
+                    "discuss_hub_connector": self.connector.id,
+                }
+                for i in range(2)
+            ]
+        )
+        channels.add_members(users[0].partner_id.ids)
+        self.assertEqual(
+            AgentLoad.get_open_counts(users), {users[0].id: 2, users[1].id: 0}
+        )
+        self.assertEqual(team.get_next_team_member(), users[1])
+
+        channels[0].add_members(users[1].partner_id.ids)
+        channels[1].action_archive()
+        self.assertEqual(
+            AgentLoad.get_open_counts(users), {users[0].id: 1, users[1].id: 1}
+        )
+        channels[0].channel_member_ids.filtered(
+            lambda m: m.partner_id == users[0].partner_id
+        ).unlink()
+        self.assertEqual(team.get_next_team_member(), users[0])
+
+        channels[1].action_unarchive()
+        AgentLoad._recompute_loads()
+        self.assertEqual(
+            AgentLoad.get_open_counts(users), {users[0].id: 1, users[1].id: 1}
+        )
+
+    def test_routing_manager_presence_snapshot(self):
+        """
+        Online only teams read the worker presence snapshot
+        """
+        team = self.env["discuss_hub.routing_team"].create(
+            {"name": "Test Online Team", "online_users_only": True}
+        )
+        users = self.env["res.users"].create(
+            [
+                {"name": f"Online User {i}", "login": f"online_user{i}"}
+                for i in range(1, 3)
+            ]
+        )
+        self.env["discuss_hub.routing_team_member"].create(
+            [{"team_id": team.id, "user_id": user.id} for user in users]
+        )
+        get_presence_snapshot(self.env)
+        update_presence_snapshot(
+            self.env, {users[0].id: "online", users[1].id: "offline"}
+        )
+        self.assertEqual(team.available_users(), users[0])
+        update_presence_snapshot(self.env, {users[1].id: "online"})
+        self.assertEqual(team.available_users(), users)
+        with self.assertQueryCount(0):
+            get_presence_snapshot(self.env)
+
+    def test_bulk_archive_in_background(self):
+        """
+        Large archive selections run in batches by the bulk operations cron
+        """
+        channels = self.env["discuss.channel"].create(
+            [
+                {
+                    "name": f"Bulk Channel {i}",
+                    "channel_type": "group",
+                    "discuss_hub_connector": self.connector.id,
+                }
+                for i in range(5)
+            ]
+        )
+        wizard = self.env["discuss_hub.archive_manager"].create(
+            {
+                "channel_ids": [(6, 0, channels.ids)],
+                "close_message": "Bye",
+                "send_close_message": True,
+            }
+        )
+        module = "odoo.addons.discuss_hub.models.routing_manager"
+        with (
+            patch(f"{module}.BULK_INLINE_LIMIT", 3),
+            patch(f"{module}.BULK_BATCH_SIZE", 2),
+            patch(
+                "odoo.addons.discuss_hub.models.models.DiscussHubConnector.outgo_message"
+            ),
+        ):
+            action = wizard.action_archive()
+            self.assertEqual(action["tag"], "display_notification")
+            self.assertTrue(all(channels.mapped("active")))
+            operation = self.env["discuss_hub.bulk_operation"].search([], limit=1)
+            self.assertEqual(operation.state, "pending")
+            self.env["discuss_hub.bulk_operation"]._cron_process_bulk_operations()
+        self.assertEqual(operation.state, "done")
+        self.assertEqual(operation.progress, 100.0)
+        self.assertFalse(any(channels.mapped("active")))
+        self.assertNotIn(
+            self.env.user.partner_id, channels.channel_member_ids.partner_id
+        )
+        self.assertNotIn(self.env.user.partner_id, channels.message_partner_ids)
+        self.assertTrue(
+            all(
+                any("Bye" in body for body in channel.message_ids.mapped("body"))
+                for channel in channels
+            )
+        )
+
+    def test_bulk_archive_inline(self):
+        """
+        Small selections are archived in the wizard request
+        """
+        channel = self.env["discuss.channel"].create(
+            {
+                "name": "Inline Bulk Channel",
+                "channel_type": "group",
+                "discuss_hub_connector": self.connector.id,
+            }
+        )
+        wizard = self.env["discuss_hub.archive_manager"].create(
+            {"channel_ids": [(6, 0, channel.ids)], "send_close_message": False}
+        )
+        action = wizard.action_archive()
+        self.assertEqual(action, {"type": "ir.actions.act_window_close"})
+        self.assertFalse(channel.active)
@@ -0,0 +1,88 @@
+from unittest.mock import patch
+
+import requests
+
+from odoo.tests import tagged
+from odoo.tests.common import TransactionCase
+
+from odoo.addons.discuss_hub.models import wakeup
+
+
+@tagged("discuss_hub", "wakeup")
+class TestWakeup(TransactionCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.connector = cls.env["discuss_hub.connector"].create(
+            {
+                "name": "test_wakeup",
+                "type": "example",
+                "enabled": True,
+                "uuid": "11111111-1111-1111-1111-111111111128",
+                "url": "http://example.com",
+                "api_key": "1234567890",
+                "queue_inbound": True,
+            }
+        )
+        cls.cron = cls.env.ref("discuss_hub.ir_cron_discuss_hub_inbound")
+
+    def setUp(self):
+        super().setUp()
+        wakeup._listener_seen.clear()
+        self.addCleanup(wakeup._listener_seen.clear)
+        patcher = patch("requests.get", side_effect=requests.ConnectionError)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _triggers(self):
+        return self.env["ir.cron.trigger"].search_count(
+            [("cron_id", "=", self.cron.id)]
+        )
+
+    def _hold_listener_lock(self):
+        self.env.cr.execute("SELECT pg_try_advisory_lock(%s, %s)", wakeup.LISTENER_LOCK)
+        self.assertTrue(self.env.cr.fetchone()[0])
+        self.addCleanup(
+            self.env.cr.execute,
+            "SELECT pg_advisory_unlock(%s, %s)",
+            wakeup.LISTENER_LOCK,
+        )
+
+    def test_wake_triggers_cron_without_listener(self):
+        """Without a listener in the cluster the cron drains the queue"""
+        self.assertFalse(wakeup.listener_active(self.env.cr))
+        triggers = self._triggers()
+        wakeup.wake(self.env, "inbound", "discuss_hub.ir_cron_discuss_hub_inbound")
+        self.assertEqual(self._triggers(), triggers + 1)
+
+    def test_wake_notifies_listener(self):
+        """With a listener, new work is only signaled with pg_notify"""
+        self._hold_listener_lock()
+        self.assertTrue(wakeup.listener_active(self.env.cr))
+        triggers = self._triggers()
+        wakeup.wake(self.env, "inbound", "discuss_hub.ir_cron_discuss_hub_inbound")
+        self.assertEqual(self._triggers(), triggers)
+
+    def test_drain(self):
+        """A woken consumer processes its queue"""
+        self.env["discuss_hub.inbound_event"].enqueue(
+            self.connector,
+            [
+                {
+                    "message_id": "WAKE1",
+                    "message_type": "text",
+                    "message": "wake up",
+                    "contact_name": "Wakeup Contact",
+                    "contact_identifier": "5511988880000",
+                }
+            ],
+        )
+        wakeup.drain(self.env, "inbound")
+        event = self.env["discuss_hub.inbound_event"].search(
+            [("connector_id", "=", self.connector.id)]
+        )
+        self.assertEqual(event.state, "done")
+
+    def test_every_queue_can_be_drained(self):
+        for model, method in wakeup.QUEUES.values():
+            self.assertTrue(hasattr(self.env[model], method), f"{model}.{method}")
@@ -0,0 +1,123 @@
+from unittest.mock import patch
+
+import requests
+
+from odoo.tests import tagged
+from odoo.tests.common import TransactionCase
+
+from odoo.addons.discuss_hub.models import webhook_delivery
+
+
+@tagged("discuss_hub", "webhook_dedup")
+class TestWebhookDedup(TransactionCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.connector = cls.env["discuss_hub.connector"].create(
+            {
+                "name": "test_webhook_dedup",
+                "type": "evolution",
+                "enabled": True,
+                "uuid": "11111111-1111-1111-1111-111111111124",
+                "url": "http://evolution.example.com",
+                "api_key": "1234567890",
+            }
+        )
+
+    def setUp(self):
+        super().setUp()
+        webhook_delivery._recent.clear()
+        patcher = patch.object(
+            requests.Session, "request", side_effect=requests.ConnectionError
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _upsert(self, message_id):
+        return {
+            "event": "messages.upsert",
+            "instance": self.connector.name,
+            "data": {
+                "key": {
+                    "remoteJid": "5511966660000@s.whatsapp.net",
+                    "fromMe": False,
+                    "id": message_id,
+                },
+                "pushName": "Dedup Contact",
+                "message": {"conversation": "only once"},
+            },
+        }
+
+    def _messages(self, message_id):
+        return self.env["mail.message"].search(
+            [("discuss_hub_message_id", "=", message_id)]
+        )
+
+    def test_redelivery_is_acknowledged(self):
+        """A redelivered message is acknowledged and posted only once"""
+        first = self.connector.process_payload(self._upsert("DEDUP1"))
+        self.assertTrue(first["success"])
+        self.assertNotIn("duplicate", first)
+        with patch.object(
+            type(self.connector.get_plugin()), "get_or_create_partner"
+        ) as get_or_create_partner:
+            second = self.connector.process_payload(self._upsert("DEDUP1"))
+        get_or_create_partner.assert_not_called()
+        self.assertTrue(second["duplicate"])
+        self.assertEqual(len(self._messages("DEDUP1")), 1)
+        self.assertEqual(self.connector.webhook_duplicate_count, 1)
+
+    def test_redelivery_seen_by_another_worker(self):
+        """Without the worker memory, the unique delivery row catches it"""
+        self.connector.process_payload(self._upsert("DEDUP2"))
+        webhook_delivery._recent.clear()
+        response = self.connector.process_payload(self._upsert("DEDUP2"))
+        self.assertTrue(response["duplicate"])
+        self.assertEqual(len(self._messages("DEDUP2")), 1)
+        delivery = self.env["discuss_hub.webhook_delivery"].search(
+            [("connector_id", "=", self.connector.id), ("key", "=", "DEDUP2")]
+        )
+        self.assertEqual(delivery.hit_count, 1)
+
+    def test_remembered_only_once_committed(self):
+        """A delivery whose transaction did not commit is processed again"""
+        self.connector.process_payload(self._upsert("DEDUP5"))
+        self.assertFalse(webhook_delivery._recent)
+        # rolled back: not remembered, and its row is lost
+        self.env.cr.postcommit.clear()
+        self.env["discuss_hub.webhook_delivery"].search(
+            [("key", "=", "DEDUP5")]
+        ).unlink()
+        response = self.connector.process_payload(self._upsert("DEDUP5"))
+        self.assertNotIn("duplicate", response)
+
+    def test_remembered_redelivery_skips_the_database(self):
+        """A redelivery seen by this worker is answered without a query"""
+        self.connector.process_payload(self._upsert("DEDUP6"))
+        self.env.cr.postcommit.run()
+        self.assertTrue(webhook_delivery._recent)
+        Delivery = self.env["discuss_hub.webhook_delivery"]
+        with self.assertQueryCount(0):
+            self.assertFalse(
+                Delivery.claim(self.connector, "messages.upsert", "DEDUP6")
+            )
+
+    def test_receipt_status_is_part_of_the_key(self):
+        """Each status of a message is processed once"""
+        plugin = self.connector.get_plugin()
+        payload = {
+            "event": "messages.update",
+            "data": {"keyId": "DEDUP3", "status": "DELIVERY_ACK"},
+        }
+        self.assertEqual(plugin.get_dedup_key(payload), "DEDUP3:DELIVERY_ACK")
+        payload["data"]["status"] = "READ"
+        self.assertEqual(plugin.get_dedup_key(payload), "DEDUP3:READ")
+        self.assertIsNone(plugin.get_dedup_key({"event": "connection.update"}))
+
+    def test_dedup_disabled(self):
+        """dedup_webhooks off processes every delivery"""
+        self.connector.dedup_webhooks = False
+        self.connector.process_payload(self._upsert("DEDUP4"))
+        response = self.connector.process_payload(self._upsert("DEDUP4"))
+        self.assertNotIn("duplicate", response)
+        self.assertFalse(self.env["discuss_hub.webhook_delivery"].search_count([]))
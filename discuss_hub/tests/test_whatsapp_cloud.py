@@ -0,0 +1,119 @@
+import base64
+from unittest.mock import MagicMock
+
+from odoo.tests import tagged
+from odoo.tests.common import TransactionCase
+
+
+@tagged("discuss_hub", "plugin_whatsapp_cloud")
+class TestWhatsappCloudMediaCache(TransactionCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.connector = cls.env["discuss_hub.connector"].create(
+            {
+                "name": "test_whatsapp_cloud",
+                "type": "whatsapp_cloud",
+                "enabled": True,
+                "uuid": "11111111-1111-1111-1111-111111111113",
+                "url": "http://graph.example.com/v1/123",
+                "api_key": "1234567890",
+            }
+        )
+        cls.channel = cls.env["discuss.channel"].create(
+            {
+                "name": "Test Whatsapp Cloud Channel",
+                "discuss_hub_connector": cls.connector.id,
+                "discuss_hub_outgoing_destination": "5511999999999",
+                "channel_type": "group",
+            }
+        )
+
+    def _post_with_attachment(self):
+        attachment = self.env["ir.attachment"].create(
+            {
+                "name": "catalogue.pdf",
+                "datas": base64.b64encode(b"same catalogue content"),
+                "mimetype": "application/pdf",
+            }
+        )
+        # create the message directly so the outgo automation is not triggered
+        return self.env["mail.message"].create(
+            {
+                "model": "discuss.channel",
+                "res_id": self.channel.id,
+                "body": "catalogue",
+                "attachment_ids": [(6, 0, attachment.ids)],
+            }
+        )
+
+    def _mock_session(self, plugin, send_status_codes):
+        """Mock the session: /media returns ids, /messages given status codes"""
+        uploads = []
+        send_status_codes = list(send_status_codes)
+
+        def post(url, **kwargs):
+            response = MagicMock()
+            if url.endswith("media/"):
+                uploads.append(url)
+                response.json.return_value = {"id": f"media-{len(uploads)}"}
+            else:
+                response.status_code = send_status_codes.pop(0)
+                response.json.return_value = {"messages": [{"id": "wamid.1"}]}
+            return response
+
+        plugin.session = MagicMock()
+        plugin.session.post.side_effect = post
+        return uploads
+
+    def test_repeated_attachment_reuses_media_id(self):
+        """The same file is uploaded once and its media id reused"""
+        plugin = self.connector.get_plugin()
+        uploads = self._mock_session(plugin, [200, 200])
+
+        plugin.send_attachments(self.channel, self._post_with_attachment())
+        plugin.send_attachments(self.channel, self._post_with_attachment())
+
+        self.assertEqual(len(uploads), 1, "Identical media should be uploaded once")
+        cached = self.env["discuss_hub.connector.media"].search(
+            [("connector_id", "=", self.connector.id)]
+        )
+        self.assertEqual(cached.media_id, "media-1")
+
+    def test_rejected_cached_media_is_uploaded_again(self):
+        """A cached media id rejected by Graph is dropped and uploaded again"""
+        plugin = self.connector.get_plugin()
+        uploads = self._mock_session(plugin, [200, 400, 200])
+
+        plugin.send_attachments(self.channel, self._post_with_attachment())
+        response = plugin.send_attachments(self.channel, self._post_with_attachment())
+
+        self.assertTrue(response)
+        self.assertEqual(len(uploads), 2)
+        cached = self.env["discuss_hub.connector.media"].search(
+            [("connector_id", "=", self.connector.id)]
+        )
+        self.assertEqual(cached.media_id, "media-2")
+
+    def test_cache_disabled(self):
+        """With zero cache days every send uploads the file"""
+        self.connector.whatsapp_cloud_media_cache_days = 0
+        plugin = self.connector.get_plugin()
+        uploads = self._mock_session(plugin, [200, 200])
+
+        plugin.send_attachments(self.channel, self._post_with_attachment())
+        plugin.send_attachments(self.channel, self._post_with_attachment())
+
+        self.assertEqual(len(uploads), 2)
+
+    def test_signed_url_mode_skips_upload(self):
+        """In signed url mode Graph gets a link and nothing is uploaded"""
+        self.connector.outbound_media_mode = "url"
+        plugin = self.connector.get_plugin()
+        uploads = self._mock_session(plugin, [200])
+
+        plugin.send_attachments(self.channel, self._post_with_attachment())
+
+        self.assertFalse(uploads)
+        sent_payload = plugin.session.post.call_args.kwargs["json"]
+        self.assertIn("/discuss_hub/media/", sent_payload["image"]["link"])